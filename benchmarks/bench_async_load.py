@@ -0,0 +1,96 @@
+"""
+Many notebook opens at once with a small request ticking alongside. MetaManager
+called straight from the event loop vs AsyncMetaManager. Reports the wall time
+of the opens and the latency of the small requests (file_exists on a txt file).
+
+python -m benchmarks.bench_async_load [opens] [size_mb]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import nbformat
+
+from nbx_deux.async_manager import AsyncMetaManager
+from nbx_deux.meta_manager import MetaManager
+from nbx_deux.testing import TempDir
+from benchmarks.bench_model_to_dict import make_large_notebook
+
+
+def stage(td, notebooks, size_mb):
+    root = td.joinpath('work')
+    root.mkdir()
+    root.joinpath('small.txt').write_text('hi')
+    nb = make_large_notebook(size_mb)
+    for i in range(notebooks):
+        with root.joinpath(f'nb_{i}.ipynb').open('w') as f:
+            nbformat.write(nb, f)
+    return root
+
+
+async def call(meta, method, *args, **kwargs):
+    result = method(*args, **kwargs)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
+
+
+async def load(meta, opens, notebooks):
+    latencies = []
+    done = asyncio.Event()
+
+    async def small_requests():
+        # timed from when the request is due, so time spent waiting on a
+        # blocked loop counts
+        while not done.is_set():
+            due = time.perf_counter() + 0.005
+            await asyncio.sleep(0.005)
+            await call(meta, meta.file_exists, 'work/small.txt')
+            latencies.append(time.perf_counter() - due)
+
+    async def open_notebook(i):
+        # let the ticker in between opens like separate requests would
+        await asyncio.sleep(0)
+        await call(meta, meta.get, f'work/nb_{i % notebooks}.ipynb')
+
+    ticker = asyncio.create_task(small_requests())
+    await asyncio.sleep(0.02)
+    start = time.perf_counter()
+    await asyncio.gather(*[open_notebook(i) for i in range(opens)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticker
+    return elapsed, latencies
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def main(opens=64, size_mb=2):
+    notebooks = 16
+    with TempDir() as td:
+        root = stage(td, notebooks, size_mb)
+        print(f"{opens} opens of {size_mb}MB notebooks ({notebooks} files)")
+        runs = [
+            ('sync', MetaManager(bundle_dirs={'work': str(root)})),
+            ('async', AsyncMetaManager(bundle_dirs={'work': str(root)})),
+        ]
+        for label, meta in runs:
+            # warm up the notary / trust cache so both runs see the same state
+            asyncio.run(load(meta, notebooks, notebooks))
+            elapsed, latencies = asyncio.run(load(meta, opens, notebooks))
+            p50 = percentile(latencies, 50) * 1000
+            p99 = percentile(latencies, 99) * 1000
+            print(
+                f"{label:>6}: opens {elapsed * 1000:9.2f} ms  "
+                f"small p50 {p50:8.2f} ms  p99 {p99:8.2f} ms  ({len(latencies)} ticks)"
+            )
+            meta.stop_watchers()
+
+
+if __name__ == '__main__':
+    opens = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    size_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    main(opens, size_mb)
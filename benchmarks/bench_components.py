@@ -0,0 +1,50 @@
+"""
+NBXNotebookExport.components on an image heavy notebook. Deepcopy of the
+whole notebook vs only copying the notebook / cell dicts.
+
+python -m benchmarks.bench_components [size_mb]
+"""
+import copy
+import sys
+
+from nbformat import NotebookNode
+
+from nbx_deux.nbx_convert import NBXCellExport
+from nbx_deux.normalized_notebook import NBXNotebookExport
+from benchmarks.bench_model_to_dict import make_large_notebook, measure
+
+
+def components_deepcopy(nb):
+    """components as it was, deepcopy then pop source / outputs."""
+    skeleton = copy.deepcopy(nb)
+    source_cells = {}
+    all_outputs = {}
+    for cell in skeleton['cells']:
+        source_cells[cell['id']] = NBXCellExport(NotebookNode({
+            'id': cell['id'],
+            'cell_type': cell['cell_type'],
+            'source': cell.pop('source'),
+            'metadata': cell['metadata'],
+        }), 'python')
+        if outputs := cell.pop('outputs', None):
+            cell['outputs'] = [{'output_type': output['output_type']} for output in outputs]
+            all_outputs[cell['id']] = outputs
+    return skeleton, source_cells, all_outputs
+
+
+def main(size_mb=50):
+    nb = make_large_notebook(size_mb)
+    print(f"components on {size_mb}MB notebook ({len(nb.cells)} cells)")
+
+    runs = [
+        ('deepcopy', lambda: components_deepcopy(nb)),
+        ('shared', lambda: NBXNotebookExport(nb).components),
+    ]
+    for label, func in runs:
+        elapsed, peak = measure(func)
+        print(f"{label:>9}: {elapsed * 1000:9.2f} ms  peak {peak / 1024:10.1f} KiB")
+
+
+if __name__ == '__main__':
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    main(size_mb)
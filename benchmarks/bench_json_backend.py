@@ -0,0 +1,68 @@
+"""
+Notebook read/write throughput: nbformat vs each nbjson backend.
+
+python -m benchmarks.bench_json_backend [size_mb]
+"""
+import sys
+import time
+
+import nbformat
+from nbformat import v4
+
+from nbx_deux.nbjson import available_backends, get_backend
+from benchmarks.bench_model_to_dict import make_large_notebook
+
+
+def make_text_notebook(cells=2000, lines=50):
+    """
+    Lots of short source and stream lines. Stresses split_lines and indentation
+    rather than raw string copying.
+    """
+    nb = v4.new_notebook()
+    for i in range(cells):
+        source = '\n'.join(f'x_{i}_{j} = {j} * 2.5  # comment' for j in range(lines))
+        output = v4.new_output('stream', name='stdout', text=source)
+        cell = v4.new_code_cell(source, outputs=[output], execution_count=i)
+        cell.metadata['tags'] = ['a', 'b']
+        nb.cells.append(cell)
+    return nb
+
+
+def best_of(func, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def report(label, op, elapsed, size):
+    mb_s = size / elapsed / 1024 / 1024
+    print(f"{label:>9} {op:>5}: {elapsed * 1000:9.2f} ms  {mb_s:8.1f} MB/s")
+
+
+def run(label, nb):
+    data = nbformat.writes(nb).encode('utf-8') + b'\n'
+    size = len(data)
+    print(f"{label}: {size / 1024 / 1024:.1f}MB notebook ({len(nb.cells)} cells)")
+
+    read_nbformat = best_of(lambda: nbformat.reads(data.decode('utf-8'), as_version=4))
+    report('nbformat', 'read', read_nbformat, size)
+    report('nbformat', 'write', best_of(lambda: nbformat.writes(nb).encode('utf-8')), size)
+
+    for name in available_backends():
+        backend = get_backend(name)
+        assert backend.writes_notebook(nb) == data
+        report(name, 'read', best_of(lambda: backend.reads_notebook(data)), size)
+        report(name, 'write', best_of(lambda: backend.writes_notebook(nb)), size)
+
+
+def main(size_mb=50):
+    run('outputs', make_large_notebook(size_mb, cells=size_mb * 20))
+    run('text', make_text_notebook(cells=size_mb * 40))
+
+
+if __name__ == '__main__':
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    main(size_mb)
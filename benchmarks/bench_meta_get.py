@@ -0,0 +1,58 @@
+"""
+What MetaManager.get adds on top of the submanager: asdict(share=True) plus
+re-anchoring paths vs anchored_model_dict. Large listing and large notebook.
+
+python -m benchmarks.bench_meta_get [children] [size_mb]
+"""
+import os
+import sys
+from datetime import datetime
+
+from nbx_deux.models import DirectoryModel, FileModel, NotebookModel, anchored_model_dict
+from benchmarks.bench_model_to_dict import make_large_notebook, measure
+
+
+def asdict_reanchor(model, nbm_path):
+    """MetaManager.get as it was."""
+    model = model.asdict(share=True)
+    if model['type'] == 'directory':
+        for m in model.get('content') or []:
+            m['path'] = os.path.join(nbm_path, m['path'])
+    if model['type'] == 'notebook':
+        model['path'] = os.path.join(nbm_path, model['path'])
+    return model
+
+
+def make_listing(children):
+    now = datetime.now()
+    content = [
+        FileModel(
+            name=f'file_{i}.txt', path=f'data/file_{i}.txt', last_modified=now,
+            created=now, size=i, writable=True, mimetype='text/plain',
+        )
+        for i in range(children)
+    ]
+    return DirectoryModel.transient('data', content=content, format='json')
+
+
+def main(children=10_000, size_mb=50):
+    listing = make_listing(children)
+    nb = make_large_notebook(size_mb)
+    notebook = NotebookModel.from_nbnode(nb, name='big.ipynb', path='big.ipynb')
+
+    cases = [(f'{children} child listing', listing), (f'{size_mb}MB notebook', notebook)]
+    for label, model in cases:
+        print(label)
+        runs = [
+            ('asdict', lambda: asdict_reanchor(model, 'alias')),
+            ('anchored', lambda: anchored_model_dict(model, 'alias')),
+        ]
+        for name, func in runs:
+            elapsed, peak = measure(func)
+            print(f"{name:>9}: {elapsed * 1000:9.2f} ms  peak {peak / 1024:10.1f} KiB")
+
+
+if __name__ == '__main__':
+    children = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    size_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    main(children, size_mb)
@@ -0,0 +1,59 @@
+"""
+model_to_dict on a large notebook. Copying vs share=True.
+
+python -m benchmarks.bench_model_to_dict [size_mb]
+"""
+import base64
+import os
+import sys
+import time
+import tracemalloc
+
+from nbformat import v4
+
+from nbx_deux.models import NotebookModel, model_to_dict
+
+
+def make_large_notebook(size_mb=50, cells=200):
+    """
+    Notebook with image outputs totalling roughly size_mb of base64.
+    """
+    payload_size = size_mb * 1024 * 1024 // cells
+    nb = v4.new_notebook()
+    for i in range(cells):
+        png = base64.b64encode(os.urandom(payload_size * 3 // 4)).decode('ascii')
+        output = v4.new_output(
+            'display_data',
+            data={'image/png': png, 'text/plain': f'<Figure {i}>'},
+        )
+        cell = v4.new_code_cell(f'plot({i})', outputs=[output], execution_count=i)
+        nb.cells.append(cell)
+    return nb
+
+
+def measure(func, repeat=3):
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def main(size_mb=50):
+    nb = make_large_notebook(size_mb)
+    model = NotebookModel.from_nbnode(nb, name='big.ipynb', path='big.ipynb')
+
+    print(f"model_to_dict on {size_mb}MB notebook ({len(nb.cells)} cells)")
+    for label, share in [('copy', False), ('share', True)]:
+        elapsed, peak = measure(lambda: model_to_dict(model, share=share))
+        print(f"{label:>6}: {elapsed * 1000:9.2f} ms  peak {peak / 1024:10.1f} KiB")
+
+
+if __name__ == '__main__':
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    main(size_mb)
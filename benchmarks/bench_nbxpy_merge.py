@@ -0,0 +1,60 @@
+"""
+Cost of merging an edited _nbx extract back into its notebook.
+
+python -m benchmarks.bench_nbxpy_merge [cells ...]
+"""
+import copy
+import sys
+
+from nbformat import v4
+
+from nbx_deux.normalized_notebook import NBXNotebookExport, merge_nbxpy, nbxpy_cell_chunks
+from benchmarks.bench_json_backend import best_of
+
+
+def make_source_notebook(cells=1000, lines=10):
+    nb = v4.new_notebook()
+    for i in range(cells):
+        if i % 5 == 0:
+            source = f'## Section {i}\n\nSome notes about step {i}.'
+            cell = v4.new_markdown_cell(source, id=f'cell-{i}')
+        else:
+            source = '\n'.join(f'x_{i}_{j} = {j} * 2' for j in range(lines))
+            cell = v4.new_code_cell(source, id=f'cell-{i}')
+        nb.cells.append(cell)
+    return nb
+
+
+def edit_extract(text, cells, edits=10):
+    for i in range(1, cells, max(cells // edits, 1)):
+        if i % 5:
+            text = text.replace(f'x_{i}_0 = 0 * 2', f'x_{i}_0 = 0 * 3', 1)
+    return text
+
+
+def run(cells):
+    nb = make_source_notebook(cells)
+    text = NBXNotebookExport(nb).to_pyfile()
+    edited = edit_extract(text, cells)
+    print(f"{cells} cells, {len(text) / 1024:.0f} KiB extract")
+
+    timings = [
+        ('export', lambda: NBXNotebookExport(nb).to_pyfile()),
+        ('parse', lambda: nbxpy_cell_chunks(text)),
+        ('merge unedited', lambda: merge_nbxpy(copy.deepcopy(nb), text)),
+        ('merge 10 edits', lambda: merge_nbxpy(copy.deepcopy(nb), edited)),
+        ('deepcopy', lambda: copy.deepcopy(nb)),
+    ]
+    for label, func in timings:
+        elapsed = best_of(func)
+        print(f"{label:>16}: {elapsed * 1000:9.2f} ms")
+
+
+def main(sizes=(1000, 5000)):
+    for cells in sizes:
+        run(cells)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or (1000, 5000)
+    main(sizes)
@@ -0,0 +1,45 @@
+"""
+nbxpy_to_cells against the old reader loop that copied the rest of the file
+for every cell.
+
+python -m benchmarks.bench_nbxpy_parse [cells ...]
+"""
+import sys
+
+from nbx_deux.nbx_convert import NBXCellScriptCellReader
+from nbx_deux.normalized_notebook import NBXNotebookExport, nbxpy_to_cells
+from benchmarks.bench_json_backend import best_of
+from benchmarks.bench_nbxpy_merge import make_source_notebook
+
+
+def nbxpy_to_cells_sliced(content):
+    reader = NBXCellScriptCellReader({})
+    lines = content.split('\n')
+    cells = []
+    offset = 0
+    while offset < len(lines):
+        new_cell, pos_next_cell = reader.read(lines[offset:])
+        cells.append(new_cell)
+        offset += pos_next_cell
+    return cells
+
+
+def run(cells):
+    text = NBXNotebookExport(make_source_notebook(cells)).to_pyfile()
+    nlines = text.count('\n') + 1
+    print(f"{cells} cells, {nlines} lines")
+
+    assert nbxpy_to_cells(text) == nbxpy_to_cells_sliced(text)
+    for label, func in [('sliced', nbxpy_to_cells_sliced), ('window', nbxpy_to_cells)]:
+        elapsed = best_of(lambda: func(text), repeat=1)
+        print(f"{label:>8}: {elapsed * 1000:10.2f} ms  {elapsed / cells * 1e6:8.1f} us/cell")
+
+
+def main(sizes=(1000, 10000)):
+    for cells in sizes:
+        run(cells)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or (1000, 10000)
+    main(sizes)
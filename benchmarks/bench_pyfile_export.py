@@ -0,0 +1,48 @@
+"""
+Percent format export of a large notebook: no cache, cold cache and a warm
+cache after a one cell edit.
+
+python -m benchmarks.bench_pyfile_export [cells ...]
+"""
+import sys
+
+from nbx_deux.normalized_notebook import NBXNotebookExport, PyCellCache
+from benchmarks.bench_json_backend import best_of
+from benchmarks.bench_nbxpy_merge import make_source_notebook
+
+
+def run(cells):
+    nb = make_source_notebook(cells)
+    expected = NBXNotebookExport(nb, cache=None).to_pyfile()
+    print(f"{cells} cells, {len(expected) / 1024:.0f} KiB extract")
+
+    def cold():
+        return NBXNotebookExport(nb, cache=PyCellCache()).to_pyfile()
+
+    cache = PyCellCache(maxsize=cells * 2)
+    NBXNotebookExport(nb, cache=cache).to_pyfile()
+    edits = iter(range(10**9))
+
+    def warm_edit():
+        nb.cells[1].source = f'x = {next(edits)}'
+        return NBXNotebookExport(nb, cache=cache).to_pyfile()
+
+    assert warm_edit() == NBXNotebookExport(nb, cache=None).to_pyfile()
+    timings = [
+        ('no cache', lambda: NBXNotebookExport(nb, cache=None).to_pyfile()),
+        ('cold', cold),
+        ('1 cell edit', warm_edit),
+    ]
+    for label, func in timings:
+        elapsed = best_of(func)
+        print(f"{label:>12}: {elapsed * 1000:9.2f} ms")
+
+
+def main(sizes=(1000, 5000)):
+    for cells in sizes:
+        run(cells)
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or (1000, 5000)
+    main(sizes)
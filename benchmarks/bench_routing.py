@@ -0,0 +1,78 @@
+"""
+MetaManager request routing. The old split / dataclass per call against the
+alias trie, with and without the resolution cache.
+
+python -m benchmarks.bench_routing [calls]
+"""
+import dataclasses as dc
+import functools
+import os
+import sys
+
+from nbx_deux.meta_manager import AliasRouter
+from benchmarks.bench_json_backend import best_of
+
+
+@dc.dataclass(kw_only=True)
+class OldManagerMeta:
+    request_path: str
+    nbm_path: str
+    path: str
+
+
+def route_split(managers, path):
+    """get_nbm_from_path as it was."""
+    path = path.strip('/')
+    if not path:
+        return None, OldManagerMeta(request_path=path, nbm_path='', path='')
+    bits = path.split(os.sep)
+    nbm_path = bits.pop(0)
+    meta = OldManagerMeta(request_path=path, nbm_path=nbm_path, path=os.sep.join(bits))
+    nbm = managers.get(nbm_path, None)
+    if nbm is None:
+        raise Exception(f"Could not find {nbm_path=} {path=}")
+    return nbm, meta
+
+
+def make_paths(aliases, count=2000):
+    paths = []
+    for i in range(count):
+        alias = aliases[i % len(aliases)]
+        paths.append(f"/{alias}/project_{i % 50}/analysis/notebook_{i}.ipynb")
+    return paths
+
+
+def main(calls=200_000):
+    aliases = [f"alias{i}" for i in range(20)]
+    managers = {alias: object() for alias in aliases}
+    router = AliasRouter(managers)
+    cached = functools.lru_cache(maxsize=4096)(router.resolve)
+
+    def route_cached(path):
+        # MetaManager.get_nbm_from_path
+        meta = cached(path)
+        return managers[meta.nbm_path], meta
+    paths = make_paths(aliases)
+    # the same handful of open notebooks get autosaved / polled over and over
+    hot = (paths[:200] * (calls // 200 + 1))[:calls]
+    print(f"{calls} routes over {len(set(hot))} paths, {len(aliases)} aliases")
+
+    def run(func):
+        def loop():
+            for path in hot:
+                func(path)
+        return loop
+
+    runs = [
+        ('split', run(functools.partial(route_split, managers))),
+        ('trie', run(router.resolve)),
+        ('trie+cache', run(route_cached)),
+    ]
+    for label, func in runs:
+        elapsed = best_of(func)
+        print(f"{label:>11}: {elapsed * 1000:8.2f} ms  {calls / elapsed / 1e6:6.2f} M routes/s")
+
+
+if __name__ == '__main__':
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    main(calls)
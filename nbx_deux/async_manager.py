@@ -0,0 +1,308 @@
+"""
+AsyncContentsManager versions of the NBX managers.
+
+The sync managers do their filesystem work inside each call, which on the
+server's event loop means one slow NFS stat or large notebook read stalls
+every other request. These run that work on a bounded thread pool instead.
+
+AsyncBundleContentsManager wraps a BundleContentsManager rather than
+subclassing it, since the sync manager calls its own get / is_bundle etc.
+internally. Directory listings build their child models in concurrent batches.
+
+AsyncMetaManager routes like MetaManager. Its submanagers can be sync or
+async: coroutine methods are awaited, anything else runs on the pool.
+
+Settings of the wrapped managers still come from c.BundleContentsManager /
+c.MetaManager.
+"""
+import asyncio
+import functools
+import inspect
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from jupyter_server.services.contents.manager import AsyncContentsManager
+from jupyter_server.utils import ApiPath
+from tornado.web import HTTPError
+from traitlets import Integer, Unicode, default
+
+from nbx_deux.bundle_manager.bundle import bundle_get_path_item
+from nbx_deux.bundle_manager.bundle_nbmanager import BundleContentsManager
+from nbx_deux.meta_manager import MetaManager
+from nbx_deux.models import anchored_model_dict
+
+
+async def call_manager(method, *args, executor=None, **kwargs):
+    """
+    Call a contents manager method whether it's sync or async. Sync methods
+    run on executor (None is the loop's default).
+    """
+    if inspect.iscoroutinefunction(method):
+        return await method(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(method, *args, **kwargs))
+
+
+class AsyncBundleContentsManager(AsyncContentsManager):
+    root_dir = Unicode(config=True)
+    max_workers = Integer(
+        8,
+        config=True,
+        help="Threads for filesystem work when not given an executor.",
+    )
+    listing_batch_size = Integer(
+        64,
+        config=True,
+        help="Directory children classified and modeled per pool task.",
+    )
+
+    @default("root_dir")
+    def _default_root_dir(self):
+        try:
+            return self.parent.root_dir  # type: ignore
+        except AttributeError:
+            return os.getcwd()
+
+    def __init__(
+        self,
+        *args,
+        manager: BundleContentsManager | None = None,
+        executor=None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if manager is None:
+            manager = BundleContentsManager(parent=self, log=self.log, root_dir=self.root_dir)
+        else:
+            self.root_dir = manager.root_dir
+        self.manager = manager
+        self._executor = executor
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='nbx-async',
+            )
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def run_quick(self, func, *args, **kwargs):
+        """
+        Stat sized calls go on the loop's default executor so they don't queue
+        behind notebook reads on ours.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    # ContentManager API
+    async def get(self, path, content=True, type=None, format=None):
+        nbm = self.manager
+        self.bind_loop()
+        if content and type in (None, 'directory'):
+            os_path = nbm._get_os_path(path=path)
+            path_item = await self.run(bundle_get_path_item, os_path)
+            if path_item.type == 'directory':
+                model = await self.run(nbm.get_dir, path, content=False)
+                model.content = await self.get_dir_content(os_path, model.path)
+                model.format = 'json'
+                return model
+        return await self.run(nbm.get, path, content=content, type=type, format=format)
+
+    async def get_dir_content(self, os_dir, path):
+        """
+        BundleContentsManager.get_dir_content with the entries classified and
+        modeled in concurrent batches.
+        """
+        nbm = self.manager
+        dir_st, contents, entries = await self.run(nbm.scan_dir_entries, os_dir, path)
+        if contents is not None:
+            return contents
+
+        size = self.listing_batch_size
+        batches = [entries[i:i + size] for i in range(0, len(entries), size)]
+        results = await asyncio.gather(*[
+            self.run(nbm.dir_entry_models, path, batch) for batch in batches
+        ])
+        listed = [item for items, _ in results for item in items]
+        contents = [model for _, models in results for model in models]
+        if nbm.index is not None:
+            await self.run(nbm.record_dir_listing, path, dir_st, listed, contents)
+        return contents
+
+    async def save(self, model, path):
+        self.bind_loop()
+        return await self.run(self.manager.save, model, path)
+
+    async def delete_file(self, path):
+        return await self.run(self.manager.delete_file, path)
+
+    async def rename_file(self, old_path, new_path):
+        return await self.run(self.manager.rename_file, old_path, new_path)
+
+    async def file_exists(self, path=''):
+        return await self.run_quick(self.manager.file_exists, path)
+
+    async def dir_exists(self, path):
+        return await self.run_quick(self.manager.dir_exists, path)
+
+    async def is_hidden(self, path):
+        return await self.run_quick(self.manager.is_hidden, path)
+
+    # events are emitted here, on the loop, not from the pool
+    async def delete(self, path):
+        path = path.strip('/')
+        if not path:
+            raise HTTPError(400, "Can't delete root")
+        await self.run(self.manager.delete_file, path)
+        await self.run(self.manager.delete_all_checkpoints, path)
+        self.emit(data={"action": "delete", "path": path})
+
+    async def rename(self, old_path, new_path):
+        await self.run(self.manager.rename_file, old_path, new_path)
+        await self.run(self.manager.rename_all_checkpoints, old_path, new_path)
+        self.emit(data={"action": "rename", "path": new_path, "source_path": old_path})
+
+    def get_kernel_path(self, path, model=None):
+        return self.manager.get_kernel_path(path, model)
+
+    # Checkpoints api
+    async def create_checkpoint(self, path):
+        return await self.run(self.manager.create_checkpoint, path)
+
+    async def list_checkpoints(self, path):
+        return await self.run(self.manager.list_checkpoints, path)
+
+    async def restore_checkpoint(self, checkpoint_id, path):
+        return await self.run(self.manager.restore_checkpoint, checkpoint_id, path)
+
+    async def delete_checkpoint(self, checkpoint_id, path):
+        return await self.run(self.manager.delete_checkpoint, checkpoint_id, path)
+
+    def bind_loop(self, loop=None):
+        # the wrapped manager only runs on our pool, it never sees the loop
+        if self.manager.watcher is not None:
+            self.manager.bind_loop(loop)
+
+    def stop_watcher(self):
+        self.manager.stop_watcher()
+
+
+class AsyncMetaManager(MetaManager, AsyncContentsManager):
+    max_workers = Integer(
+        8,
+        config=True,
+        help="Threads for filesystem work, shared by the bundle_dirs managers.",
+    )
+    listing_batch_size = Integer(
+        64,
+        config=True,
+        help="AsyncBundleContentsManager.listing_batch_size",
+    )
+
+    _executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='nbx-async',
+            )
+        return self._executor
+
+    def new_submanager(self, alias, path):
+        return AsyncBundleContentsManager(
+            manager=super().new_submanager(alias, path),
+            executor=self.executor,
+            listing_batch_size=self.listing_batch_size,
+            log=self.log,
+        )
+
+    async def call(self, method, *args, **kwargs):
+        return await call_manager(method, *args, executor=self.executor, **kwargs)
+
+    async def call_quick(self, method, *args, **kwargs):
+        # see AsyncBundleContentsManager.run_quick
+        return await call_manager(method, *args, executor=None, **kwargs)
+
+    def _same_nbm(self, old_path, new_path):
+        nbm, meta = self.get_nbm_from_path(old_path)
+        _new_nbm, new_meta = self.get_nbm_from_path(new_path)
+        if nbm is not _new_nbm:
+            raise Exception("Cannot rename across child content managers")
+        return nbm, meta, new_meta
+
+    # ContentManager API
+    async def get(self, path: ApiPath, content=True, type=None, format=None):
+        self.bind_loop()
+        nbm, meta = self.get_nbm_from_path(path)
+        # the root listing waits on the submanagers, which may need this
+        # executor. keep it off of it.
+        executor = None if nbm is self.root else self.executor
+        model = await call_manager(
+            nbm.get, meta.path, content=content, type=type, format=format, executor=executor,
+        )
+        return anchored_model_dict(model, meta.nbm_path)
+
+    async def save(self, model, path: ApiPath):
+        self.bind_loop()
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call(nbm.save, model, meta.path)
+
+    async def delete_file(self, path: ApiPath):
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call(nbm.delete_file, meta.path)
+
+    async def rename_file(self, old_path: ApiPath, new_path: ApiPath):
+        nbm, meta, new_meta = self._same_nbm(old_path, new_path)
+        return await self.call(nbm.rename_file, meta.path, new_meta.path)
+
+    async def file_exists(self, path: ApiPath = '') -> bool:
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call_quick(nbm.file_exists, meta.path)
+
+    async def dir_exists(self, path: ApiPath) -> bool:
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call_quick(nbm.dir_exists, meta.path)
+
+    async def is_hidden(self, path: ApiPath) -> bool:
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call_quick(nbm.is_hidden, meta.path)
+
+    # ContentManager API 2
+    async def delete(self, path: ApiPath):
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call(nbm.delete, meta.path)
+
+    async def rename(self, old_path, new_path):
+        nbm, meta, new_meta = self._same_nbm(old_path, new_path)
+        return await self.call(nbm.rename, meta.path, new_meta.path)
+
+    async def update(self, model, path):
+        path = path.strip("/")
+        new_path = model.get("path", path).strip("/")
+        if path != new_path:
+            await self.rename(path, new_path)
+        return await self.get(new_path, content=False)
+
+    # Checkpoints api
+    async def create_checkpoint(self, path: ApiPath):
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call(nbm.create_checkpoint, meta.path)
+
+    async def list_checkpoints(self, path: ApiPath):
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call(nbm.list_checkpoints, meta.path)
+
+    async def restore_checkpoint(self, checkpoint_id, path: ApiPath):
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call(nbm.restore_checkpoint, checkpoint_id, meta.path)
+
+    async def delete_checkpoint(self, checkpoint_id, path: ApiPath):
+        nbm, meta = self.get_nbm_from_path(path)
+        return await self.call(nbm.delete_checkpoint, checkpoint_id, meta.path)
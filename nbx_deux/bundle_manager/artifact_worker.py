@@ -0,0 +1,112 @@
+"""
+Background generation of derived bundle artifacts.
+
+The _nbx percent-format extract is derived from the notebook and nothing in
+the save response depends on it, so it doesn't need to hold up the save.
+
+Jobs are keyed on path. Submitting a job for a path that already has one
+queued replaces it, so a burst of autosaves only generates the artifacts for
+the latest notebook. A job that is already running is not interrupted; the
+replacement runs after it.
+"""
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+
+class ArtifactWorker:
+    def __init__(self, log=None, name='nbx-artifacts'):
+        self.log = log or logging.getLogger(__name__)
+        self.name = name
+        self.submitted = 0
+        self.processed = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._pending: OrderedDict[str, tuple] = OrderedDict()
+        self._active = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        # daemon so an idle worker never blocks exit, but drain what's queued
+        atexit.register(self.shutdown)
+
+    def submit(self, key, func, *args, **kwargs):
+        with self._cond:
+            if self._closed:
+                raise Exception(f"ArtifactWorker {self.name} is shut down")
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (func, args, kwargs)
+            self.submitted += 1
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def discard(self, key):
+        """
+        Drop the queued job for key. Returns whether there was one.
+        """
+        with self._cond:
+            job = self._pending.pop(key, None)
+            self._cond.notify_all()
+            return job is not None
+
+    def pending(self):
+        with self._cond:
+            return list(self._pending)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                key, (func, args, kwargs) = self._pending.popitem(last=False)
+                self._active = key
+
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                self.errors += 1
+                self.log.exception("Artifact job failed for %s", key)
+            finally:
+                with self._cond:
+                    self._active = None
+                    self.processed += 1
+                    self._cond.notify_all()
+
+    def flush(self, timeout=None) -> bool:
+        """
+        Block until every job submitted so far has run. Returns False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and self._active is None,
+                timeout,
+            )
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop taking jobs. Queued jobs still run before the thread exits.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'pending': len(self._pending),
+            }
@@ -13,20 +13,52 @@ In the above setup `/root/frank.txt` is the bundle_path.
 `/root/frank/frank.txt` is the actual file.
 """
 import os
+import threading
 from pathlib import Path
 import dataclasses as dc
-from typing import ClassVar, Literal, cast
+from typing import Callable, ClassVar, Iterable, Literal, cast
 
 import nbformat
 
+from nbx_deux import nbjson
+from nbx_deux.bundle_manager.artifact_worker import ArtifactWorker
+from nbx_deux.bundle_manager.bundle_checkpoints import BundleCheckpoints
+from nbx_deux.bundle_manager.bundle_digests import BundleDigests
+from nbx_deux.bundle_manager.bundle_outputs import (
+    BundleOutputs,
+    referenced_outputs,
+    split_outputs,
+)
+from nbx_deux.listing import ListingEntry, is_racy
 from nbx_deux.models import BaseModel, NotebookModel
 from nbx_deux.fileio import (
-    _read_notebook,
+    TRUST_CACHE,
+    _read_validated_notebook,
     _save_notebook,
     check_and_sign,
+    validate_notebook_model,
 )
+from nbx_deux.lazy_notebook import LazyNotebook
+from nbx_deux.nbjson import reads_notebook, writes_notebook
+from nbx_deux.trust_cache import chunks_digest, content_digest
 from nbx_deux.nbx_convert import upgrade_nb
-from nbx_deux.normalized_notebook import NBXNotebookExport
+from nbx_deux.normalized_notebook import NBXNotebookExport, merge_nbxpy, nbxpy_cell_chunks
+
+
+# Per bundle. Writing the _nbx extract and recording its digest happen under
+# this, as does deciding whether it was edited and reading it for a merge.
+_EXTRACT_LOCKS: dict[str, threading.Lock] = {}
+
+
+def _extract_lock(bundle_path) -> threading.Lock:
+    return _EXTRACT_LOCKS.setdefault(str(bundle_path), threading.Lock())
+
+
+def _write_through(f, chunks):
+    """Write each chunk to f on its way past."""
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
 
 
 @dc.dataclass(frozen=True, kw_only=True)
@@ -34,11 +66,23 @@ class PathItem:
     path: Path
     type: Literal['file', 'directory']
     is_bundle: bool = False
+    # lstat result when the item came from a directory scan
+    stat: os.stat_result | None = dc.field(default=None, compare=False)
 
     @property
     def is_regular_file(self):
         return self.type == 'file' and not self.is_bundle
 
+    @property
+    def kind(self) -> Literal['file', 'directory', 'bundle', 'notebook_bundle']:
+        if self.type == 'directory':
+            return 'directory'
+        if not self.is_bundle:
+            return 'file'
+        if self.path.name.endswith('.ipynb'):
+            return 'notebook_bundle'
+        return 'bundle'
+
 
 def bundle_get_path_item(os_path):
     os_path = Path(os_path)
@@ -55,6 +99,30 @@ def bundle_get_path_item(os_path):
     return item
 
 
+def _probe_bundle_entry(entry: ListingEntry):
+    if not entry.is_dir:
+        return PathItem(path=Path(entry.os_path), type='file', stat=entry.stat)
+
+    # is_dir already came from the scan. Only the bundle file needs a probe.
+    bundle_file = os.path.join(entry.os_path, entry.name)
+    if os.path.isfile(bundle_file):
+        return PathItem(path=Path(entry.os_path), type='file', is_bundle=True, stat=entry.stat)
+    return PathItem(path=Path(entry.os_path), type='directory', stat=entry.stat)
+
+
+def bundle_classify_entries(entries: Iterable[ListingEntry], executor=None) -> list[PathItem]:
+    """
+    Sort scanned entries into file / directory / bundle in one pass.
+
+    Directories need one isfile probe each to detect bundles. On network
+    filesystems those round trips dominate so they can be fanned out over an
+    executor. Results keep the order of entries regardless.
+    """
+    if executor is None:
+        return [_probe_bundle_entry(entry) for entry in entries]
+    return list(executor.map(_probe_bundle_entry, entries))
+
+
 def bundle_list_dir(os_path):
     os_path = Path(os_path)
     content = []
@@ -179,33 +247,99 @@ class BundlePath:
             yield bundle
 
     def save(self, model):
+        self.write(model)
+        return model
+
+    def write(self, model) -> bool:
+        """
+        Save model to the bundle. Returns False if the bundle file was left
+        untouched because its content didn't change.
+        """
         bundle_path = self.bundle_path
         if not os.path.exists(bundle_path):
             os.mkdir(bundle_path)
 
-        self.save_bundle_file(model)
-        return model
+        digests = BundleDigests(bundle_path)
+        changed = self.save_bundle_file(model, digests=digests)
+        digests.save()
+        return changed
+
+    def restore(self, data: bytes) -> bool:
+        """
+        Put the bundle file back to exactly data, like from a checkpoint.
+        """
+        digests = BundleDigests(self.bundle_path)
+        changed = self.write_if_changed(self.name, data, digests)
+        digests.save()
+        return changed
 
-    def save_bundle_file(self, model):
+    def write_if_changed(self, name, data: bytes, digests: BundleDigests) -> bool:
+        """
+        Write data to name (relative to bundle_path) unless the file already
+        holds exactly these bytes.
+        """
+        return self.write_chunks_if_changed(name, lambda: (data,), digests)
+
+    def write_chunks_if_changed(
+        self,
+        name,
+        iter_chunks: Callable[[], Iterable[bytes]],
+        digests: BundleDigests,
+    ) -> bool:
+        """
+        write_if_changed for content that is generated in pieces, so it's never
+        held in memory as a whole. A first pass over iter_chunks only hashes,
+        leaving an unchanged file untouched. Otherwise the second pass goes to
+        a temp file next to the target, hashed as it's written, and is renamed
+        into place. Readers never see a half written file and the digest we
+        record is of the bytes that actually landed.
+        """
+        if digests.is_current(name, chunks_digest(iter_chunks())):
+            return False
+
+        filepath = self.bundle_path.joinpath(name)
+        tmp_path = filepath.with_name(f'.{filepath.name}.{threading.get_ident()}.tmp')
+        try:
+            with open(tmp_path, 'wb') as f:
+                digest = chunks_digest(_write_through(f, iter_chunks()))
+            # rename keeps mtime and size, so this stat describes our bytes even
+            # if the file is replaced again right after
+            st = os.stat(tmp_path)
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        digests.record(name, digest, st)
+        return True
+
+    def save_bundle_file(self, model, digests: BundleDigests | None = None) -> bool:
+        if digests is None:
+            digests = BundleDigests(self.bundle_path)
         content = model['content']
-        with open(self.bundle_file, 'w') as f:
-            f.write(content)
+        return self.write_if_changed(self.name, content.encode('utf-8'), digests)
 
-    def get_bundle_file_content(self):
+    def get_bundle_file_content(self, validation_policy='always', validation_error=None):
         with open(self.bundle_file, 'r') as f:
             return f.read()
 
-    def write_files(self, model):
+    def write_files(self, model) -> bool:
         # write files
-        bundle_path = self.bundle_path
+        digests = BundleDigests(self.bundle_path)
 
+        changed = False
         files = model['bundle_files']
         for fn, fcontent in files.items():
-            filepath = os.path.join(bundle_path, fn)
-            with open(filepath, 'w') as f:
-                f.write(fcontent)
-
-    def get_model(self, root_dir=None, content=True, file_content=None):
+            changed |= self.write_if_changed(fn, fcontent.encode('utf-8'), digests)
+        digests.save()
+        return changed
+
+    def get_model(
+        self,
+        root_dir=None,
+        content=True,
+        file_content=None,
+        validation_policy='always',
+    ):
         # default getting file_content to content
         if file_content is None:
             file_content = content
@@ -216,8 +350,12 @@ class BundlePath:
         os_path = self.bundle_file
 
         bundle_file_content = None
+        validation_error: dict = {}
         if content:
-            bundle_file_content = self.get_bundle_file_content()
+            bundle_file_content = self.get_bundle_file_content(
+                validation_policy=validation_policy,
+                validation_error=validation_error,
+            )
 
         model = BaseModel.from_filepath_dict(os_path, root_dir)
         # This gets the deets for the actual bundle_file
@@ -232,6 +370,8 @@ class BundlePath:
             content=bundle_file_content,
             **model,
         )
+        if validation_error:
+            validate_notebook_model(model, validation_error)
         return model
 
     def rename(self, new_name):
@@ -271,6 +411,10 @@ class NotebookBundlePath(BundlePath):
     Bundle that represents a Jupyter Notebook.
     """
     bundle_model_class = NotebookBundleModel
+    # ArtifactWorker for the _nbx extract. None generates it inline.
+    artifact_worker: ArtifactWorker | None = None
+    # outputs at least this many bytes are stored outside the ipynb. 0 is off.
+    output_threshold: int = 0
 
     @classmethod
     def valid_path(cls, os_path):
@@ -284,7 +428,11 @@ class NotebookBundlePath(BundlePath):
         normalized_dir = self.bundle_path.joinpath('_nbx')
         return normalized_dir
 
-    def save_nbx_extract(self, nb: nbformat.NotebookNode):
+    def nbx_extract_name(self):
+        basename, ext = os.path.splitext(self.bundle_file.name)
+        return os.path.join('_nbx', basename + '.py')
+
+    def save_nbx_extract(self, nb: nbformat.NotebookNode, digests: BundleDigests | None = None):
         """
         The idea behind this save command is to split up the ipynb into component parts.
         TODO:
@@ -292,32 +440,179 @@ class NotebookBundlePath(BundlePath):
             2. ipynb skeleton
             3. extracted outputs
 
-        For now this only goes one way. Notebook => nbxpy
+        Edits made to the nbxpy file outside nbx come back in through
+        merge_nbx_extract.
         """
+        if digests is None:
+            digests = BundleDigests(self.bundle_path)
+
         nbx_dir = self.nbx_dir(nb)
         nbx_dir.mkdir(exist_ok=True, parents=True)
 
         nnpy = NBXNotebookExport(nb)
-        content = nnpy.to_pyfile()
-        basename, ext = os.path.splitext(self.bundle_file.name)
-        new_filename = basename + '.py'
-        new_filepath = nbx_dir.joinpath(new_filename)
-        with open(new_filepath, 'w') as f:
-            f.write(content)
 
-    def save_bundle_file(self, model: NotebookModel):
+        def iter_chunks():
+            # the second pass is served from PYCELL_CACHE
+            return (chunk.encode('utf-8') for chunk in nnpy.iter_pychunks())
+
+        with _extract_lock(self.bundle_path):
+            changed = self.write_chunks_if_changed(self.nbx_extract_name(), iter_chunks, digests)
+            if changed:
+                # until the digest is on disk a reader would take our own
+                # write for an external edit
+                digests.save()
+        return changed
+
+    def nbx_extract_edited(self, digests: BundleDigests | None = None) -> bool:
+        """
+        Was the _nbx extract changed outside of nbx since we last wrote it?
+        """
+        if digests is None:
+            digests = BundleDigests(self.bundle_path)
+        name = self.nbx_extract_name()
+        if digests.get(name) is None:
+            # not written by us, so nothing to say it was edited
+            return False
+        if not self.bundle_path.joinpath(name).exists():
+            return False
+        return not digests.is_current(name)
+
+    def merge_nbx_extract(
+        self,
+        nb: nbformat.NotebookNode,
+        digests: BundleDigests | None = None,
+    ) -> bool:
+        """
+        Pull edits made to the _nbx extract in an external editor into nb.
+        The ipynb itself is left alone until the next save.
+        """
+        extract = self.bundle_path.joinpath(self.nbx_extract_name())
+        with _extract_lock(self.bundle_path):
+            if not self.nbx_extract_edited(digests):
+                return False
+            try:
+                st = os.stat(extract)
+                content = extract.read_text()
+                ids = {cell['id'] for cell, _ in nbxpy_cell_chunks(content)}
+            except Exception as e:
+                nbformat.get_logger().warning("Could not merge %s: %r", extract, e)
+                return False
+
+        # A file another program is still writing looks like one with cells
+        # deleted. Leave it for a later read once it has settled.
+        st_after = os.stat(extract)
+        if (st_after.st_mtime_ns, st_after.st_size) != (st.st_mtime_ns, st.st_size):
+            return False
+        if is_racy(st) and any(cell['id'] not in ids for cell in nb['cells']):
+            return False
+        return merge_nbxpy(nb, content)
+
+    def _nbx_extract_job(self, nb: nbformat.NotebookNode):
+        if not self.bundle_file.exists():
+            # renamed or deleted while queued
+            return
+        digests = BundleDigests(self.bundle_path)
+        self.save_nbx_extract(nb, digests=digests)
+        digests.save()
+
+    def update_nbx_extract(self, nb: nbformat.NotebookNode, digests: BundleDigests):
+        if self.artifact_worker is None:
+            self.save_nbx_extract(nb, digests=digests)
+            return
+        # nb is our own copy from save_bundle_file so it's safe to hand off
+        self.artifact_worker.submit(str(self.bundle_path), self._nbx_extract_job, nb)
+
+    def save_bundle_file(self, model: NotebookModel, digests: BundleDigests | None = None) -> bool:
+        if digests is None:
+            digests = BundleDigests(self.bundle_path)
+
         nb = cast(nbformat.NotebookNode, nbformat.from_dict(model['content']))
         # upgrade to latest version
         upgrade_nb(nb)
-        check_and_sign(nb)
-        _save_notebook(self.bundle_file, nb)
+        disk_nb, blobs, data, digest = self._disk_notebook(nb)
+
+        if digests.is_current(self.name, digest) and self.merge_nbx_extract(nb, digests):
+            # Same notebook as on disk, so an edit to the extract is the only
+            # change and writing the extract back out would throw it away.
+            # When the notebook changed too, the notebook wins.
+            disk_nb, blobs, data, digest = self._disk_notebook(nb)
+
+        if digests.is_current(self.name, digest):
+            # Same bytes. Only signing can be outstanding, if the cells were
+            # trusted since the last write.
+            if not TRUST_CACHE.digest_trusted(digest):
+                if check_and_sign(nb) is not None:
+                    TRUST_CACHE.seed(digest, True)
+            # a missing extract gets written, an edited one waits to be merged
+            stale = not digests.is_current(self.nbx_extract_name())
+            if stale and not self.nbx_extract_edited(digests):
+                # WIP
+                self.update_nbx_extract(nb, digests)
+            return False
+
+        signature = check_and_sign(nb)
+        outputs = BundleOutputs(self.bundle_path)
+        # blobs go first so the ipynb never points at something missing
+        outputs.write(blobs)
+        _save_notebook(self.bundle_file, disk_nb, signature=signature, data=data)
+        digests.record(self.name, digest)
+        self.prune_outputs(referenced_outputs(disk_nb), outputs)
         # WIP
-        self.save_nbx_extract(nb)
+        self.update_nbx_extract(nb, digests)
+        return True
+
+    def _disk_notebook(self, nb: nbformat.NotebookNode):
+        """
+        (disk_nb, blobs, data, digest) for what saving nb puts in the ipynb.
+        """
+        disk_nb, blobs = nb, {}
+        if self.output_threshold:
+            disk_nb, blobs = split_outputs(nb, self.output_threshold)
+        data = writes_notebook(disk_nb)
+        return disk_nb, blobs, data, content_digest(data)
 
-    def get_bundle_file_content(self):
-        nb = _read_notebook(self.bundle_file)
+    def prune_outputs(self, in_use: set[str], outputs: BundleOutputs | None = None) -> int:
+        """
+        Remove output blobs that neither the notebook nor any checkpoint
+        refers to.
+        """
+        if outputs is None:
+            outputs = BundleOutputs(self.bundle_path)
+        if not outputs.stored() - in_use:
+            return 0
+        keep = set(in_use)
+        for data in BundleCheckpoints(self.bundle_path).iter_objects():
+            try:
+                keep |= referenced_outputs(nbjson.BACKEND.loads(data))
+            except ValueError:
+                continue
+        return outputs.prune(keep)
+
+    def restore(self, data: bytes) -> bool:
+        digests = BundleDigests(self.bundle_path)
+        changed = self.write_if_changed(self.name, data, digests)
+        if changed:
+            self.update_nbx_extract(reads_notebook(data), digests)
+        digests.save()
+        return changed
+
+    def get_bundle_file_content(self, validation_policy='always', validation_error=None):
+        nb, _, error = _read_validated_notebook(
+            self.bundle_file,
+            validation_policy=validation_policy,
+        )
+        if validation_error is not None:
+            validation_error.update(error)
+        BundleOutputs(self.bundle_path).join(nb)
+        self.merge_nbx_extract(nb)
         return nb
 
+    def get_lazy_notebook(self) -> LazyNotebook:
+        """
+        For callers that only need metadata or a few cells.
+        """
+        return LazyNotebook.from_path(self.bundle_file)
+
 
 if __name__ == '__main__':
     from nbx_deux.testing import TempDir
@@ -0,0 +1,239 @@
+"""
+Content addressed checkpoints for bundles.
+
+Checkpoints live inside the bundle so renames carry them along for free.
+
+    <bundle>/.ipynb_checkpoints/manifest.json
+    <bundle>/.ipynb_checkpoints/objects/<digest>
+
+The bundle file is stored once per distinct content, keyed on its digest, so
+checkpointing the same notebook state again doesn't take more disk. The
+manifest is the only thing read to list checkpoints:
+
+    {"checkpoints": [{"id": ..., "digest": ..., "size": ..., "created": ...}]}
+
+ordered oldest first. Objects no checkpoint refers to are removed when their
+last checkpoint is deleted.
+
+Bundles checkpointed before this have whole copies named
+`<basename>---<id><ext>`. Those are moved into the object store the first time
+the checkpoints are loaded.
+"""
+import datetime
+import json
+import os
+import threading
+from pathlib import Path
+
+from nbx_deux.trust_cache import content_digest
+
+CHECKPOINT_DIRNAME = '.ipynb_checkpoints'
+MANIFEST_FILENAME = 'manifest.json'
+
+# manifest updates are read-modify-write
+_LOCK = threading.RLock()
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class BundleCheckpoints:
+    def __init__(self, bundle_path, max_checkpoints=0):
+        self.bundle_path = Path(bundle_path)
+        self.name = self.bundle_path.name
+        self.max_checkpoints = max_checkpoints
+        self.checkpoint_dir = self.bundle_path.joinpath(CHECKPOINT_DIRNAME)
+        self.objects_dir = self.checkpoint_dir.joinpath('objects')
+        self.manifest_path = self.checkpoint_dir.joinpath(MANIFEST_FILENAME)
+
+    @property
+    def bundle_file(self):
+        return self.bundle_path.joinpath(self.name)
+
+    def object_path(self, digest) -> Path:
+        return self.objects_dir.joinpath(digest)
+
+    def _load(self) -> list[dict]:
+        try:
+            with open(self.manifest_path, 'rb') as f:
+                return json.load(f)['checkpoints']
+        except FileNotFoundError:
+            return self._import_legacy()
+        except (OSError, ValueError, KeyError):
+            return []
+
+    def _save(self, checkpoints: list[dict]):
+        self.checkpoint_dir.mkdir(exist_ok=True)
+        tmp_path = self.manifest_path.with_name(MANIFEST_FILENAME + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'checkpoints': checkpoints}, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _store(self, data: bytes) -> str:
+        digest = content_digest(data)
+        obj_path = self.object_path(digest)
+        if not obj_path.exists():
+            self.objects_dir.mkdir(exist_ok=True, parents=True)
+            tmp_path = obj_path.with_name(digest + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, obj_path)
+        return digest
+
+    def _import_legacy(self) -> list[dict]:
+        """
+        Move `<basename>---<id><ext>` copies into the object store.
+        """
+        basename, ext = os.path.splitext(self.name)
+        prefix = f"{basename}---"
+        try:
+            legacy = [
+                entry for entry in os.scandir(self.checkpoint_dir)
+                if entry.name.startswith(prefix) and entry.name.endswith(ext)
+                and entry.is_file()
+            ]
+        except FileNotFoundError:
+            return []
+
+        checkpoints = []
+        for entry in sorted(legacy, key=lambda e: e.stat().st_mtime_ns):
+            with open(entry.path, 'rb') as f:
+                data = f.read()
+            st = entry.stat()
+            checkpoints.append({
+                'id': entry.name[len(prefix):len(entry.name) - len(ext)],
+                'digest': self._store(data),
+                'size': len(data),
+                'created': datetime.datetime.fromtimestamp(
+                    st.st_mtime, datetime.timezone.utc,
+                ).isoformat(),
+            })
+        if checkpoints:
+            self._save(checkpoints)
+            for entry in legacy:
+                os.unlink(entry.path)
+        return checkpoints
+
+    @staticmethod
+    def checkpoint_model(checkpoint: dict):
+        return dict(
+            id=checkpoint['id'],
+            last_modified=datetime.datetime.fromisoformat(checkpoint['created']),
+        )
+
+    def _new_id(self, checkpoints, now):
+        checkpoint_id = now.strftime("%Y-%m-%dT%H-%M-%S.%f")
+        taken = {cp['id'] for cp in checkpoints}
+        i = 1
+        while checkpoint_id in taken:
+            checkpoint_id = f"{now.strftime('%Y-%m-%dT%H-%M-%S.%f')}-{i}"
+            i += 1
+        return checkpoint_id
+
+    def create(self):
+        """
+        Checkpoint the current bundle file. If it's unchanged since the
+        latest checkpoint, that checkpoint is returned instead of a new one.
+        """
+        with open(self.bundle_file, 'rb') as f:
+            data = f.read()
+
+        with _LOCK:
+            checkpoints = self._load()
+            digest = content_digest(data)
+            if checkpoints and checkpoints[-1]['digest'] == digest \
+                    and self.object_path(digest).exists():
+                return self.checkpoint_model(checkpoints[-1])
+
+            self._store(data)
+            now = _utcnow()
+            checkpoint = {
+                'id': self._new_id(checkpoints, now),
+                'digest': digest,
+                'size': len(data),
+                'created': now.isoformat(),
+            }
+            checkpoints.append(checkpoint)
+
+            if self.max_checkpoints:
+                while len(checkpoints) > self.max_checkpoints:
+                    self._drop(checkpoints, checkpoints[0]['id'])
+            self._save(checkpoints)
+        return self.checkpoint_model(checkpoint)
+
+    def list_checkpoints(self):
+        with _LOCK:
+            return [self.checkpoint_model(cp) for cp in self._load()]
+
+    def get(self, checkpoint_id) -> dict:
+        for checkpoint in self._load():
+            if checkpoint['id'] == checkpoint_id:
+                return checkpoint
+        raise Exception(f"Checkpoint {checkpoint_id} does not exist for {self.bundle_path}")
+
+    def read(self, checkpoint_id) -> bytes:
+        """
+        Bundle file bytes as of checkpoint_id.
+        """
+        checkpoint = self.get(checkpoint_id)
+        with open(self.object_path(checkpoint['digest']), 'rb') as f:
+            data = f.read()
+        if content_digest(data) != checkpoint['digest']:
+            raise Exception(f"Checkpoint {checkpoint_id} for {self.bundle_path} is corrupt")
+        return data
+
+    def _drop(self, checkpoints: list[dict], checkpoint_id):
+        """
+        Remove checkpoint_id from checkpoints and its object if nothing else
+        refers to it.
+        """
+        for i, checkpoint in enumerate(checkpoints):
+            if checkpoint['id'] == checkpoint_id:
+                break
+        else:
+            raise Exception(f"Checkpoint {checkpoint_id} does not exist for {self.bundle_path}")
+
+        del checkpoints[i]
+        digest = checkpoint['digest']
+        if not any(cp['digest'] == digest for cp in checkpoints):
+            try:
+                os.unlink(self.object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def delete(self, checkpoint_id):
+        with _LOCK:
+            checkpoints = self._load()
+            self._drop(checkpoints, checkpoint_id)
+            self._save(checkpoints)
+
+    def delete_all(self):
+        with _LOCK:
+            checkpoints = self._load()
+            for checkpoint in list(checkpoints):
+                self._drop(checkpoints, checkpoint['id'])
+            self._save(checkpoints)
+
+    def iter_objects(self):
+        """
+        Bytes of every stored object.
+        """
+        try:
+            entries = list(os.scandir(self.objects_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.name.endswith('.tmp'):
+                continue
+            with open(entry.path, 'rb') as f:
+                yield f.read()
+
+    def disk_usage(self) -> int:
+        """
+        Bytes taken by stored objects.
+        """
+        try:
+            return sum(entry.stat().st_size for entry in os.scandir(self.objects_dir))
+        except FileNotFoundError:
+            return 0
@@ -0,0 +1,120 @@
+"""
+Content digests of what a bundle last wrote, so saves can skip writes whose
+output would be byte-identical. Autosave sends the same notebook over and
+over; without this every tick rewrites the notebook, regenerates the nbx
+extract and fans out to the post-save hooks.
+
+Stored in <bundle>/_nbx/digests.json
+
+    {"files": {"<name relative to bundle>": {
+        "digest": ..., "mtime_ns": ..., "size": ..., "recorded_ns": ...
+    }}}
+
+A recorded digest only counts while the file's stat still matches, so edits
+made outside of nbx are never mistaken for unchanged. Entries recorded within
+the racy window of the file's mtime are confirmed by hashing the file.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from nbx_deux.listing import RACY_WINDOW_NS
+from nbx_deux.trust_cache import content_digest
+
+DIGESTS_FILENAME = 'digests.json'
+
+# save() is a read-modify-write. The artifact worker and request threads can
+# record into the same bundle at once.
+_SAVE_LOCK = threading.Lock()
+
+
+class BundleDigests:
+    def __init__(self, bundle_path):
+        self.bundle_path = Path(bundle_path)
+        self.path = self.bundle_path.joinpath('_nbx', DIGESTS_FILENAME)
+        self.files = self._load()
+        self._changed: set[str] = set()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data.get('files', {})
+
+    def get(self, name) -> str | None:
+        entry = self.files.get(name)
+        if entry is None:
+            return None
+        return entry['digest']
+
+    def is_current(self, name, digest=None) -> bool:
+        """
+        Does the file on disk still hold the bytes that hashed to digest?
+        digest defaults to whatever was last recorded for name.
+        """
+        entry = self.files.get(name)
+        if entry is None:
+            return False
+        if digest is not None and entry['digest'] != digest:
+            return False
+
+        os_path = self.bundle_path.joinpath(name)
+        try:
+            st = os.stat(os_path)
+        except OSError:
+            return False
+        if (st.st_mtime_ns, st.st_size) != (entry['mtime_ns'], entry['size']):
+            return False
+
+        if entry['recorded_ns'] - entry['mtime_ns'] < RACY_WINDOW_NS:
+            # written too close to when we recorded it to trust the stat
+            with open(os_path, 'rb') as f:
+                if content_digest(f.read()) != entry['digest']:
+                    return False
+            self.record(name, entry['digest'], st=st)
+        return True
+
+    def record(self, name, digest, st=None):
+        if st is None:
+            st = os.stat(self.bundle_path.joinpath(name))
+        self.files[name] = {
+            'digest': digest,
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'recorded_ns': time.time_ns(),
+        }
+        self._changed.add(name)
+
+    def discard(self, name):
+        self.files.pop(name, None)
+        self._changed.add(name)
+
+    @property
+    def dirty(self):
+        return bool(self._changed)
+
+    def save(self):
+        """
+        Write out our changes on top of whatever is on disk now.
+        """
+        if not self._changed:
+            return
+        with _SAVE_LOCK:
+            files = self._load()
+            for name in self._changed:
+                if name in self.files:
+                    files[name] = self.files[name]
+                else:
+                    files.pop(name, None)
+
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            tmp_path = self.path.with_name(DIGESTS_FILENAME + '.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump({'files': files}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        self.files = files
+        self._changed.clear()
@@ -0,0 +1,313 @@
+"""
+Persistent metadata index for a bundle root.
+
+Rows mirror the content=False models BundleContentsManager returns for a
+listing, plus notebook level metadata (kernel, gist_id, cell_count) that is
+filled in on save.
+
+A directory listing is recorded with the directory mtime it was scanned at.
+As long as the directory mtime hasn't moved and every child still has the mtime
+its row was built from, the listing is answered from the index. That costs a
+stat per child instead of classifying and reading them. Single path lookups
+revalidate the same way.
+"""
+import json
+import mimetypes
+import os
+import sqlite3
+import threading
+
+from jupyter_server import _tz as tz
+
+from nbx_deux.models import DirectoryModel, FileModel, NotebookModel
+from .bundle import BundleModel, NotebookBundleModel
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    entry_mtime_ns INTEGER NOT NULL,
+    size INTEGER,
+    last_modified REAL NOT NULL,
+    created REAL NOT NULL,
+    writable INTEGER,
+    bundle_files TEXT,
+    kernel TEXT,
+    gist_id TEXT,
+    cell_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries(parent);
+CREATE TABLE IF NOT EXISTS listings (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+);
+"""
+
+ENTRY_COLUMNS = (
+    'path',
+    'parent',
+    'name',
+    'kind',
+    'entry_mtime_ns',
+    'size',
+    'last_modified',
+    'created',
+    'writable',
+    'bundle_files',
+)
+
+BUNDLE_KINDS = ('bundle', 'notebook_bundle')
+
+
+def _parent(path):
+    return os.path.dirname(path.strip('/'))
+
+
+def model_kind(model):
+    if model['type'] == 'directory':
+        return 'directory'
+    if not model.get('is_bundle', False):
+        return model['type']
+    if model['type'] == 'notebook':
+        return 'notebook_bundle'
+    return 'bundle'
+
+
+def notebook_summary(nb):
+    metadata = nb.get('metadata', {})
+    kernelspec = metadata.get('kernelspec') or {}
+    return {
+        'kernel': kernelspec.get('name'),
+        'gist_id': metadata.get('gist_id'),
+        'cell_count': len(nb.get('cells', [])),
+    }
+
+
+def entry_mtime_ns(os_path, kind, st=None):
+    """
+    mtime a row is validated against. A bundle's model comes from its main
+    file, which can be rewritten in place without touching the bundle dir, so
+    bundles use the later of the two.
+    """
+    if st is None:
+        st = os.lstat(os_path)
+    mtime_ns = st.st_mtime_ns
+    if kind in BUNDLE_KINDS:
+        bundle_file = os.path.join(os_path, os.path.basename(os_path))
+        mtime_ns = max(mtime_ns, os.stat(bundle_file).st_mtime_ns)
+    return mtime_ns
+
+
+def _current_mtime_ns(os_path, kind):
+    try:
+        return entry_mtime_ns(os_path, kind)
+    except OSError:
+        return None
+
+
+class BundleIndex:
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        dirname = os.path.dirname(self.db_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    # listings
+    def get_listing(self, path, mtime_ns, os_dir):
+        """
+        Child models for directory path if it was indexed at mtime_ns and none
+        of its children changed since. Returns None when it needs a rescan.
+        """
+        path = path.strip('/')
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT mtime_ns FROM listings WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None or row['mtime_ns'] != mtime_ns:
+                return None
+            rows = self.conn.execute(
+                "SELECT * FROM entries WHERE parent = ? ORDER BY rowid", (path,)
+            ).fetchall()
+        # in place rewrites don't move the directory mtime
+        for row in rows:
+            os_path = os.path.join(os_dir, row['name'])
+            if _current_mtime_ns(os_path, row['kind']) != row['entry_mtime_ns']:
+                return None
+        return [self.row_to_model(row) for row in rows]
+
+    def record_listing(self, path, mtime_ns, items, contents):
+        """
+        items: PathItems from the scan, contents: the matching child models.
+        """
+        path = path.strip('/')
+        rows = []
+        for item, model in zip(items, contents):
+            try:
+                child_mtime_ns = entry_mtime_ns(str(item.path), item.kind, item.stat)
+            except OSError:
+                # gone since the scan. never matches, next listing rescans.
+                child_mtime_ns = -1
+            rows.append(self.model_to_row(model, child_mtime_ns))
+        placeholders = ", ".join("?" * len(ENTRY_COLUMNS))
+        updates = ", ".join(f"{col}=excluded.{col}" for col in ENTRY_COLUMNS[1:])
+        paths = [row[0] for row in rows]
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM entries WHERE parent = ? AND path NOT IN "
+                "(SELECT value FROM json_each(?))",
+                (path, json.dumps(paths)),
+            )
+            self.conn.executemany(
+                f"INSERT INTO entries ({', '.join(ENTRY_COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                rows,
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO listings (path, mtime_ns) VALUES (?, ?)",
+                (path, mtime_ns),
+            )
+
+    def invalidate_listing(self, path):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM listings WHERE path = ?", (path.strip('/'),))
+
+    def invalidate_all_listings(self):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM listings")
+
+    # single entries
+    def get_entry(self, path):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT * FROM entries WHERE path = ?", (path.strip('/'),)
+            ).fetchone()
+
+    def lookup(self, path, os_path):
+        """
+        Return the entry row for path if it is still current on disk.
+
+        Costs one lstat, two for a bundle. Stale rows are dropped along with
+        the parent listing.
+        """
+        row = self.get_entry(path)
+        if row is None:
+            return None
+        if _current_mtime_ns(os_path, row['kind']) != row['entry_mtime_ns']:
+            self.delete(path)
+            return None
+        return row
+
+    def update_entry(self, model, entry_mtime_ns, nb=None):
+        row = self.model_to_row(model, entry_mtime_ns)
+        placeholders = ", ".join("?" * len(ENTRY_COLUMNS))
+        updates = ", ".join(f"{col}=excluded.{col}" for col in ENTRY_COLUMNS[1:])
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO entries ({', '.join(ENTRY_COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT(path) DO UPDATE SET {updates}",
+                row,
+            )
+            if nb is not None:
+                summary = notebook_summary(nb)
+                self.conn.execute(
+                    "UPDATE entries SET kernel = ?, gist_id = ?, cell_count = ? WHERE path = ?",
+                    (summary['kernel'], summary['gist_id'], summary['cell_count'], row[0]),
+                )
+
+    def delete(self, path):
+        path = path.strip('/')
+        with self._lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM entries WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                (path, _like_prefix(path)),
+            )
+            self.conn.execute(
+                "DELETE FROM listings WHERE path = ? OR path = ? OR path LIKE ? ESCAPE '\\'",
+                (path, _parent(path), _like_prefix(path)),
+            )
+
+    def rename(self, old_path, new_path):
+        old_path = old_path.strip('/')
+        new_path = new_path.strip('/')
+        # rename keeps notebook metadata. stat columns get refreshed by the
+        # next listing since both parents are invalidated.
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM entries WHERE path = ?", (new_path,))
+            self.conn.execute(
+                "UPDATE entries SET path = ?, parent = ?, name = ? WHERE path = ?",
+                (new_path, _parent(new_path), os.path.basename(new_path), old_path),
+            )
+            self.conn.execute(
+                "UPDATE entries SET path = ? || substr(path, ?), "
+                "parent = ? || substr(parent, ?) WHERE path LIKE ? ESCAPE '\\'",
+                (
+                    new_path, len(old_path) + 1,
+                    new_path, len(old_path) + 1,
+                    _like_prefix(old_path),
+                ),
+            )
+            for listing in (old_path, _parent(old_path), _parent(new_path)):
+                self.conn.execute("DELETE FROM listings WHERE path = ?", (listing,))
+            self.conn.execute(
+                "DELETE FROM listings WHERE path LIKE ? ESCAPE '\\'",
+                (_like_prefix(old_path),),
+            )
+
+    # row <-> model
+    @staticmethod
+    def model_to_row(model, entry_mtime_ns):
+        path = model['path'].strip('/')
+        bundle_files = None
+        if model.get('is_bundle', False):
+            bundle_files = json.dumps(list(model['bundle_files']))
+        return (
+            path,
+            _parent(path),
+            model['name'],
+            model_kind(model),
+            entry_mtime_ns,
+            model['size'],
+            model['last_modified'].timestamp(),
+            model['created'].timestamp(),
+            model['writable'],
+            bundle_files,
+        )
+
+    @staticmethod
+    def row_to_model(row):
+        kwargs = dict(
+            name=row['name'],
+            path=row['path'],
+            last_modified=tz.utcfromtimestamp(row['last_modified']),
+            created=tz.utcfromtimestamp(row['created']),
+            size=row['size'],
+            writable=None if row['writable'] is None else bool(row['writable']),
+        )
+        kind = row['kind']
+        if kind == 'directory':
+            return DirectoryModel(**kwargs)
+        if kind in BUNDLE_KINDS:
+            bundle_files = dict.fromkeys(json.loads(row['bundle_files']))
+            if kind == 'notebook_bundle':
+                return NotebookBundleModel(bundle_files=bundle_files, content=None, **kwargs)
+            return BundleModel(bundle_files=bundle_files, **kwargs)
+        if kind == 'notebook':
+            return NotebookModel(**kwargs)
+        return FileModel(mimetype=mimetypes.guess_type(row['name'])[0], **kwargs)
+
+
+def _like_prefix(path):
+    escaped = path.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '/%'
@@ -1,32 +1,367 @@
-import datetime
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import errno
 import os
 from pathlib import Path
 import shutil
+import threading
+import time
 from jupyter_server.services.contents.fileio import FileManagerMixin
-from jupyter_server.utils import to_os_path
+from jupyter_server.utils import to_api_path, to_os_path
 
 
-from traitlets import Unicode
-from IPython.utils import tz
+from traitlets import Bool, Enum, Float, Integer, Unicode
 from jupyter_server.services.contents.filemanager import FileContentsManager
 
-from nbx_deux.models import DirectoryModel, NotebookModel
+from nbx_deux.listing import ListingCache, filter_entries, is_racy, scan_dir
+from nbx_deux.models import DirectoryModel, FileModel, NotebookModel
+from nbx_deux.nbjson import reads_notebook
+from nbx_deux.trust_cache import share_notary_store
+from nbx_deux.watcher import (
+    CREATED,
+    DELETED,
+    MOVED,
+    OVERFLOW,
+    UNWATCHED,
+    WATCH_BACKENDS,
+    make_watcher,
+)
 
 from ..nbx_manager import NBXContentsManager, ApiPath
-from .bundle import NotebookBundlePath, BundlePath, bundle_get_path_item
+from .artifact_worker import ArtifactWorker
+from .bundle import (
+    NotebookBundlePath,
+    BundlePath,
+    PathItem,
+    bundle_classify_entries,
+    bundle_get_path_item,
+)
+from .bundle_checkpoints import BundleCheckpoints
+from .bundle_index import BUNDLE_KINDS, BundleIndex, entry_mtime_ns, model_kind
+
+# Watch events this soon after one of our own writes to the same path are
+# treated as ours and not emitted as external edits.
+OWN_CHANGE_WINDOW = 2.0
+
+EVENT_ACTIONS = {
+    CREATED: 'create',
+    DELETED: 'delete',
+    MOVED: 'rename',
+}
 
 
 class BundleContentsManager(FileManagerMixin, NBXContentsManager):
     trash_dir = Unicode(config=True)
+    listing_cache_size = Integer(
+        0,
+        config=True,
+        help="Number of directory scans to keep. 0 disables the listing cache.",
+    )
+    bundle_classify_workers = Integer(
+        0,
+        config=True,
+        help=(
+            "Threads used to probe directory entries for bundles. Worth setting "
+            "on network filesystems. 0 probes serially."
+        ),
+    )
+    index_path = Unicode(
+        '',
+        config=True,
+        help="sqlite file for the metadata index. Empty disables the index.",
+    )
+    max_bundle_checkpoints = Integer(
+        0,
+        config=True,
+        help="Checkpoints kept per bundle, oldest dropped first. 0 keeps all.",
+    )
+    output_threshold = Integer(
+        0,
+        config=True,
+        help=(
+            "Notebook outputs of at least this many bytes are stored as "
+            "separate files in the bundle. 0 keeps outputs in the notebook."
+        ),
+    )
+    async_artifacts = Bool(
+        False,
+        config=True,
+        help=(
+            "Generate derived bundle artifacts like the _nbx extract on a "
+            "background thread instead of inside the save."
+        ),
+    )
+    watch_files = Enum(
+        WATCH_BACKENDS,
+        default_value='off',
+        config=True,
+        help=(
+            "Watch root_dir for changes made outside the server. Invalidates "
+            "the listing cache and index and emits contents events for "
+            "external edits. 'auto' uses inotify and falls back to polling."
+        ),
+    )
+    watch_poll_interval = Float(
+        1.0,
+        config=True,
+        help="Seconds between rescans when watching by polling.",
+    )
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fm = FileContentsManager(root_dir=self.root_dir)
+        share_notary_store(self.fm.notary)
+        self.listing_cache = None
+        if self.listing_cache_size:
+            self.listing_cache = ListingCache(maxsize=self.listing_cache_size)
+        self._classify_executor = None
+        self._artifact_worker = None
+        self.index = None
+        if self.index_path:
+            self.index = BundleIndex(self.index_path)
+        self.watcher = None
+        # called with the event data of every external change
+        self.change_listeners = []
+        self._own_changes: dict[str, float] = {}
+        self._own_changes_lock = threading.Lock()
+        # loop events are emitted on, and changes seen before we had one
+        self._loop = None
+        self._pending_changes: dict[str, dict] = {}
+        self._pending_lock = threading.Lock()
+        if self.watch_files != 'off':
+            self.start_watcher()
+
+    @property
+    def classify_executor(self):
+        if not self.bundle_classify_workers:
+            return None
+        if self._classify_executor is None:
+            self._classify_executor = ThreadPoolExecutor(
+                max_workers=self.bundle_classify_workers,
+                thread_name_prefix='nbx-classify',
+            )
+        return self._classify_executor
+
+    @property
+    def artifact_worker(self):
+        if not self.async_artifacts:
+            return None
+        if self._artifact_worker is None:
+            self._artifact_worker = ArtifactWorker(log=self.log)
+        return self._artifact_worker
+
+    def flush_artifacts(self, timeout=None) -> bool:
+        """
+        Wait for queued artifact generation. For tests and shutdown.
+        """
+        if self._artifact_worker is None:
+            return True
+        return self._artifact_worker.flush(timeout)
+
+    def invalidate_listing(self, path: ApiPath):
+        """
+        Drop the cached scan of the directory containing path.
+        """
+        if self.listing_cache is None:
+            return
+        parent = os.path.dirname(path.strip('/'))
+        self.listing_cache.invalidate(self._get_os_path(path=parent))
+
+    # watching
+    def start_watcher(self):
+        """
+        Start watching root_dir. Called from __init__ when watch_files is set.
+        Events are held until bind_loop gives us a loop to emit them on.
+        """
+        if self.watcher is not None:
+            return self.watcher
+        self.bind_loop()
+        backend = self.watch_files if self.watch_files != 'off' else 'auto'
+        self.watcher = make_watcher(
+            self.root_dir,
+            self.handle_fs_events,
+            backend=backend,
+            interval=self.watch_poll_interval,
+            log=self.log,
+        )
+        # polling can be a whole interval behind, keep revalidating by stat
+        if self.listing_cache is not None and self.watcher.backend == 'inotify':
+            self.listing_cache.watched = True
+        return self.watcher
+
+    def stop_watcher(self):
+        if self.watcher is None:
+            return
+        if self.listing_cache is not None:
+            self.listing_cache.watched = False
+            self.listing_cache.invalidate()
+        self.watcher.stop()
+        self.watcher = None
+
+    def bind_loop(self, loop=None):
+        """
+        Emit watch events on loop, by default the running one. The server
+        builds its contents manager before its loop runs, so requests call this
+        and changes seen before then wait for it. jupyter_events listeners are
+        scheduled with asyncio.create_task, emit can't run on the watcher thread.
+        """
+        current = self._loop
+        if current is not None and not current.is_closed():
+            return
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+        with self._pending_lock:
+            self._loop = loop
+            pending, self._pending_changes = self._pending_changes, {}
+        for data in pending.values():
+            loop.call_soon_threadsafe(self.emit_external, data)
+
+    def expect_change(self, path: ApiPath):
+        """
+        Mark path (and anything below it) as about to be changed by us.
+        """
+        if self.watcher is None:
+            return
+        os_path = self._get_os_path(path=path)
+        with self._own_changes_lock:
+            self._own_changes[os_path] = time.monotonic() + OWN_CHANGE_WINDOW
+
+    def is_own_change(self, os_path):
+        now = time.monotonic()
+        with self._own_changes_lock:
+            for path, deadline in list(self._own_changes.items()):
+                if deadline < now:
+                    del self._own_changes[path]
+                elif os_path == path or os_path.startswith(path + os.sep):
+                    return True
+        return False
+
+    def _in_root(self, os_path):
+        return os_path == self.root_dir or os_path.startswith(self.root_dir + os.sep)
+
+    def invalidate_os_path(self, os_path, is_dir=False):
+        """
+        Drop everything cached about os_path.
+        """
+        parent = os.path.dirname(os_path)
+        # a bundle's model in its parent listing is built from files inside
+        # the bundle, so changes there reach two levels up
+        dirs = [d for d in (parent, os.path.dirname(parent)) if self._in_root(d)]
+        if self.listing_cache is not None:
+            for os_dir in dirs:
+                self.listing_cache.invalidate(os_dir)
+            if is_dir:
+                self.listing_cache.invalidate_tree(os_path)
+        if self.index is not None:
+            for os_dir in dirs:
+                self.index.invalidate_listing(to_api_path(os_dir, self.root_dir))
+
+    def external_change(self, event):
+        """
+        contents event data for a watch event, None if it isn't worth emitting.
+        """
+        if not self._in_root(event.path) or event.path == self.root_dir:
+            return None
+        if self.is_own_change(event.path):
+            return None
+
+        parts = to_api_path(event.path, self.root_dir).split('/')
+        if any(part.startswith('.') for part in parts):
+            return None
+
+        # anything inside a bundle is an edit of the bundle
+        for i in range(len(parts) - 1):
+            os_dir = os.path.join(self.root_dir, *parts[:i + 1])
+            if parts[i + 1] == parts[i] or BundlePath.valid_path(os_dir):
+                return {'action': 'save', 'path': '/'.join(parts[:i + 1])}
+
+        data = {'action': EVENT_ACTIONS.get(event.kind, 'save'), 'path': '/'.join(parts)}
+        if event.kind == MOVED:
+            if not self._in_root(event.src_path):
+                data['action'] = 'create'
+            else:
+                data['source_path'] = to_api_path(event.src_path, self.root_dir)
+        return data
+
+    def handle_fs_events(self, events):
+        """
+        Watcher callback. Runs on the watcher thread.
+        """
+        changes = {}
+        for event in events:
+            if event.kind == OVERFLOW:
+                if self.listing_cache is not None:
+                    self.listing_cache.invalidate()
+                if self.index is not None:
+                    self.index.invalidate_all_listings()
+                continue
+            if event.kind == UNWATCHED:
+                # the feed has a hole now. go back to revalidating by stat.
+                if self.listing_cache is not None:
+                    self.listing_cache.watched = False
+                self.invalidate_os_path(event.path, is_dir=True)
+                continue
+
+            self.invalidate_os_path(event.path, event.is_dir)
+            if event.src_path:
+                self.invalidate_os_path(event.src_path, event.is_dir)
+
+            data = self.external_change(event)
+            if data is None:
+                continue
+            # a save is usually several events. report one per path, and
+            # deleting a bundle beats the edits to its files.
+            if data['action'] != 'save' or data['path'] not in changes:
+                changes[data['path']] = data
+
+        if changes:
+            self.dispatch_changes(changes)
+
+    def dispatch_changes(self, changes):
+        with self._pending_lock:
+            loop = self._loop
+            if loop is not None:
+                try:
+                    for path, data in list(changes.items()):
+                        loop.call_soon_threadsafe(self.emit_external, data)
+                        del changes[path]
+                    return
+                except RuntimeError:
+                    # loop closed under us
+                    self._loop = None
+            pending = self._pending_changes
+            for path, data in changes.items():
+                if data['action'] != 'save' or path not in pending:
+                    pending[path] = data
+
+    def emit_external(self, data):
+        self.emit(data=data)
+        for listener in self.change_listeners:
+            listener(data)
+
+    def index_lookup(self, path: ApiPath):
+        """
+        Current index row for path or None if not indexed / stale.
+        """
+        if self.index is None:
+            return None
+        return self.index.lookup(path, self._get_os_path(path=path))
+
+    def index_saved(self, path: ApiPath, model, nb=None):
+        if self.index is None:
+            return
+        mtime_ns = entry_mtime_ns(self._get_os_path(path=path), model_kind(model))
+        self.index.update_entry(model, mtime_ns, nb=nb)
 
     def is_bundle(self, path: ApiPath | Path):
         if isinstance(path, Path) and path.is_absolute():
             os_path = path
         else:
+            if row := self.index_lookup(path):
+                return row['kind'] in BUNDLE_KINDS
             os_path = self._get_os_path(path=path)
         return BundlePath.valid_path(os_path)
 
@@ -37,11 +372,15 @@ class BundleContentsManager(FileManagerMixin, NBXContentsManager):
         os_path = self._get_os_path(path=path)
         if type == "notebook" or self.is_notebook(path, type):
             bundle = NotebookBundlePath(os_path)
+            bundle.artifact_worker = self.artifact_worker
+            bundle.output_threshold = self.output_threshold
         else:
             bundle = BundlePath(os_path)
         return bundle
 
     def get(self, path, content=True, type=None, format=None):
+        if self.watcher is not None:
+            self.bind_loop()
         os_path = self._get_os_path(path=path)
         path_item = bundle_get_path_item(os_path)
         # TODO: Someday we might allow accessing other files in bundle. But that's later.
@@ -72,14 +411,97 @@ class BundleContentsManager(FileManagerMixin, NBXContentsManager):
         model = DirectoryModel.from_filepath(
             os_path,
             self.root_dir,
-            content=content,
-            model_get=self.get,  # use out CM.get logic
+            content=False,
         )
+        if content:
+            model.content = self.get_dir_content(os_path, model.path)
+            # Copying jupyter idiom of only setting format when content is requested
+            model.format = 'json'
         return model
 
+    def get_dir_content(self, os_dir, path):
+        """
+        Child models for a directory listing. Entries are scanned once and
+        classified as a batch so each child costs at most one bundle probe.
+        """
+        dir_st, contents, entries = self.scan_dir_entries(os_dir, path)
+        if contents is not None:
+            return contents
+        listed, contents = self.dir_entry_models(path, entries)
+        self.record_dir_listing(path, dir_st, listed, contents)
+        return contents
+
+    def scan_dir_entries(self, os_dir, path):
+        """
+        First half of get_dir_content. Returns (dir stat, contents, entries)
+        where contents is the indexed listing if there is a current one.
+        """
+        dir_st = None
+        if self.index is not None:
+            dir_st = os.stat(os_dir)
+            contents = self.index.get_listing(path, dir_st.st_mtime_ns, os_dir)
+            if contents is not None:
+                return dir_st, contents, None
+
+        if self.listing_cache is not None:
+            entries = self.listing_cache.get_entries(os_dir)
+        else:
+            entries = scan_dir(os_dir)
+        return dir_st, None, list(filter_entries(entries))
+
+    def dir_entry_models(self, path, entries):
+        """
+        Classify entries and build their models. Returns (items, models) for
+        the entries that could be listed. Can be run on slices of a listing.
+        """
+        items = bundle_classify_entries(entries, executor=self.classify_executor)
+        listed = []
+        contents = []
+        for item in items:
+            child_path = f"{path}/{item.path.name}".strip('/')
+            try:
+                model = self.path_item_model(child_path, item)
+            except OSError as e:
+                # ELOOP: recursive symlink, also don't show failure due to permissions
+                if e.errno not in [errno.ELOOP, errno.EACCES]:
+                    pass
+                continue
+            listed.append(item)
+            contents.append(model)
+        return listed, contents
+
+    def record_dir_listing(self, path, dir_st, listed, contents):
+        if self.index is not None and not is_racy(dir_st):
+            self.index.record_listing(path, dir_st.st_mtime_ns, listed, contents)
+
+    def path_item_model(self, path, item: PathItem):
+        """
+        content=False model for a classified directory entry.
+        """
+        if item.is_bundle:
+            return self.bundle_get(path, content=False)
+
+        os_path = str(item.path)
+        if item.type == 'directory':
+            model_class = DirectoryModel
+        elif item.path.name.endswith('.ipynb'):
+            model_class = NotebookModel
+        else:
+            model_class = FileModel
+        return model_class.from_filepath(
+            os_path,
+            root_dir=self.root_dir,
+            content=False,
+            stat_res=item.stat,
+        )
+
     def bundle_get(self, path, content=True, type=None, format=None):
         bundle = self.get_bundle(path, type=type)
-        model = bundle.get_model(self.root_dir, content=content)
+        model = bundle.get_model(
+            self.root_dir,
+            content=content,
+            validation_policy=self.validation_policy,
+        )
         return model
 
     def save(self, model, path):
@@ -87,37 +509,64 @@ class BundleContentsManager(FileManagerMixin, NBXContentsManager):
         is_notebook = self.is_notebook(path)
         is_new = not os.path.exists(os_path)
         is_new_notebook = is_new and is_notebook
+        if self.watcher is not None:
+            self.bind_loop()
+        self.expect_change(path)
         # new files default to bundle
         if self.is_bundle(path) or is_new_notebook:
             bundle = self.get_bundle(path)
-            bundle.save(model)
+            changed = bundle.write(model)
+            if changed:
+                # saving inside the bundle dir doesn't bump the parent mtime
+                self.invalidate_listing(path)
             # refresh
-            model = self.get(path, content=False)
-            self.run_post_save_hooks(model=model, os_path=os_path)
-            return model.asdict()
+            saved_model = self.get(path, content=False)
+            if changed:
+                self.index_saved(path, saved_model, nb=model['content'])
+                self.run_post_save_hooks(model=saved_model, os_path=os_path)
+            return saved_model.asdict()
 
-        return self.fm.save(model, path)
+        saved_model = self.fm.save(model, path)
+        nb = model.get('content') if model.get('type') == 'notebook' else None
+        self.index_saved(path, saved_model, nb=nb)
+        return saved_model
 
     def delete_file(self, path):
         if self.is_bundle(path):
             raise NotImplementedError("Deleting bundle not supported yet")
-        return self.fm.delete_file(path)
+        self.expect_change(path)
+        self.fm.delete_file(path)
+        if self.index is not None:
+            self.index.delete(path)
 
     def rename_file(self, old_path, new_path):
+        self.expect_change(old_path)
+        self.expect_change(new_path)
         if self.is_bundle(old_path):
             bundle = self.get_bundle(old_path)
+            if self._artifact_worker is not None:
+                # artifacts are regenerated on the next save under the new name
+                self._artifact_worker.discard(str(bundle.bundle_path))
             new_name = os.path.basename(new_path)
             bundle.rename(new_name)
-            return
-        return self.fm.rename_file(old_path, new_path)
+            self.invalidate_listing(old_path)
+        else:
+            self.fm.rename_file(old_path, new_path)
+
+        if self.index is not None:
+            self.index.rename(old_path, new_path)
 
     def file_exists(self, path):
+        if row := self.index_lookup(path):
+            return row['kind'] != 'directory'
         os_path = self._get_os_path(path=path)
         if self.is_bundle(path):
             return True
         return os.path.isfile(os_path)
 
     def dir_exists(self, path: ApiPath):
+        if row := self.index_lookup(path):
+            return row['kind'] == 'directory'
         # if bundle the dir is a file
         if self.is_bundle(path):
             return False
@@ -141,8 +590,10 @@ class BundleContentsManager(FileManagerMixin, NBXContentsManager):
     def delete_all_checkpoints(self, path):
         if not self.is_bundle(path):
             return self.fm.checkpoints.delete_all_checkpoints(path)
+        self.get_bundle_checkpoints(path).delete_all()
 
     def rename_all_checkpoints(self, old_path, new_path):
+        # bundle checkpoints live inside the bundle and move with it
         if not self.is_bundle(old_path):
             return self.fm.checkpoints.rename_all_checkpoints(old_path, new_path)
 
@@ -155,6 +606,7 @@ class BundleContentsManager(FileManagerMixin, NBXContentsManager):
             return
 
         # get into bundle dir
+        self.expect_change(path)
         bundle = self.get_bundle(path)
         bundle_path = bundle.bundle_path
 
@@ -171,101 +623,40 @@ class BundleContentsManager(FileManagerMixin, NBXContentsManager):
 
         shutil.move(bundle_path, trash_path)
 
-    # Checkpoint-related utilities
-    def _get_checkpoint_dir(self, path):
-        checkpoint_dir = os.path.join(path, '.ipynb_checkpoints')
-        return ApiPath(checkpoint_dir)
-
-    def get_checkpoint_path(self, checkpoint_id, path):
-        """find the path to a checkpoint"""
-        path = path.strip('/')
-        checkpoint_dir = self._get_checkpoint_dir(path)
-        name = path.rsplit('/', 1)[-1]
-        basename, ext = os.path.splitext(name)
-        filename = u"{name}---{checkpoint_id}{ext}".format(
-            name=basename,
-            checkpoint_id=checkpoint_id,
-            ext=ext,
-        )
-        cp_path = os.path.join(checkpoint_dir, filename)
-        return ApiPath(cp_path)
-
-    def extract_checkpoint_id(self, path):
-        """
-        Not currently used...
-
-        extra checkpoint_id from strings of form
-        "{basename}---{checkpoint_id}.ipynb"
-        """
-        name = path.rsplit('/', 1)[-1]
-        basename, ext = os.path.splitext(name)
-        checkpoint_basename, _ = os.path.splitext(name)
-        prefix = "{name}---".format(name=basename)
-        return checkpoint_basename.replace(prefix, '')
-
-    def get_checkpoint_model(self, checkpoint_id, path):
-        """construct the info dict for a given checkpoint"""
-        path = path.strip('/')
-        cp_path = self.get_checkpoint_path(checkpoint_id, path)
-        os_cp_path = self._get_os_path(path=cp_path)
-        stats = os.stat(os_cp_path)
-        last_modified = tz.utcfromtimestamp(stats.st_mtime)
-        info = dict(
-            id=checkpoint_id,
-            last_modified=last_modified,
-        )
-        return info
+    # Checkpoints
+    def get_bundle_checkpoints(self, path: ApiPath) -> BundleCheckpoints:
+        os_path = self._get_os_path(path=path)
+        return BundleCheckpoints(os_path, max_checkpoints=self.max_bundle_checkpoints)
 
     def create_checkpoint(self, path):
         if not self.is_bundle(path):
             return self.fm.create_checkpoint(path)
-
-        now = datetime.datetime.now()
-        checkpoint_id = now.strftime("%Y-%m-%d %H:%M:%S")
-        checkpoint_dir = self._get_checkpoint_dir(path)
-        os_checkpoint_dir = self._get_os_path(path=checkpoint_dir)
-        if not os.path.exists(os_checkpoint_dir):
-            os.mkdir(os_checkpoint_dir)
-
-        bundle = self.get_bundle(path)
-        cp_path = self.get_checkpoint_path(checkpoint_id, path)
-        os_cp_path = self._get_os_path(cp_path)
-
-        self._copy(bundle.bundle_file, os_cp_path)
-
-        # return the checkpoint info
-        return self.get_checkpoint_model(checkpoint_id, path)
+        return self.get_bundle_checkpoints(path).create()
 
     def list_checkpoints(self, path):
         """Return a list of checkpoints for a given notebook"""
         if not self.is_bundle(path):
             return self.fm.list_checkpoints(path)
-
-        path = path.strip('/')
-
-        checkpoint_dir = self._get_checkpoint_dir(path)
-        os_checkpoint_dir = self._get_os_path(path=checkpoint_dir)
-        if not os.path.exists(os_checkpoint_dir):
-            return []
-
-        name = path.rsplit('/', 1)[-1]
-        basename, ext = os.path.splitext(name)
-        prefix = "{name}---".format(name=basename)
-
-        _, _, files = next(os.walk(os_checkpoint_dir))
-        cp_names = [fn for fn in files if fn.startswith(prefix)]
-        cp_basenames = map(lambda fn: os.path.splitext(fn)[0], cp_names)
-        checkpoint_ids = map(lambda fn: fn.replace(prefix, ''), cp_basenames)
-        return [self.get_checkpoint_model(checkpoint_id, path)
-                for checkpoint_id in checkpoint_ids]
+        return self.get_bundle_checkpoints(path).list_checkpoints()
 
     def restore_checkpoint(self, checkpoint_id, path=''):
         """Restore a notebook from one of its checkpoints"""
-        raise NotImplementedError("must be implemented in a subclass")
+        if not self.is_bundle(path):
+            return self.fm.restore_checkpoint(checkpoint_id, path)
+
+        data = self.get_bundle_checkpoints(path).read(checkpoint_id)
+        bundle = self.get_bundle(path)
+        self.expect_change(path)
+        if bundle.restore(data):
+            self.invalidate_listing(path)
+            nb = reads_notebook(data) if isinstance(bundle, NotebookBundlePath) else None
+            self.index_saved(path, self.get(path, content=False), nb=nb)
 
     def delete_checkpoint(self, checkpoint_id, path=''):
         """delete a checkpoint for a notebook"""
-        raise NotImplementedError("must be implemented in a subclass")
+        if not self.is_bundle(path):
+            return self.fm.delete_checkpoint(checkpoint_id, path)
+        self.get_bundle_checkpoints(path).delete(checkpoint_id)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+"""
+Large cell outputs stored next to the notebook instead of inside it.
+
+When a NotebookBundlePath has an output_threshold, outputs whose payload is at
+least that many bytes are written to
+
+    <bundle>/_nbx/outputs/<digest>.json
+
+and replaced in the .ipynb by an empty output of the same type. The cell
+records which of its outputs were moved out
+
+    cell.metadata.nbx_outputs = {"<output index>": "<digest>"}
+
+so the file on disk is still a valid notebook. Reading the bundle joins them
+back in.
+
+Blobs are content addressed. A save where the plots didn't change rewrites the
+small .ipynb and nothing else.
+"""
+import os
+from pathlib import Path
+
+import nbformat
+from nbformat import NotebookNode
+
+from nbx_deux import nbjson
+from nbx_deux.trust_cache import content_digest
+
+OUTPUTS_DIR = os.path.join('_nbx', 'outputs')
+OUTPUTS_KEY = 'nbx_outputs'
+
+
+def _text_size(value) -> int:
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, list):
+        return sum(len(v) for v in value if isinstance(v, str))
+    # json mimetypes. rough is fine here.
+    return len(str(value))
+
+
+def output_size(output) -> int:
+    """
+    Rough size of an output's payload without serializing it.
+    """
+    output_type = output.get('output_type')
+    if output_type == 'stream':
+        return _text_size(output.get('text', ''))
+    if output_type == 'error':
+        return _text_size(output.get('traceback', []))
+    return sum(_text_size(v) for v in output.get('data', {}).values())
+
+
+def output_stub(output) -> dict:
+    """
+    Smallest valid output of the same type, to hold output's place.
+    """
+    output_type = output['output_type']
+    if output_type == 'stream':
+        return {'output_type': 'stream', 'name': output['name'], 'text': ''}
+    if output_type == 'error':
+        return {
+            'output_type': 'error',
+            'ename': output['ename'],
+            'evalue': output['evalue'],
+            'traceback': [],
+        }
+    stub = {'output_type': output_type, 'data': {}, 'metadata': {}}
+    if output_type == 'execute_result':
+        stub['execution_count'] = output.get('execution_count')
+    return stub
+
+
+def split_outputs(nb, threshold) -> tuple[NotebookNode, dict[str, bytes]]:
+    """
+    Returns (disk_nb, blobs). disk_nb shares everything with nb except the
+    cells that had outputs moved out. blobs is {digest: serialized output}.
+    """
+    blobs: dict[str, bytes] = {}
+    cells = []
+    for cell in nb['cells']:
+        outputs = cell.get('outputs')
+        if not outputs and OUTPUTS_KEY not in cell.get('metadata', {}):
+            cells.append(cell)
+            continue
+
+        refs = {}
+        disk_outputs = []
+        for i, output in enumerate(outputs or []):
+            if output_size(output) < threshold:
+                disk_outputs.append(output)
+                continue
+            data = nbjson.BACKEND.dumps(output)
+            digest = content_digest(data)
+            blobs[digest] = data
+            refs[str(i)] = digest
+            disk_outputs.append(output_stub(output))
+
+        metadata = {k: v for k, v in cell['metadata'].items() if k != OUTPUTS_KEY}
+        if refs:
+            metadata[OUTPUTS_KEY] = refs
+        cell = NotebookNode(cell)
+        cell['metadata'] = NotebookNode(metadata)
+        if 'outputs' in cell:
+            cell['outputs'] = disk_outputs
+        cells.append(cell)
+
+    disk_nb = NotebookNode(nb)
+    disk_nb['cells'] = cells
+    return disk_nb, blobs
+
+
+def referenced_outputs(nb) -> set[str]:
+    digests = set()
+    for cell in nb.get('cells', []):
+        refs = cell.get('metadata', {}).get(OUTPUTS_KEY)
+        if refs:
+            digests.update(refs.values())
+    return digests
+
+
+class BundleOutputs:
+    def __init__(self, bundle_path):
+        self.bundle_path = Path(bundle_path)
+        self.outputs_dir = self.bundle_path.joinpath(OUTPUTS_DIR)
+
+    def path(self, digest) -> Path:
+        return self.outputs_dir.joinpath(digest + '.json')
+
+    def write(self, blobs: dict[str, bytes]) -> int:
+        """
+        Write the blobs that don't exist yet. Returns how many were written.
+        """
+        written = 0
+        for digest, data in blobs.items():
+            path = self.path(digest)
+            if path.exists():
+                continue
+            self.outputs_dir.mkdir(exist_ok=True, parents=True)
+            tmp_path = path.with_name(digest + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            written += 1
+        return written
+
+    def read(self, digest) -> NotebookNode:
+        with open(self.path(digest), 'rb') as f:
+            return nbformat.from_dict(nbjson.BACKEND.loads(f.read()))
+
+    def join(self, nb):
+        """
+        Put externalized outputs back into nb, in place.
+
+        A ref that no longer lines up with the cell's outputs (the ipynb was
+        edited outside nbx) or whose blob is gone keeps its placeholder.
+        """
+        for cell in nb['cells']:
+            refs = cell.get('metadata', {}).pop(OUTPUTS_KEY, None)
+            if not refs:
+                continue
+            outputs = cell.get('outputs', [])
+            for index, digest in refs.items():
+                try:
+                    i = int(index)
+                    if not 0 <= i < len(outputs):
+                        raise IndexError(f"no output {index}")
+                    outputs[i] = self.read(digest)
+                except (ValueError, IndexError, OSError) as e:
+                    nbformat.get_logger().warning(
+                        "Skipping output %s of cell %s: %r", index, cell.get('id'), e,
+                    )
+        return nb
+
+    def stored(self) -> set[str]:
+        try:
+            names = os.listdir(self.outputs_dir)
+        except FileNotFoundError:
+            return set()
+        return {name[:-len('.json')] for name in names if name.endswith('.json')}
+
+    def prune(self, keep: set[str]) -> int:
+        """
+        Remove blobs not in keep. Returns how many were removed.
+        """
+        removed = 0
+        for digest in self.stored() - keep:
+            try:
+                os.unlink(self.path(digest))
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from ..artifact_worker import ArtifactWorker
+
+
+def test_artifact_worker_coalesces():
+    worker = ArtifactWorker()
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def blocker():
+        started.set()
+        release.wait()
+
+    worker.submit('a.ipynb', blocker)
+    started.wait()
+    # a.ipynb is running. Only the last of the queued jobs should run after it.
+    for i in range(3):
+        worker.submit('a.ipynb', ran.append, ('a', i))
+    worker.submit('b.ipynb', ran.append, ('b', 0))
+    assert worker.pending() == ['a.ipynb', 'b.ipynb']
+
+    release.set()
+    assert worker.flush(timeout=5)
+    assert ran == [('a', 2), ('b', 0)]
+
+    stats = worker.stats()
+    assert stats['coalesced'] == 2
+    assert stats['processed'] == 3
+    worker.shutdown()
+
+
+def test_artifact_worker_errors_and_shutdown():
+    worker = ArtifactWorker()
+
+    def boom():
+        raise ValueError('boom')
+
+    worker.submit('a.ipynb', boom)
+    worker.submit('b.ipynb', lambda: None)
+    assert worker.flush(timeout=5)
+    assert worker.stats()['errors'] == 1
+
+    assert worker.discard('b.ipynb') is False
+    worker.shutdown()
+    with pytest.raises(Exception, match='shut down'):
+        worker.submit('a.ipynb', lambda: None)
@@ -1,11 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from unittest import mock
+
+from nbx_deux import listing
+from nbx_deux.listing import scan_dir
 from nbx_deux.models import NotebookModel
 from nbx_deux.testing import TempDir
-from nbformat.v4 import new_notebook, writes
+from nbx_deux.trust_cache import content_digest
+from nbformat.v4 import new_code_cell, new_notebook, writes
 
 
+from .. import bundle as bundle_mod
 from ..bundle import (
+    BundlePath,
     NotebookBundlePath,
+    bundle_classify_entries,
 )
+from ..bundle_digests import BundleDigests
 
 
 def test_notebook_bundle_file():
@@ -62,3 +73,210 @@ def test_notebook_bundle_save():
 
         new_model = bundle.get_model(td)
         assert new_model['content'] == nb
+
+
+def test_bundle_classify_entries():
+    with TempDir() as td:
+        td.joinpath('subdir').mkdir()
+        td.joinpath('example.txt').mkdir()
+        td.joinpath('example.txt/example.txt').write_text('bundle')
+        td.joinpath('example.ipynb').mkdir()
+        td.joinpath('example.ipynb/example.ipynb').write_text(writes(new_notebook()))
+        td.joinpath('sup.txt').write_text('sups')
+
+        entries = scan_dir(td)
+        items = bundle_classify_entries(entries)
+        kinds = {item.path.name: item.kind for item in items}
+        assert kinds == {
+            'subdir': 'directory',
+            'example.txt': 'bundle',
+            'example.ipynb': 'notebook_bundle',
+            'sup.txt': 'file',
+        }
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            threaded = bundle_classify_entries(entries, executor=executor)
+        assert threaded == items
+        assert [item.path.name for item in threaded] == [entry.name for entry in entries]
+
+
+def test_notebook_bundle_incremental_save():
+    with TempDir() as td:
+        nb_dir = td.joinpath('example.ipynb')
+        nb = new_notebook()
+        nb.cells.append(new_code_cell('1 + 1'))
+        bundle = NotebookBundlePath(nb_dir)
+        model = NotebookModel.from_nbnode(nb, name='example.ipynb', path='example.ipynb')
+        assert bundle.write(model) is True
+
+        nb_file = bundle.bundle_file
+        extract = nb_dir.joinpath('_nbx/example.py')
+        assert nb_dir.joinpath('_nbx/digests.json').exists()
+        mtime = nb_file.stat().st_mtime_ns
+
+        # autosave of the same notebook touches nothing
+        with mock.patch.object(bundle_mod, '_save_notebook') as save_notebook, \
+                mock.patch.object(bundle_mod, 'NBXNotebookExport') as export:
+            assert bundle.write(model) is False
+            assert save_notebook.call_count == 0
+            assert export.call_count == 0
+        assert nb_file.stat().st_mtime_ns == mtime
+
+        # a missing extract is regenerated without rewriting the notebook
+        extract.unlink()
+        assert bundle.write(model) is False
+        assert extract.exists()
+        assert nb_file.stat().st_mtime_ns == mtime
+
+        # edits made outside of nbx are not mistaken for unchanged
+        nb_file.write_text(writes(new_notebook()))
+        assert bundle.write(model) is True
+        assert bundle.get_model(td)['content'] == nb
+
+        nb.cells.append(new_code_cell('2 + 2'))
+        assert bundle.write(model) is True
+        assert '2 + 2' in extract.read_text()
+
+
+def test_notebook_bundle_nbx_extract_edits():
+    with TempDir() as td:
+        nb_dir = td.joinpath('example.ipynb')
+        nb = new_notebook()
+        nb.cells.append(new_code_cell('1 + 1', id='first'))
+        nb.cells.append(new_code_cell('2 + 2', id='second'))
+        bundle = NotebookBundlePath(nb_dir)
+        model = NotebookModel.from_nbnode(nb, name='example.ipynb', path='example.ipynb')
+        bundle.write(model)
+        assert not bundle.nbx_extract_edited()
+
+        # edited in an external editor
+        extract = nb_dir.joinpath('_nbx/example.py')
+        extract.write_text(extract.read_text().replace('2 + 2', 'print("edited")'))
+        data = bundle.bundle_file.read_bytes()
+        assert bundle.nbx_extract_edited()
+
+        content = bundle.get_model(td)['content']
+        assert [cell.source for cell in content.cells] == ['1 + 1', 'print("edited")']
+        assert bundle.bundle_file.read_bytes() == data
+
+        # saving the merged notebook brings the two back in line
+        model['content'] = content
+        assert bundle.write(model)
+        assert not bundle.nbx_extract_edited()
+        assert 'print("edited")' in extract.read_text()
+
+
+def test_notebook_bundle_save_after_extract_edit():
+    with TempDir() as td:
+        nb_dir = td.joinpath('example.ipynb')
+        nb = new_notebook()
+        nb.cells.append(new_code_cell('y = 2', id='first'))
+        bundle = NotebookBundlePath(nb_dir)
+        model = NotebookModel.from_nbnode(nb, name='example.ipynb', path='example.ipynb')
+        bundle.write(model)
+
+        extract = nb_dir.joinpath('_nbx/example.py')
+        extract.write_text(extract.read_text().replace('y = 2', 'y = 999'))
+
+        # an autosave of the model from before the edit
+        assert bundle.write(model)
+        assert 'y = 999' in extract.read_text()
+        assert not bundle.nbx_extract_edited()
+        content = bundle.get_model(td)['content']
+        assert [cell.source for cell in content.cells] == ['y = 999']
+
+
+def test_notebook_bundle_nbx_extract_partial():
+    with TempDir() as td:
+        nb_dir = td.joinpath('example.ipynb')
+        nb = new_notebook()
+        nb.cells.append(new_code_cell('1 + 1', id='first'))
+        nb.cells.append(new_code_cell('2 + 2', id='second'))
+        bundle = NotebookBundlePath(nb_dir)
+        model = NotebookModel.from_nbnode(nb, name='example.ipynb', path='example.ipynb')
+        bundle.write(model)
+
+        # cut off mid write by another program
+        extract = nb_dir.joinpath('_nbx/example.py')
+        text = extract.read_text()
+        extract.write_text(text[:text.index('2 + 2')].rsplit('# %%', 1)[0])
+        assert bundle.nbx_extract_edited()
+        content = bundle.get_model(td)['content']
+        assert [cell.source for cell in content.cells] == ['1 + 1', '2 + 2']
+
+        # once it has settled a missing cell is a deletion
+        with mock.patch.object(listing, 'RACY_WINDOW_NS', 0):
+            content = bundle.get_model(td)['content']
+        assert [cell.source for cell in content.cells] == ['1 + 1']
+
+        # and a file we can't parse never is
+        extract.write_text('# %% [markdown] id="first"\n# %% id="first"\n')
+        with mock.patch.object(listing, 'RACY_WINDOW_NS', 0):
+            content = bundle.get_model(td)['content']
+        assert [cell.source for cell in content.cells] == ['1 + 1', '2 + 2']
+
+
+def test_write_chunks_if_changed_streams():
+    with TempDir() as td:
+        bundle = BundlePath(td.joinpath('example.txt'))
+        bundle.bundle_path.mkdir()
+        digests = BundleDigests(bundle.bundle_path)
+        calls = []
+
+        def iter_chunks():
+            calls.append(1)
+            return (chunk for chunk in [b'a', b'b', b'c'])
+
+        assert bundle.write_chunks_if_changed('out.txt', iter_chunks, digests)
+        assert td.joinpath('example.txt/out.txt').read_bytes() == b'abc'
+        # hashed, then written
+        assert len(calls) == 2
+
+        # unchanged content is only hashed
+        calls.clear()
+        assert not bundle.write_chunks_if_changed('out.txt', iter_chunks, digests)
+        assert len(calls) == 1
+        # written via a temp file that doesn't stick around
+        assert sorted(os.listdir(bundle.bundle_path)) == ['out.txt']
+
+        # the digest recorded is of what got written, even if the content
+        # moved between the hashing and writing passes
+        passes = iter([[b'x'], [b'y', b'z']])
+        assert bundle.write_chunks_if_changed('out.txt', lambda: iter(next(passes)), digests)
+        assert td.joinpath('example.txt/out.txt').read_bytes() == b'yz'
+        assert digests.get('out.txt') == content_digest(b'yz')
+        assert digests.is_current('out.txt')
+
+
+def test_bundle_write_files():
+    with TempDir() as td:
+        bundle_dir = td.joinpath('example.txt')
+        bundle = BundlePath(bundle_dir)
+        model = {'content': 'hi', 'bundle_files': {'meta.txt': 'meta'}}
+        assert bundle.write(model) is True
+        assert bundle.write(model) is False
+
+        assert bundle.write_files(model) is True
+        assert bundle.write_files(model) is False
+        model['bundle_files']['meta.txt'] = 'changed'
+        assert bundle.write_files(model) is True
+        assert bundle.files_pack() == {'meta.txt': 'changed'}
+
+
+def test_bundle_digests_racy():
+    with TempDir() as td:
+        bundle_dir = td.joinpath('example.txt')
+        bundle_dir.mkdir()
+        bundle_file = bundle_dir.joinpath('example.txt')
+        bundle_file.write_text('hi')
+
+        digests = BundleDigests(bundle_dir)
+        digest = content_digest(b'hi')
+        digests.record('example.txt', digest)
+        assert digests.is_current('example.txt', digest)
+
+        # same size, same mtime, different bytes
+        st = bundle_file.stat()
+        bundle_file.write_text('yo')
+        os.utime(bundle_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+        assert not digests.is_current('example.txt', digest)
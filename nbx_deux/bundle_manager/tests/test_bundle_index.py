@@ -0,0 +1,120 @@
+import os
+from unittest import mock
+
+from nbformat.v4 import new_notebook, new_code_cell, writes
+
+from nbx_deux import listing
+from nbx_deux.models import NotebookModel
+from nbx_deux.testing import TempDir
+from ..bundle_nbmanager import BundleContentsManager
+from ..bundle_index import BundleIndex
+from .test_bundle_nbmanager import stage_bundle_workspace
+
+
+def backdate(path, seconds=10):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns - seconds * 10**9))
+
+
+def test_bundle_index_listing():
+    with TempDir() as td, TempDir() as index_dir:
+        stage_bundle_workspace(td)
+        backdate(td)
+        index_path = index_dir.joinpath('index.sqlite')
+        nbm = BundleContentsManager(root_dir=str(td), index_path=str(index_path))
+        plain = BundleContentsManager(root_dir=str(td))
+
+        model = nbm.get("")
+        assert model.asdict() == plain.get("").asdict()
+
+        # second listing comes from the index without scanning
+        with mock.patch.object(listing, 'scan_dir') as scan_dir:
+            with mock.patch('nbx_deux.bundle_manager.bundle_nbmanager.scan_dir', scan_dir):
+                indexed = nbm.get("")
+        assert scan_dir.call_count == 0
+        indexed_content = {m['path']: m.asdict() for m in indexed.content}
+        content = {m['path']: m.asdict() for m in model.content}
+        assert indexed_content == content
+
+        # index survives restarts
+        nbm2 = BundleContentsManager(root_dir=str(td), index_path=str(index_path))
+        assert nbm2.index.get_listing("", os.stat(td).st_mtime_ns, str(td)) is not None
+
+        assert nbm.is_bundle('example.txt')
+        assert nbm.file_exists('example.txt')
+        assert not nbm.dir_exists('example.txt')
+        assert nbm.dir_exists('subdir')
+        assert nbm.file_exists('sup.txt')
+
+        # in place rewrite of a bundle's notebook, dir mtimes don't move
+        bundle_file = td.joinpath('subdir/example.ipynb/example.ipynb')
+        bundle_dir_st = os.stat(td.joinpath('subdir/example.ipynb'))
+        nb = new_notebook(cells=[new_code_cell('x = 1' * 1000)])
+        with bundle_file.open('w') as f:
+            f.write(writes(nb))
+        st = os.stat(bundle_file)
+        os.utime(bundle_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert os.stat(td.joinpath('subdir/example.ipynb')) == bundle_dir_st
+        nbm3 = BundleContentsManager(root_dir=str(td), index_path=str(index_path))
+        for manager in (nbm, nbm3):
+            sizes = {m['name']: m['size'] for m in manager.get("subdir").content}
+            assert sizes['example.ipynb'] == os.stat(bundle_file).st_size
+
+        # new entry changes the directory mtime. listing is rebuilt
+        td.joinpath('new.txt').write_text('new')
+        model = nbm.get("")
+        assert 'new.txt' in model.contents_dict()
+
+
+def test_bundle_index_save_rename():
+    with TempDir() as td, TempDir() as index_dir:
+        index_path = index_dir.joinpath('index.sqlite')
+        nbm = BundleContentsManager(root_dir=str(td), index_path=str(index_path))
+
+        nb = new_notebook()
+        nb['metadata']['gist_id'] = 'abc'
+        nb['metadata']['kernelspec'] = {'name': 'python3', 'display_name': 'Python 3'}
+        nb.cells.append(new_code_cell('1 + 1'))
+        model = NotebookModel.from_nbnode(nb, path='hi.ipynb', name='hi.ipynb')
+        nbm.save(model, 'hi.ipynb')
+
+        row = nbm.index.get_entry('hi.ipynb')
+        assert row['kind'] == 'notebook_bundle'
+        assert row['gist_id'] == 'abc'
+        assert row['kernel'] == 'python3'
+        assert row['cell_count'] == 1
+        assert nbm.is_bundle('hi.ipynb')
+
+        nbm.rename_file('hi.ipynb', 'bye.ipynb')
+        assert nbm.index.get_entry('hi.ipynb') is None
+        row = nbm.index.get_entry('bye.ipynb')
+        assert row['gist_id'] == 'abc'
+        assert not nbm.file_exists('hi.ipynb')
+
+        # external change to the bundle dir invalidates the row
+        td.joinpath('bye.ipynb/extra.txt').write_text('extra')
+        st = os.stat(td.joinpath('bye.ipynb'))
+        os.utime(td.joinpath('bye.ipynb'), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert nbm.index_lookup('bye.ipynb') is None
+        assert nbm.is_bundle('bye.ipynb')
+
+
+def test_bundle_index_delete():
+    with TempDir() as td:
+        index = BundleIndex(td.joinpath('index.sqlite'))
+        td.joinpath('root/a_b').mkdir(parents=True)
+        td.joinpath('root/a_b/file.txt').write_text('hi')
+        td.joinpath('root/axb').mkdir()
+        nbm = BundleContentsManager(root_dir=str(td.joinpath('root')))
+        with mock.patch.object(listing, 'RACY_WINDOW_NS', 0):
+            for path in ('', 'a_b', 'axb'):
+                items_model = nbm.get(path)
+                for child in items_model.content:
+                    index.update_entry(child, 0)
+
+        assert index.get_entry('a_b/file.txt') is not None
+        index.delete('a_b')
+        assert index.get_entry('a_b') is None
+        assert index.get_entry('a_b/file.txt') is None
+        # LIKE wildcards are escaped
+        assert index.get_entry('axb') is not None
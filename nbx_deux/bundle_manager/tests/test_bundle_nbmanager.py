@@ -1,6 +1,13 @@
-from nbformat.v4 import new_notebook, writes
+import asyncio
+import os
+from unittest import mock
 
+from nbformat.v4 import new_code_cell, new_notebook, writes
+
+from nbx_deux import listing
+from nbx_deux.meta_manager import MetaManager
 from nbx_deux.testing import TempDir
+from nbx_deux.watcher import UNWATCHED, ChangeEvent
 from ..bundle_nbmanager import (
     BundleContentsManager
 )
@@ -89,5 +96,237 @@ def test_bundle_contents_manager():
         assert subdir_contents_dict['subdir/example.ipynb'] == nb_model
 
 
+def test_bundle_classify_workers():
+    with TempDir() as td:
+        stage_bundle_workspace(td)
+        serial = BundleContentsManager(root_dir=str(td))
+        threaded = BundleContentsManager(root_dir=str(td), bundle_classify_workers=4)
+
+        model = serial.get("")
+        threaded_model = threaded.get("")
+        assert [m['name'] for m in threaded_model.content] == [m['name'] for m in model.content]
+        assert threaded_model.asdict() == model.asdict()
+
+
+def test_unchanged_save_skips_hooks():
+    with TempDir() as td:
+        stage_bundle_workspace(td)
+        nbm = BundleContentsManager(root_dir=str(td))
+        calls = []
+        nbm.register_post_save_hook(lambda **kwargs: calls.append(kwargs['os_path']))
+
+        model = nbm.get("subdir/example.ipynb").asdict()
+        nbm.save(model, "subdir/example.ipynb")
+        assert len(calls) == 1
+
+        saved = nbm.save(model, "subdir/example.ipynb")
+        assert saved['name'] == 'example.ipynb'
+        assert len(calls) == 1
+
+        model['content']['metadata']['howdy'] = 'bye'
+        nbm.save(model, "subdir/example.ipynb")
+        assert len(calls) == 2
+
+
+def test_async_artifacts():
+    with TempDir() as td:
+        stage_bundle_workspace(td)
+        nbm = BundleContentsManager(root_dir=str(td), async_artifacts=True)
+        extract = td.joinpath('subdir/example.ipynb/_nbx/example.py')
+
+        model = nbm.get("subdir/example.ipynb").asdict()
+        for i in range(5):
+            model['content']['cells'].append(new_code_cell(f'x = {i}'))
+            nbm.save(model, "subdir/example.ipynb")
+        assert nbm.flush_artifacts(timeout=5)
+
+        assert 'x = 4' in extract.read_text()
+        stats = nbm.artifact_worker.stats()
+        assert stats['errors'] == 0
+        assert stats['processed'] + stats['coalesced'] == 5
+
+
+def test_bundle_checkpoints():
+    with TempDir() as td:
+        stage_bundle_workspace(td)
+        nbm = BundleContentsManager(root_dir=str(td))
+        path = "subdir/example.ipynb"
+        checkpoints = nbm.get_bundle_checkpoints(path)
+
+        cp1 = nbm.create_checkpoint(path)
+        # unchanged notebook doesn't make a new checkpoint
+        assert nbm.create_checkpoint(path) == cp1
+
+        model = nbm.get(path).asdict()
+        model['content']['cells'].append(new_code_cell('x = 1'))
+        nbm.save(model, path)
+        cp2 = nbm.create_checkpoint(path)
+        assert cp2['id'] != cp1['id']
+        assert [cp['id'] for cp in nbm.list_checkpoints(path)] == [cp1['id'], cp2['id']]
+        assert len(list(checkpoints.objects_dir.iterdir())) == 2
+
+        # back to the first state. its content is stored once.
+        nbm.restore_checkpoint(cp1['id'], path)
+        assert nbm.get(path)['content']['cells'] == []
+        cp3 = nbm.create_checkpoint(path)
+        assert len(nbm.list_checkpoints(path)) == 3
+        assert len(list(checkpoints.objects_dir.iterdir())) == 2
+
+        # the object stays until nothing refers to it
+        nbm.delete_checkpoint(cp1['id'], path)
+        assert len(list(checkpoints.objects_dir.iterdir())) == 2
+        nbm.delete_checkpoint(cp3['id'], path)
+        assert len(list(checkpoints.objects_dir.iterdir())) == 1
+
+        nbm.restore_checkpoint(cp2['id'], path)
+        assert nbm.get(path)['content']['cells'][0]['source'] == 'x = 1'
+        # checkpoint store isn't a bundle file
+        assert 'manifest.json' not in nbm.get(path)['bundle_files']
+
+        nbm.delete_all_checkpoints(path)
+        assert nbm.list_checkpoints(path) == []
+        assert checkpoints.disk_usage() == 0
+
+
+def test_bundle_checkpoints_legacy_and_limit():
+    with TempDir() as td:
+        stage_bundle_workspace(td)
+        nbm = BundleContentsManager(root_dir=str(td), max_bundle_checkpoints=2)
+        path = "subdir/example.ipynb"
+        bundle_dir = td.joinpath(path)
+
+        # old style whole copies
+        legacy_dir = bundle_dir.joinpath('.ipynb_checkpoints')
+        legacy_dir.mkdir()
+        data = bundle_dir.joinpath('example.ipynb').read_bytes()
+        legacy_dir.joinpath('example---2020-01-01 00:00:00.ipynb').write_bytes(data)
+
+        checkpoints = nbm.list_checkpoints(path)
+        assert [cp['id'] for cp in checkpoints] == ['2020-01-01 00:00:00']
+        assert not legacy_dir.joinpath('example---2020-01-01 00:00:00.ipynb').exists()
+
+        model = nbm.get(path).asdict()
+        for i in range(3):
+            model['content']['cells'].append(new_code_cell(f'x = {i}'))
+            nbm.save(model, path)
+            nbm.create_checkpoint(path)
+        checkpoints = nbm.list_checkpoints(path)
+        assert len(checkpoints) == 2
+        assert '2020-01-01 00:00:00' not in [cp['id'] for cp in checkpoints]
+        assert len(list(legacy_dir.joinpath('objects').iterdir())) == 2
+
+
 if __name__ == '__main__':
     ...
+
+
+def test_watch_external_changes():
+    with TempDir() as td, mock.patch.object(listing, 'RACY_WINDOW_NS', 0):
+        stage_bundle_workspace(td)
+        nbm = BundleContentsManager(
+            root_dir=str(td),
+            listing_cache_size=16,
+            watch_files='poll',
+            watch_poll_interval=3600,
+        )
+        changes = []
+        nbm.change_listeners.append(changes.append)
+
+        async def poll():
+            # events are handed to the loop
+            nbm.watcher.poll()
+            await asyncio.sleep(0)
+
+        async def run():
+            sizes = {m['name']: m['size'] for m in nbm.get('')['content']}
+            assert sizes['sup.txt'] == 4
+
+            # in place edit doesn't touch the dir mtime. the watcher catches it.
+            with td.joinpath('sup.txt').open('a') as f:
+                f.write(' and more')
+            await poll()
+            sizes = {m['name']: m['size'] for m in nbm.get('')['content']}
+            assert sizes['sup.txt'] == 13
+            assert changes == [{'action': 'save', 'path': 'sup.txt'}]
+
+            # edits inside a bundle are edits of the bundle
+            changes.clear()
+            td.joinpath('subdir/example.ipynb/howdy.txt').write_text('edited')
+            td.joinpath('new.txt').write_text('new')
+            await poll()
+            assert sorted(changes, key=lambda d: d['path']) == [
+                {'action': 'create', 'path': 'new.txt'},
+                {'action': 'save', 'path': 'subdir/example.ipynb'},
+            ]
+
+            # our own saves aren't reported
+            changes.clear()
+            model = nbm.get('subdir/example.ipynb')
+            model['content'].cells.append(new_code_cell('1 + 1'))
+            nbm.save(model, 'subdir/example.ipynb')
+            await poll()
+            assert changes == []
+
+        try:
+            asyncio.run(run())
+        finally:
+            nbm.stop_watcher()
+        assert nbm.watcher is None
+
+
+def test_unwatched_dir_stops_trusting_watcher():
+    with TempDir() as td:
+        td.joinpath('new').mkdir()
+        nbm = BundleContentsManager(root_dir=str(td), listing_cache_size=16)
+        nbm.listing_cache.watched = True
+        nbm.get('new')
+        # a directory the watcher couldn't cover. listings are stat'd again.
+        nbm.handle_fs_events([ChangeEvent(UNWATCHED, str(td.joinpath('new')), is_dir=True)])
+        assert not nbm.listing_cache.watched
+        td.joinpath('new/a.txt').write_text('a')
+        assert [m['name'] for m in nbm.get('new')['content']] == ['a.txt']
+
+
+def test_meta_manager_watch_aliases():
+    with TempDir() as td:
+        td.joinpath('one').mkdir()
+        td.joinpath('one/c.txt').write_text('c')
+        meta = MetaManager(
+            bundle_dirs={'one': str(td.joinpath('one'))},
+            watch_files='poll',
+            watch_poll_interval=3600,
+        )
+        emitted = []
+
+        async def listener(logger, schema_id, data):
+            emitted.append(data)
+
+        meta.event_logger.add_listener(schema_id=meta.event_schema_id, listener=listener)
+        watcher = meta.managers['one'].watcher
+
+        async def settle():
+            # call_soon_threadsafe, then the listener task
+            for _ in range(3):
+                await asyncio.sleep(0)
+
+        async def run():
+            # seen before the server's loop ran. held until the first request.
+            assert emitted == []
+            meta.get('')
+            await settle()
+            assert emitted == [{'action': 'create', 'path': 'one/b'}]
+
+            # the watcher thread hands them to the loop
+            emitted.clear()
+            td.joinpath('one/c.txt').write_text('edited')
+            await asyncio.to_thread(watcher.poll)
+            await settle()
+            assert emitted == [{'action': 'save', 'path': 'one/c.txt'}]
+
+        try:
+            os.mkdir(td.joinpath('one/a'))
+            os.rename(td.joinpath('one/a'), td.joinpath('one/b'))
+            watcher.poll()
+            asyncio.run(run())
+        finally:
+            meta.stop_watchers()
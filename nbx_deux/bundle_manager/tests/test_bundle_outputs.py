@@ -0,0 +1,123 @@
+import base64
+import json
+
+import nbformat
+from nbformat.v4 import new_code_cell, new_notebook, new_output
+
+from nbx_deux.models import NotebookModel
+from nbx_deux.testing import TempDir
+from ..bundle import NotebookBundlePath
+from ..bundle_checkpoints import BundleCheckpoints
+from ..bundle_outputs import OUTPUTS_KEY, BundleOutputs, split_outputs
+
+
+def make_plot_notebook(source='plot()', png_size=50_000):
+    png = base64.b64encode(b'\x89PNG' * (png_size // 4)).decode('ascii')
+    nb = new_notebook()
+    cell = new_code_cell(source, execution_count=1)
+    cell.outputs = [
+        new_output('stream', name='stdout', text='small\n'),
+        new_output('display_data', data={'image/png': png, 'text/plain': '<Figure>'}),
+        new_output('execute_result', data={'text/html': '<td>x</td>' * 5000}, execution_count=1),
+    ]
+    nb.cells.append(cell)
+    return nb
+
+
+def test_split_outputs():
+    nb = make_plot_notebook()
+    disk_nb, blobs = split_outputs(nb, threshold=1024)
+    assert len(blobs) == 2
+
+    cell = disk_nb.cells[0]
+    assert cell.outputs[0] is nb.cells[0].outputs[0]
+    assert cell.outputs[1] == {'output_type': 'display_data', 'data': {}, 'metadata': {}}
+    assert set(cell.metadata[OUTPUTS_KEY]) == {'1', '2'}
+    # still a valid notebook and the original is untouched
+    nbformat.validate(disk_nb)
+    assert OUTPUTS_KEY not in nb.cells[0].metadata
+    assert 'image/png' in nb.cells[0].outputs[1].data
+
+
+def test_bundle_externalized_outputs():
+    with TempDir() as td:
+        nb_dir = td.joinpath('example.ipynb')
+        bundle = NotebookBundlePath(nb_dir)
+        bundle.output_threshold = 1024
+        nb = make_plot_notebook()
+        model = NotebookModel.from_nbnode(nb, name='example.ipynb', path='example.ipynb')
+        assert bundle.write(model)
+
+        outputs = BundleOutputs(nb_dir)
+        assert len(outputs.stored()) == 2
+        nb_file = bundle.bundle_file
+        assert nb_file.stat().st_size < 2000
+        on_disk = json.loads(nb_file.read_text())
+        assert OUTPUTS_KEY in on_disk['cells'][0]['metadata']
+
+        # joined back on read
+        assert bundle.get_model(td)['content'] == nb
+        assert bundle.get_model(td, content=False)['content'] is None
+
+        # code changed, plots didn't. no blob is rewritten.
+        mtimes = {p.name: p.stat().st_mtime_ns for p in outputs.outputs_dir.iterdir()}
+        nb.cells[0].source = 'plot(); 1'
+        assert bundle.write(model)
+        assert {p.name: p.stat().st_mtime_ns for p in outputs.outputs_dir.iterdir()} == mtimes
+        assert bundle.get_model(td)['content'] == nb
+
+        # a checkpoint keeps the old outputs alive
+        checkpoint = BundleCheckpoints(nb_dir).create()
+        old = outputs.stored()
+        nb.cells[0].outputs = []
+        assert bundle.write(model)
+        assert outputs.stored() == old
+
+        BundleCheckpoints(nb_dir).delete(checkpoint['id'])
+        nb.cells[0].source = 'plot(); 2'
+        assert bundle.write(model)
+        assert outputs.stored() == set()
+        assert bundle.get_model(td)['content'] == nb
+
+
+def test_bundle_outputs_turned_off():
+    with TempDir() as td:
+        nb_dir = td.joinpath('example.ipynb')
+        bundle = NotebookBundlePath(nb_dir)
+        bundle.output_threshold = 1024
+        nb = make_plot_notebook()
+        model = NotebookModel.from_nbnode(nb, name='example.ipynb', path='example.ipynb')
+        bundle.write(model)
+
+        # still reads, and the next save puts the outputs back inline
+        bundle = NotebookBundlePath(nb_dir)
+        model = bundle.get_model(td)
+        assert model['content'] == nb
+        model['content'].cells[0].source = 'plot(); 1'
+        assert bundle.write(model)
+        assert 'image/png' in bundle.bundle_file.read_text()
+        assert BundleOutputs(nb_dir).stored() == set()
+
+
+def test_bundle_outputs_edited_outside():
+    with TempDir() as td:
+        nb_dir = td.joinpath('example.ipynb')
+        bundle = NotebookBundlePath(nb_dir)
+        bundle.output_threshold = 1024
+        nb = make_plot_notebook()
+        model = NotebookModel.from_nbnode(nb, name='example.ipynb', path='example.ipynb')
+        bundle.write(model)
+
+        # an output dropped by hand, refs left as they were
+        on_disk = json.loads(bundle.bundle_file.read_text())
+        del on_disk['cells'][0]['outputs'][2]
+        bundle.bundle_file.write_text(json.dumps(on_disk))
+        outputs = bundle.get_model(td)['content'].cells[0].outputs
+        assert len(outputs) == 2
+        assert 'image/png' in outputs[1].data
+
+        # a missing blob keeps its placeholder
+        for digest in BundleOutputs(nb_dir).stored():
+            BundleOutputs(nb_dir).path(digest).unlink()
+        outputs = bundle.get_model(td)['content'].cells[0].outputs
+        assert outputs[1] == {'output_type': 'display_data', 'data': {}, 'metadata': {}}
@@ -2,9 +2,12 @@
 Mishmash of io logic stripped from jupyter code that isn't entangled with the
 Configurable and ContentsManager.
 """
+from collections import OrderedDict
 from datetime import datetime
 from contextlib import contextmanager
+from functools import lru_cache
 import os.path
+import threading
 from fnmatch import fnmatch
 from base64 import decodebytes, encodebytes
 import json
@@ -24,11 +27,15 @@ from nbformat import validate as validate_nb
 from tornado.web import HTTPError
 from jupyter_server import _tz as tz
 
+from nbx_deux import nbjson
+from nbx_deux.trust_cache import TrustCache, content_digest, share_notary_store
 
-CM_NOTARY = cast(sign.NotebookNotary, FileContentsManager().notary)
 
+CM_NOTARY = share_notary_store(cast(sign.NotebookNotary, FileContentsManager().notary))
+TRUST_CACHE = TrustCache(CM_NOTARY)
 
-def mark_trusted_cells(nb):
+
+def mark_trusted_cells(nb, digest=None):
     """Mark cells as trusted if the notebook signature matches.
 
     Called as a part of loading notebooks.
@@ -37,13 +44,12 @@ def mark_trusted_cells(nb):
     ----------
     nb : dict
         The notebook object (in current nbformat)
-    path : str
-        The notebook's path (for logging)
+    digest : str, optional
+        content_digest of the file bytes. Lets TRUST_CACHE skip the HMAC.
     """
 
-    notary = CM_NOTARY
-    trusted = notary.check_signature(nb)
-    notary.mark_cells(nb, trusted)
+    trusted = TRUST_CACHE.check_signature(nb, digest=digest)
+    CM_NOTARY.mark_cells(nb, trusted)
 
 
 def get_hide_globs() -> list:
@@ -63,20 +69,54 @@ def should_list(name, hide_globs):
     return not any(fnmatch(name, glob) for glob in hide_globs)
 
 
+def _validate_notebook(nb, capture_validation_error=None):
+    """The validation step of nbformat.reads/writes."""
+    try:
+        validate_nb(nb)
+    except ValidationError as e:
+        nbformat.get_logger().error("Notebook JSON is invalid: %s", e)
+        if isinstance(capture_validation_error, dict):
+            capture_validation_error["ValidationError"] = e
+
+
+def _reads_notebook(data, as_version=4, capture_validation_error=None, validate=True):
+    """
+    nbformat.reads on the raw file bytes through the nbjson backend, with the
+    option of skipping schema validation.
+    """
+    nb = nbjson.reads_notebook(data)
+    if as_version is not nbformat.NO_CONVERT:
+        nb = nbformat.convert(nb, as_version)
+    if validate:
+        _validate_notebook(nb, capture_validation_error)
+    return nb
+
+
 def _read_notebook(
     os_path,
     as_version=4,
     capture_validation_error=None,
-    use_atomic_writing=True
+    use_atomic_writing=True,
+    with_digest=False,
+    validate=True,
 ):
-    """Read a notebook from an os path."""
-    with open(os_path, "r", encoding="utf-8") as f:
+    """Read a notebook from an os path.
+
+    with_digest: return (nb, content_digest) instead of nb.
+    validate: set to False to skip nbformat schema validation.
+    """
+    with open(os_path, "rb") as f:
+        data = f.read()
         try:
-            return nbformat.read(
-                f,
+            nb = _reads_notebook(
+                data,
                 as_version=as_version,
-                capture_validation_error=capture_validation_error
+                capture_validation_error=capture_validation_error,
+                validate=validate,
             )
+            if with_digest:
+                return nb, content_digest(data)
+            return nb
         except Exception as e:
             e_orig = e
 
@@ -99,7 +139,9 @@ def _read_notebook(
             os_path,
             as_version,
             capture_validation_error=capture_validation_error,
-            use_atomic_writing=use_atomic_writing
+            use_atomic_writing=use_atomic_writing,
+            with_digest=with_digest,
+            validate=validate,
         )
 
 
@@ -107,16 +149,40 @@ def _save_notebook(
     os_path,
     nb,
     capture_validation_error=None,
-    use_atomic_writing=True
+    use_atomic_writing=True,
+    signature=None,
+    data=None,
 ):
-    """Save a notebook to an os_path."""
-    with writing_cm(os_path, encoding="utf-8", use_atomic_writing=use_atomic_writing) as f:
-        nbformat.write(
-            nb,
-            f,
-            version=nbformat.NO_CONVERT,
-            capture_validation_error=capture_validation_error,
-        )
+    """Save a notebook to an os_path.
+
+    Writes the same bytes as nbformat.write with a single buffered write.
+
+    signature: what check_and_sign returned for nb. When set, the written
+    bytes are known to be trusted and the next read skips the notary.
+    data: nbjson.writes_notebook(nb), if the caller already serialized it.
+
+    Returns the content_digest of the written bytes.
+    """
+    if capture_validation_error is None:
+        capture_validation_error = {}
+
+    _validate_notebook(nb, capture_validation_error)
+    if data is None:
+        data = nbjson.writes_notebook(nb)
+    with writing_cm(os_path, text=False, use_atomic_writing=use_atomic_writing) as f:
+        f.write(data)
+
+    # we just validated what is now on disk
+    VALIDATION_CACHE.record(
+        os_path,
+        nb,
+        capture_validation_error.get("ValidationError"),
+    )
+
+    digest = content_digest(data)
+    if signature is not None:
+        TRUST_CACHE.seed(digest, True)
+    return digest
 
 
 @contextmanager
@@ -192,9 +258,47 @@ def ospath_is_writable(os_path):
         return False
 
 
+@lru_cache(maxsize=1)
+def _process_ids():
+    return os.geteuid(), {os.getegid(), *os.getgroups()}
+
+
+def stat_has_access(info, mode):
+    """
+    `os.access` answered from a stat result so listings don't pay a syscall
+    per entry. Only looks at the permission bits, so ACLs and read-only
+    mounts are not accounted for. Returns None when the platform has no
+    posix ids and the caller should fall back to `os.access`.
+    """
+    if not hasattr(os, 'geteuid'):
+        return None
+
+    uid, gids = _process_ids()
+    if uid == 0:
+        return True
+
+    if info.st_uid == uid:
+        bits = info.st_mode >> 6
+    elif info.st_gid in gids:
+        bits = info.st_mode >> 3
+    else:
+        bits = info.st_mode
+    return (bits & mode & 0o7) == mode
+
+
+def stat_is_writable(os_path, info):
+    writable = stat_has_access(info, os.W_OK)
+    if writable is None:
+        writable = ospath_is_writable(os_path)
+    return writable
+
+
 def get_ospath_metadata(os_path):
     info = os.lstat(os_path)
+    return get_stat_metadata(info)
 
+
+def get_stat_metadata(info):
     size = None
     try:
         # size of file
@@ -219,6 +323,109 @@ def get_ospath_metadata(os_path):
     return {'size': size, 'last_modified': last_modified, 'created': created}
 
 
+VALIDATION_POLICIES = ('always', 'on-change', 'on-save-only')
+
+
+class ValidationCache:
+    """
+    Schema validation results keyed on
+    (os_path, mtime, size, notebook version, nbformat library version).
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[tuple, ValidationError | None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(os_path, st, nb):
+        return (
+            str(os_path),
+            st.st_mtime_ns,
+            st.st_size,
+            nb.get('nbformat'),
+            nb.get('nbformat_minor'),
+            nbformat.__version__,
+        )
+
+    def get(self, key):
+        """Returns (hit, ValidationError | None)"""
+        with self._lock:
+            if key not in self._cache:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return True, self._cache[key]
+
+    def put(self, key, error):
+        with self._lock:
+            self._cache[key] = error
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def record(self, os_path, nb, error):
+        try:
+            st = os.stat(os_path)
+        except OSError:
+            return
+        self.put(self.key(os_path, st, nb), error)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+
+VALIDATION_CACHE = ValidationCache()
+
+
+def _read_validated_notebook(os_path, validation_policy='always', cache=VALIDATION_CACHE):
+    """
+    Read a notebook validating according to validation_policy.
+
+        always: validate on every read.
+        on-change: validate when (path, mtime, size, version) hasn't been seen.
+        on-save-only: don't validate reads. _save_notebook validates on save.
+
+    Returns (nb, digest, validation_error) where validation_error is suitable
+    for validate_notebook_model.
+    """
+    if validation_policy not in VALIDATION_POLICIES:
+        raise ValueError(f"Unknown validation policy {validation_policy!r}")
+
+    validation_error: dict = {}
+    if validation_policy == 'always':
+        nb, digest = _read_notebook(
+            os_path,
+            capture_validation_error=validation_error,
+            with_digest=True,
+        )
+        return nb, digest, validation_error
+
+    st = os.stat(os_path)
+    nb, digest = _read_notebook(os_path, with_digest=True, validate=False)
+    if validation_policy == 'on-save-only':
+        return nb, digest, validation_error
+
+    key = cache.key(os_path, st, nb)
+    hit, error = cache.get(key)
+    if not hit:
+        try:
+            validate_nb(nb)
+        except ValidationError as e:
+            error = e
+        cache.put(key, error)
+
+    if error is not None:
+        validation_error["ValidationError"] = error
+    return nb, digest, validation_error
+
+
 def validate_notebook_model(model, validation_error=None):
     """Add failed-validation message to model"""
     try:
@@ -245,9 +452,7 @@ def check_and_sign(nb):
     ----------
     nb : dict
         The notebook dict
-    path : str
-        The notebook's path (for logging)
+
+    Returns the signature if the notebook was signed.
     """
-    notary = CM_NOTARY
-    if notary.check_cells(nb):
-        notary.sign(nb)
+    return TRUST_CACHE.check_and_sign(nb)
@@ -1,7 +1,13 @@
-from nbformat import v4 as current
+from collections import OrderedDict
+import bisect
+import dataclasses as dc
+import threading
+
 import github
 import time
 from .bundle_manager.bundle import BundleModel
+from .nbjson import writes_notebook
+from .trust_cache import content_digest
 
 _missing = object()
 
@@ -23,7 +29,7 @@ def model_to_files(model: BundleModel | dict):
     """
     files = {}
     name = model['name']
-    content = current.writes(model['content'])
+    content = writes_notebook(model['content']).decode('utf-8')
     files[name] = content
 
     bundle_files = model.get('bundle_files', {})
@@ -32,6 +38,25 @@ def model_to_files(model: BundleModel | dict):
     return files
 
 
+def file_hash(content: str) -> str:
+    return content_digest(content.encode('utf-8'))
+
+
+def gist_file_hashes(gist):
+    """
+    {filename: hash} from the file contents that came with the gist response.
+    Truncated files are None since we only have part of the content.
+    """
+    hashes = {}
+    for fn, fobj in gist.files.items():
+        content = fobj.content
+        if getattr(fobj, 'truncated', False) is True or not isinstance(content, str):
+            hashes[fn] = None
+        else:
+            hashes[fn] = file_hash(content)
+    return hashes
+
+
 def _github_files(files):
     """ wrap basestring content into github.InputFilecontent """
     new_files = {}
@@ -42,14 +67,206 @@ def _github_files(files):
     return new_files
 
 
+def gist_size(gister):
+    """Rough bytes held by a Gister: the file contents it carries."""
+    size = 0
+    for fobj in gister.files.values():
+        content = fobj.content
+        if isinstance(content, str):
+            size += len(content)
+    return size
+
+
+@dc.dataclass
+class _GistCacheEntry:
+    gister: 'Gister'
+    size: int
+    checked_at: float
+
+
+class GistCache:
+    """
+    LRU of Gisters bounded by entry count and total content size.
+
+    Entries older than ttl seconds are revalidated with a conditional request
+    (etag / last modified) before being served, so an unchanged gist costs a
+    304 instead of a full refetch.
+    """
+    def __init__(self, max_entries=128, max_bytes=64 * 1024 * 1024, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.nbytes = 0
+        self._entries: OrderedDict[str, _GistCacheEntry] = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, gist_id):
+        return gist_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, gist_id):
+        with self._lock:
+            entry = self._entries.get(gist_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            checked_at = entry.checked_at
+            stale = self.clock() - checked_at > self.ttl
+            if stale:
+                # claim the revalidation so concurrent gets serve the entry
+                # instead of sending their own
+                self.revalidations += 1
+                entry.checked_at = self.clock()
+            else:
+                self._touch(gist_id, entry)
+                return entry.gister
+
+        # network round trip, outside the lock
+        try:
+            changed = entry.gister.refresh()
+        except github.GithubException:
+            # gone or inaccessible. let the caller refetch.
+            with self._lock:
+                if self._entries.get(gist_id) is entry:
+                    self._drop(gist_id)
+                self.misses += 1
+            return None
+        except Exception:
+            with self._lock:
+                entry.checked_at = checked_at
+            raise
+
+        with self._lock:
+            if not changed:
+                self.not_modified += 1
+            entry.checked_at = self.clock()
+            if self._entries.get(gist_id) is entry:
+                self._touch(gist_id, entry)
+            return entry.gister
+
+    def _touch(self, gist_id, entry):
+        self.hits += 1
+        self._entries.move_to_end(gist_id)
+        # edits since it was cached change what it holds
+        self._resize(entry)
+        self._evict()
+
+    def put(self, gist_id, gister):
+        with self._lock:
+            self._drop(gist_id)
+            size = gist_size(gister)
+            if size > self.max_bytes:
+                return
+            self._entries[gist_id] = _GistCacheEntry(gister, size, self.clock())
+            self.nbytes += size
+            self._evict()
+
+    def pop(self, gist_id):
+        with self._lock:
+            entry = self._drop(gist_id)
+            return entry.gister if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _drop(self, gist_id):
+        entry = self._entries.pop(gist_id, None)
+        if entry is not None:
+            self.nbytes -= entry.size
+        return entry
+
+    def _resize(self, entry):
+        size = gist_size(entry.gister)
+        self.nbytes += size - entry.size
+        entry.size = size
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries or self.nbytes > self.max_bytes
+        ):
+            gist_id = next(iter(self._entries))
+            self._drop(gist_id)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'revalidations': self.revalidations,
+                'not_modified': self.not_modified,
+                'size': len(self._entries),
+                'bytes': self.nbytes,
+            }
+
+
+@dc.dataclass
+class PublishResult:
+    index: int
+    name: str
+    gist_id: str | None
+    # created / updated / unchanged / skipped / failed / rate_limited
+    status: str = 'pending'
+    error: str | None = None
+    attempts: int = 0
+
+
+class RateLimitSchedule:
+    """
+    Decides when an account can make its next requests from the rate limit
+    headers of its last response (hub.rate_limiting and
+    hub.rate_limiting_resettime). Requests still in flight count against
+    what is left, since their responses haven't updated the headers yet.
+    """
+    def __init__(self, service, reserve=0, clock=time.time):
+        self.service = service
+        self.reserve = reserve
+        self.clock = clock
+        self.inflight: dict[str, int] = {}
+
+    def ready_in(self, login, n=1) -> float | None:
+        """
+        Seconds until login can send n more requests. 0 means now, None means
+        wait for its in-flight requests to come back.
+        """
+        hub = self.service.accounts[login]
+        remaining, _ = hub.rate_limiting
+        inflight = self.inflight.get(login, 0)
+        if remaining - inflight - n >= self.reserve:
+            return 0
+        if inflight:
+            return None
+        return max(hub.rate_limiting_resettime - self.clock(), 0)
+
+    def started(self, login, n=1):
+        self.inflight[login] = self.inflight.get(login, 0) + n
+
+    def finished(self, login, n=1):
+        self.inflight[login] -= n
+
+
 class GistService(object):
     """
     Keeps track of github accounts and gists.
     """
-    def __init__(self, hub=None):
+    def __init__(self, hub=None, gist_cache=None):
         self.accounts = {}
         self.default = None
-        self.gist_cache = {}
+        if gist_cache is None:
+            gist_cache = GistCache()
+        self.gist_cache = gist_cache
 
         if hub is not None:
             self._save_login(hub)
@@ -84,10 +301,13 @@ class GistService(object):
         self.accounts[login] = hub
 
     def get_gist(self, gist_id, refresh=False):
-        if gist_id not in self.gist_cache or refresh:
+        gist = None
+        if not refresh:
+            gist = self.gist_cache.get(gist_id)
+        if gist is None:
             gist = self._get_gist(gist_id)
-            self.gist_cache[gist_id] = gist
-        return self.gist_cache[gist_id]
+            self.gist_cache.put(gist_id, gist)
+        return gist
 
     def _get_gist(self, gist_id):
         """
@@ -118,6 +338,144 @@ class GistService(object):
         gist = self.get_gist(gist.id)
         return gist
 
+    def publish(self, model, gist_id=None, login=None, public=True, force=False):
+        """
+        Push a notebook model to gist_id, or to a new gist if gist_id is None.
+        Returns (status, gist). Gists we don't own are skipped.
+        """
+        files = model_to_files(model)
+        name = model['name']
+        if gist_id is None:
+            gist = self.create_gist(description=name, files=files, public=public, login=login)
+            return 'created', gist
+
+        gist = self.get_gist(gist_id)
+        if not self.is_owned(gist):
+            return 'skipped', gist
+        changed = gist.save(description=name, files=files, force=force, settle=False)
+        return ('updated' if changed else 'unchanged'), gist
+
+    def publish_requests(self, gist_id):
+        """
+        Most requests publish(model, gist_id) can send.
+        """
+        if gist_id is None:
+            # POST, then get_gist: GET and maybe a GET from the owner's hub
+            return 3
+        if gist_id in self.gist_cache:
+            # revalidation, PATCH
+            return 2
+        # GET, owner's GET, PATCH
+        return 3
+
+    def publish_many(self, items, max_workers=4, login=None, public=True,
+                     force=False, max_wait=None, max_rate_limit_retries=3,
+                     clock=time.time):
+        """
+        Publish many (model, gist_id) pairs. gist_id None creates a new gist
+        under login.
+
+        At most max_workers items are published at once. All of them go
+        through the one hub we hold per account. Each item holds back what
+        publish_requests says it can send. When the rate limit headers say the
+        account doesn't have that left, the remaining items are held until the
+        reset time instead of being sent to fail. If that is more than
+        max_wait seconds away they are marked rate_limited and not sent.
+
+        Items for the same gist_id run one after the other, in order, since
+        they share a cached Gister.
+
+        Returns a PublishResult per item, in the order given.
+        """
+        if login is None:
+            login = self.default
+        items = list(items)
+        results = [
+            PublishResult(index=i, name=model['name'], gist_id=gist_id)
+            for i, (model, gist_id) in enumerate(items)
+        ]
+        # kept sorted so items go out in order
+        queue = list(range(len(items)))
+        active_gists = set()
+        schedule = RateLimitSchedule(self, clock=clock)
+        deadline = None if max_wait is None else clock() + max_wait
+        cond = threading.Condition()
+
+        def next_runnable():
+            for pos, index in enumerate(queue):
+                gist_id = items[index][1]
+                if gist_id is None or gist_id not in active_gists:
+                    return pos
+            return None
+
+        def take():
+            with cond:
+                while queue:
+                    pos = next_runnable()
+                    if pos is None:
+                        # everything left waits on a gist that's being published
+                        cond.wait()
+                        continue
+                    index = queue[pos]
+                    gist_id = items[index][1]
+                    cost = self.publish_requests(gist_id)
+                    wait = schedule.ready_in(login, cost)
+                    if wait == 0:
+                        schedule.started(login, cost)
+                        del queue[pos]
+                        if gist_id is not None:
+                            active_gists.add(gist_id)
+                        return index, cost
+                    if wait is not None and deadline is not None and clock() + wait > deadline:
+                        for index in queue:
+                            results[index].status = 'rate_limited'
+                        queue.clear()
+                        break
+                    # an in-flight response or the reset time will change things
+                    cond.wait(wait)
+                return None, 0
+
+        def run():
+            while True:
+                index, cost = take()
+                if index is None:
+                    return
+                result = results[index]
+                model, gist_id = items[index]
+                result.attempts += 1
+                try:
+                    result.status, gist = self.publish(
+                        model, gist_id, login=login, public=public, force=force,
+                    )
+                    result.gist_id = gist.id
+                    result.error = None
+                except github.RateLimitExceededException as e:
+                    # headers now say we're out. try again after the reset.
+                    result.error = repr(e)
+                    if result.attempts > max_rate_limit_retries:
+                        result.status = 'rate_limited'
+                    else:
+                        with cond:
+                            bisect.insort(queue, index)
+                except Exception as e:
+                    result.status = 'failed'
+                    result.error = repr(e)
+                finally:
+                    with cond:
+                        schedule.finished(login, cost)
+                        active_gists.discard(gist_id)
+                        cond.notify_all()
+
+        workers = [
+            threading.Thread(target=run, name=f'nbx-gist-publish-{i}', daemon=True)
+            for i in range(min(max_workers, len(items)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
     def is_owned(self, gist):
         """
         Checks if the gist is ownd by an account we manage.
@@ -130,7 +488,7 @@ class GistService(object):
         return self.accounts.get(login, None)
 
     def gist_deleted(self, gist):
-        del self.gist_cache[gist.id]
+        self.gist_cache.pop(gist.id)
 
 
 class Gister(object):
@@ -142,6 +500,8 @@ class Gister(object):
         self.service = service
 
         self.id = gist.id
+        # hash of each file as of our last push or pull. None means unknown.
+        self.file_hashes = gist_file_hashes(gist)
 
     @property
     def public(self):
@@ -159,10 +519,15 @@ class Gister(object):
     def owner(self):
         return self.gist.owner
 
-    def edit(self, description=None, files=None, force=False):
+    def edit(self, description=None, files=None, force=False, settle=True):
         """
         Wrapper around github.Gist.edit. If nothing has changed
         we will not save unless `force` is true.
+
+        settle: sleep after the edit, see below. Callers that space out their
+        own edits (GistSyncWorker) pass False.
+
+        Returns whether an edit was sent.
         """
         if description is None:
             description = self.description
@@ -170,39 +535,81 @@ class Gister(object):
             files = {}
 
         dirty = self._is_dirty(description, files)
-        files = _github_files(files)
-        if dirty or force:
-            self.gist.edit(description, files)
+        if not (dirty or force):
+            return False
+
+        self.gist.edit(description, _github_files(files))
+        self._record_pushed(files)
+        if settle:
             # at the moment, it looks like sending edit requests
             # too quickly will cause the files dict in the response
             # to be stale. Emailed github about this. For now,
             # putting in a sleep.
             # http://nbviewer.ipython.org/gist/dalejung/9008256a672754df6d7d
             time.sleep(1)
+        return True
 
     def delete(self):
         self.gist.delete()
         self.service.gist_deleted(self)
 
+    def _record_pushed(self, files):
+        """
+        files is the {filename: str content} we just sent, None for deletions.
+        """
+        for fn, content in files.items():
+            if content is None:
+                self.file_hashes.pop(fn, None)
+            else:
+                self.file_hashes[fn] = file_hash(content)
+
     def _is_dirty(self, description, files):
         """
         Check whether the description/files would change the current
         gist
+
+        Only compares against local hashes of what was last pushed or
+        pulled, so no remote file contents are fetched.
         """
         if description != self.gist.description:
             return True
 
         for fn, content in files.items():
             # new file
-            if fn not in self.gist.files:
+            if fn not in self.file_hashes:
                 return True
 
-            old_content = self.gist.files[fn].content
-            if content != old_content:
+            old_hash = self.file_hashes[fn]
+            if content is None or old_hash is None:
+                return True
+
+            if file_hash(content) != old_hash:
                 return True
         return False
 
-    def save(self, description=None, files=_missing, force=False):
+    def remote_changes(self):
+        """
+        Files changed on github since our last push or pull. This is a
+        network read.
+        """
+        self.gist.update()
+        remote = gist_file_hashes(self.gist)
+        changed = set()
+        for fn in set(remote) | set(self.file_hashes):
+            known = self.file_hashes.get(fn, _missing)
+            if known is None or remote.get(fn, _missing) != known:
+                changed.add(fn)
+        return sorted(changed)
+
+    def has_conflict(self, files):
+        """
+        Would pushing files overwrite changes made on github since our last
+        push or pull?
+        """
+        changed = self.remote_changes()
+        return any(fn in files for fn in changed)
+
+    def save(self, description=None, files=_missing, force=False, settle=True):
         """
         Similar to edit except it assumes that `files` represents all
         files. So if a file is missing from `files` then it will be deleted.
@@ -213,11 +620,22 @@ class Gister(object):
         if files is None:
             files = {}
 
-        for fn, fobj in self.gist.files.items():
+        for fn in self.file_hashes:
             if fn not in files:
                 files[fn] = None  # mark for deletion
 
-        self.edit(description, files=files, force=force)
+        return self.edit(description, files=files, force=force, settle=settle)
 
     def pull(self):
-        self.gist = self.service.get_gist(self.gist.id)
+        self.gist.update()
+        self.file_hashes = gist_file_hashes(self.gist)
+
+    def refresh(self):
+        """
+        Conditional refetch. Returns whether the gist changed on github, in
+        which case it counts as a pull.
+        """
+        changed = self.gist.update()
+        if changed:
+            self.file_hashes = gist_file_hashes(self.gist)
+        return changed
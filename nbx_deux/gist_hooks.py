@@ -5,19 +5,24 @@ from github import Auth, Github
 
 from jupyter_server.services.contents.filemanager import FileContentsManager
 from jupyter_server.utils import to_api_path
+from nbx_deux.bundle_manager.bundle import BundlePath, NotebookBundlePath
 from nbx_deux.bundle_manager.bundle_nbmanager import BundleContentsManager
-from .gist import GistService, model_to_files
+from nbx_deux.lazy_notebook import read_notebook_metadata
+from .gist import GistService
+from .gist_sync import GistSyncWorker
 from nbx_deux.config import GITHUB_TOKEN
 
 service = None
+sync_worker = None
 if GITHUB_TOKEN:
     auth = Auth.Token(GITHUB_TOKEN)
     hub = Github(auth=auth)
     service = GistService(hub=hub)
+    sync_worker = GistSyncWorker(service)
 
 
 def gist_post_save_notebook(model, os_path, contents_manager, **kwargs):
-    if service is None:
+    if sync_worker is None:
         return
 
     # for now only support bundlenbmanager
@@ -30,25 +35,17 @@ def gist_post_save_notebook(model, os_path, contents_manager, **kwargs):
         print("uh. why?")
         return 
 
-    model = contents_manager.get(api_path, content=True)
-
-    gist_id = model['content']['metadata'].get('gist_id', None)
-    if gist_id is None:
+    nb_file = os_path
+    if BundlePath.is_bundle(os_path):
+        nb_file = NotebookBundlePath(os_path).bundle_file
+    if not str(nb_file).endswith('.ipynb'):
         return
 
-    gist = service.get_gist(gist_id)
-    if not service.is_owned(gist):
+    # Only pay for the full notebook read if it is linked to a gist
+    gist_id = read_notebook_metadata(nb_file).get('gist_id', None)
+    if gist_id is None:
         return
 
+    # reading the notebook and talking to github happen on the worker
     name = os_path.rsplit('/', 1)[-1]
-
-    files = model_to_files(model)
-
-    try:
-        gist.save(description=name, files=files)
-    except Exception:
-        print(files)
-        raise Exception('Error saving gist')
-    else:
-        msg = f"Saved notebook {api_path} {name} to gist {gist_id}"
-        print(msg)
+    sync_worker.submit(gist_id, os_path, name=name)
@@ -0,0 +1,305 @@
+"""
+Background gist sync.
+
+The gist post-save hook used to read the notebook, talk to github and sleep
+inside the save request. GistSyncWorker takes that off the request thread:
+
+    - jobs are keyed on gist id and debounced. A save that lands while a job
+      is pending replaces it, so only the latest save is pushed.
+    - the notebook is read from disk when the job runs, not when it is
+      queued. This doesn't go through the contents manager, whose notary
+      sqlite connection can't be used off the thread that created it.
+    - the queue is bounded. A new gist that doesn't fit is dropped and
+      recorded as such rather than blocking the save.
+    - failed pushes are retried with exponential backoff.
+    - edits to the same gist are spaced `min_interval` apart. This replaces
+      the sleep in `Gister.edit`.
+    - queued saves are pushed at interpreter exit, waiting up to
+      `exit_timeout`, so the last save before shutdown isn't lost.
+
+`state(gist_id)` / `states()` / `stats()` expose what the worker is doing.
+"""
+import atexit
+import dataclasses as dc
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from .bundle_manager.bundle import NotebookBundlePath
+from .fileio import _read_notebook
+from .gist import GistService, model_to_files
+
+
+def read_gist_model(os_path):
+    """
+    The parts of a notebook model that model_to_files needs.
+    """
+    if NotebookBundlePath.valid_path(os_path):
+        return NotebookBundlePath(os_path).get_model()
+    return {
+        'name': os.path.basename(os_path),
+        'content': _read_notebook(os_path),
+    }
+
+
+@dc.dataclass
+class GistSyncState:
+    gist_id: str
+    os_path: str | None = None
+    # pending / running / synced / unchanged / skipped / failed / dropped
+    status: str = 'pending'
+    attempts: int = 0
+    submitted: int = 0
+    pushes: int = 0
+    last_error: str | None = None
+    last_synced: float | None = None
+
+
+@dc.dataclass
+class _SyncJob:
+    gist_id: str
+    os_path: str
+    name: str
+    due: float
+    deadline: float
+    attempt: int = 0
+
+
+class GistSyncWorker:
+    def __init__(
+        self,
+        service: GistService,
+        debounce=2.0,
+        max_delay=30.0,
+        max_pending=100,
+        max_retries=3,
+        backoff=1.0,
+        max_backoff=60.0,
+        min_interval=1.0,
+        exit_timeout=30.0,
+        clock: Callable[[], float] = time.monotonic,
+        log=None,
+    ):
+        self.service = service
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.min_interval = min_interval
+        self.exit_timeout = exit_timeout
+        self.clock = clock
+        self.log = log
+
+        self.dropped = 0
+        self.coalesced = 0
+        self.retries = 0
+
+        self._pending: OrderedDict[str, _SyncJob] = OrderedDict()
+        self._states: dict[str, GistSyncState] = {}
+        self._last_push: dict[str, float] = {}
+        self._running: str | None = None
+        self._flushing = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='nbx-gist-sync', daemon=True)
+            self._thread.start()
+            # daemon so a hung push never blocks exit, but drain what's queued
+            atexit.register(self.shutdown, timeout=self.exit_timeout)
+
+    def _state(self, gist_id) -> GistSyncState:
+        if gist_id not in self._states:
+            self._states[gist_id] = GistSyncState(gist_id)
+        return self._states[gist_id]
+
+    def submit(self, gist_id, os_path, name=None) -> bool:
+        """
+        Queue a push of the notebook or notebook bundle at os_path to gist_id.
+        Returns False if it was dropped.
+        """
+        os_path = str(os_path)
+        if name is None:
+            name = os.path.basename(os_path)
+
+        now = self.clock()
+        with self._cond:
+            if self._closed:
+                raise Exception("GistSyncWorker is shut down")
+
+            state = self._state(gist_id)
+            state.os_path = os_path
+            state.submitted += 1
+
+            job = self._pending.get(gist_id)
+            if job is not None:
+                # latest save wins, but don't let a stream of saves starve it
+                self.coalesced += 1
+                job.os_path = os_path
+                job.name = name
+                job.attempt = 0
+                job.due = min(now + self.debounce, job.deadline)
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                state.status = 'dropped'
+                return False
+            else:
+                self._pending[gist_id] = _SyncJob(
+                    gist_id=gist_id,
+                    os_path=os_path,
+                    name=name,
+                    due=now + self.debounce,
+                    deadline=now + self.max_delay,
+                )
+
+            state.status = 'pending'
+            self._ensure_thread()
+            self._cond.notify_all()
+        return True
+
+    def _next_job(self):
+        """
+        Pop the next runnable job or return how long to wait for one.
+        """
+        now = self.clock()
+        wait = None
+        for gist_id, job in self._pending.items():
+            if gist_id == self._running:
+                continue
+            due = job.due
+            if gist_id in self._last_push:
+                due = max(due, self._last_push[gist_id] + self.min_interval)
+            if self._flushing or due <= now:
+                del self._pending[gist_id]
+                return job, None
+            delay = due - now
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._pending:
+                        return
+                    job, wait = self._next_job()
+                    if job is not None:
+                        break
+                    self._cond.wait(wait)
+                self._running = job.gist_id
+                state = self._state(job.gist_id)
+                state.status = 'running'
+                state.attempts += 1
+
+            try:
+                pushed = self.push(job)
+            except Exception as e:
+                self._failed(job, e)
+            else:
+                with self._cond:
+                    state.status = {True: 'synced', False: 'unchanged', None: 'skipped'}[pushed]
+                    if job.gist_id in self._pending:
+                        state.status = 'pending'
+                    if pushed:
+                        state.pushes += 1
+                        self._last_push[job.gist_id] = self.clock()
+                    state.last_error = None
+                    state.last_synced = time.time()
+            finally:
+                with self._cond:
+                    self._running = None
+                    self._cond.notify_all()
+
+    def _failed(self, job: _SyncJob, error):
+        with self._cond:
+            state = self._state(job.gist_id)
+            state.last_error = repr(error)
+            if self.log is not None:
+                self.log.warning(
+                    "Gist sync of %s to %s failed: %r", job.os_path, job.gist_id, error,
+                )
+
+            if job.gist_id in self._pending:
+                # a newer save is already queued and will retry for us
+                state.status = 'pending'
+                return
+
+            if job.attempt >= self.max_retries:
+                state.status = 'failed'
+                return
+
+            self.retries += 1
+            delay = min(self.backoff * 2 ** job.attempt, self.max_backoff)
+            job.attempt += 1
+            job.due = self.clock() + delay
+            self._pending[job.gist_id] = job
+            state.status = 'pending'
+
+    def push(self, job: _SyncJob):
+        """
+        Push the current notebook at job.os_path. Returns whether an edit
+        was sent, or None if the gist isn't ours to edit.
+        """
+        gist = self.service.get_gist(job.gist_id)
+        if not self.service.is_owned(gist):
+            return None
+
+        files = model_to_files(read_gist_model(job.os_path))
+        return gist.save(description=job.name, files=files, settle=False)
+
+    def state(self, gist_id) -> GistSyncState | None:
+        with self._cond:
+            state = self._states.get(gist_id)
+            return dc.replace(state) if state is not None else None
+
+    def states(self) -> dict[str, GistSyncState]:
+        with self._cond:
+            return {gist_id: dc.replace(state) for gist_id, state in self._states.items()}
+
+    def stats(self):
+        with self._cond:
+            counts: dict[str, int] = {}
+            for state in self._states.values():
+                counts[state.status] = counts.get(state.status, 0) + 1
+            return {
+                'pending': len(self._pending),
+                'running': self._running,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'retries': self.retries,
+                'statuses': counts,
+            }
+
+    def flush(self, timeout=None) -> bool:
+        """
+        Run everything queued now, ignoring debounce and backoff, and wait
+        for it. Returns False on timeout.
+        """
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(
+                    lambda: not self._pending and self._running is None,
+                    timeout,
+                )
+            finally:
+                self._flushing = False
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop taking saves. Queued ones are pushed right away before the
+        thread exits.
+        """
+        with self._cond:
+            self._closed = True
+            self._flushing = True
+            self._cond.notify_all()
+        if wait and self._thread is not None:
+            self._thread.join(timeout)
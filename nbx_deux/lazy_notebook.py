@@ -0,0 +1,291 @@
+"""
+Lazy notebook reader.
+
+nbformat.read decodes the whole document, including every output payload,
+before anything can look at it. LazyNotebook instead scans the raw bytes once
+for the structure: top level keys, the byte span of each cell and the span of
+each field within a cell. Values are only json decoded when accessed.
+
+Strings are skipped with bytes.find so large base64 outputs are stepped over
+at memchr speed and never turned into python objects unless someone asks for
+them.
+
+This is for internal callers that only need metadata or a few cells. Anything
+that goes back to jupyter should still get a full NotebookNode via
+`LazyNotebook.materialize`.
+"""
+import json
+import re
+
+import nbformat
+from nbformat import NotebookNode
+from nbformat.notebooknode import from_dict
+from nbformat.v4.rwbase import rejoin_lines
+
+_WS_RE = re.compile(rb'[ \t\n\r]*')
+_SCALAR_RE = re.compile(rb'[^,:\]}\s]+')
+# characters that matter when stepping over a container
+_TOKEN_RE = re.compile(rb'[\[\]{}"]')
+
+_OPEN = frozenset(b'[{')
+_QUOTE = ord('"')
+_BACKSLASH = ord('\\')
+
+
+class LazyNotebookError(ValueError):
+    pass
+
+
+def _skip_ws(data, idx):
+    return _WS_RE.match(data, idx).end()
+
+
+def _skip_string(data, idx):
+    """
+    Return the end offset of the json string whose opening quote is at idx.
+    """
+    pos = idx + 1
+    while True:
+        end = data.find(b'"', pos)
+        if end == -1:
+            raise LazyNotebookError(f"Unterminated json string at {idx}")
+        # quote is escaped if preceded by an odd number of backslashes
+        backslashes = 0
+        j = end - 1
+        while data[j] == _BACKSLASH:
+            backslashes += 1
+            j -= 1
+        if backslashes % 2 == 0:
+            return end + 1
+        pos = end + 1
+
+
+def _skip_value(data, idx):
+    """
+    Return the end offset of the json value starting at idx.
+    """
+    first = data[idx]
+    if first in _OPEN:
+        depth = 0
+        pos = idx
+        while m := _TOKEN_RE.search(data, pos):
+            tok = data[m.start()]
+            if tok == _QUOTE:
+                pos = _skip_string(data, m.start())
+                continue
+            pos = m.end()
+            if tok in _OPEN:
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return pos
+        raise LazyNotebookError(f"Unterminated json container at {idx}")
+
+    if first == _QUOTE:
+        return _skip_string(data, idx)
+
+    m = _SCALAR_RE.match(data, idx)
+    if m is None:
+        raise LazyNotebookError(f"Invalid json value at {idx}")
+    return m.end()
+
+
+def _expect(data, idx, char):
+    if data[idx:idx + 1] != char:
+        raise LazyNotebookError(f"Expected {char!r} at {idx}")
+    return idx + 1
+
+
+def scan_object(data, idx=0) -> tuple[dict[str, tuple[int, int]], int]:
+    """
+    Map each key of the json object starting at idx to its value span.
+    """
+    idx = _expect(data, _skip_ws(data, idx), b'{')
+    spans = {}
+    idx = _skip_ws(data, idx)
+    if data[idx:idx + 1] == b'}':
+        return spans, idx + 1
+
+    while True:
+        if data[idx] != _QUOTE:
+            raise LazyNotebookError(f"Expected object key at {idx}")
+        key_end = _skip_string(data, idx)
+        key = json.loads(data[idx:key_end])
+        idx = _skip_ws(data, key_end)
+        idx = _skip_ws(data, _expect(data, idx, b':'))
+        end = _skip_value(data, idx)
+        spans[key] = (idx, end)
+        idx = _skip_ws(data, end)
+        if data[idx:idx + 1] == b',':
+            idx = _skip_ws(data, idx + 1)
+            continue
+        return spans, _expect(data, idx, b'}')
+
+
+def scan_array(data, idx) -> tuple[list[tuple[int, int]], int]:
+    """
+    Spans of each element of the json array starting at idx.
+    """
+    idx = _expect(data, _skip_ws(data, idx), b'[')
+    spans = []
+    idx = _skip_ws(data, idx)
+    if data[idx:idx + 1] == b']':
+        return spans, idx + 1
+
+    while True:
+        end = _skip_value(data, idx)
+        spans.append((idx, end))
+        idx = _skip_ws(data, end)
+        if data[idx:idx + 1] == b',':
+            idx = _skip_ws(data, idx + 1)
+            continue
+        return spans, _expect(data, idx, b']')
+
+
+class LazyCell:
+    """
+    Cell whose fields are decoded on first access.
+    """
+    def __init__(self, data, span):
+        self.data = data
+        self.span = span
+        self.field_spans, _ = scan_object(data, span[0])
+        self._fields = {}
+
+    def _decode(self, key):
+        if key not in self._fields:
+            start, end = self.field_spans[key]
+            self._fields[key] = json.loads(self.data[start:end])
+        return self._fields[key]
+
+    def __contains__(self, key):
+        return key in self.field_spans
+
+    def __getitem__(self, key):
+        value = self._decode(key)
+        if key == 'source' and isinstance(value, list):
+            value = ''.join(value)
+        return value
+
+    def get(self, key, default=None):
+        if key not in self.field_spans:
+            return default
+        return self[key]
+
+    def keys(self):
+        return self.field_spans.keys()
+
+    @property
+    def id(self):
+        return self.get('id')
+
+    @property
+    def cell_type(self):
+        return self['cell_type']
+
+    @property
+    def source(self):
+        return self['source']
+
+    @property
+    def metadata(self):
+        return from_dict(self._decode('metadata'))
+
+    def materialize(self) -> NotebookNode:
+        """
+        Full cell in the same in-memory form nbformat.read produces.
+        """
+        start, end = self.span
+        cell = json.loads(self.data[start:end])
+        nb = rejoin_lines(from_dict({'cells': [cell]}))
+        cell = nb.cells[0]
+        cell.metadata.pop('trusted', None)
+        return cell
+
+    def __repr__(self):
+        return f"LazyCell(id={self.id}, cell_type={self.cell_type})"
+
+
+class LazyNotebook:
+    def __init__(self, data: bytes):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.data = data
+        self.field_spans, _ = scan_object(data)
+        self._cell_spans = None
+        self._cells = {}
+        self._metadata = None
+
+    @classmethod
+    def from_path(cls, os_path):
+        with open(os_path, 'rb') as f:
+            return cls(f.read())
+
+    def _decode(self, key, default=None):
+        if key not in self.field_spans:
+            return default
+        start, end = self.field_spans[key]
+        return json.loads(self.data[start:end])
+
+    @property
+    def nbformat(self) -> int:
+        return self._decode('nbformat')
+
+    @property
+    def nbformat_minor(self) -> int:
+        return self._decode('nbformat_minor', 0)
+
+    @property
+    def metadata(self) -> NotebookNode:
+        if self._metadata is None:
+            self._metadata = from_dict(self._decode('metadata', {}))
+        return self._metadata
+
+    @property
+    def cell_spans(self):
+        if self._cell_spans is None:
+            if self.nbformat != 4:
+                raise LazyNotebookError(
+                    f"Lazy cells are only supported for nbformat 4, got {self.nbformat}"
+                )
+            if 'cells' not in self.field_spans:
+                self._cell_spans = []
+            else:
+                start, _ = self.field_spans['cells']
+                self._cell_spans, _ = scan_array(self.data, start)
+        return self._cell_spans
+
+    @property
+    def cell_count(self):
+        return len(self.cell_spans)
+
+    def cell(self, index) -> LazyCell:
+        if index not in self._cells:
+            self._cells[index] = LazyCell(self.data, self.cell_spans[index])
+        return self._cells[index]
+
+    def iter_cells(self):
+        for index in range(self.cell_count):
+            yield self.cell(index)
+
+    def materialize(self, as_version=4, capture_validation_error=None) -> NotebookNode:
+        """
+        Full NotebookNode. Equivalent to nbformat.read on the same bytes.
+        """
+        return nbformat.reads(
+            self.data.decode('utf-8'),
+            as_version=as_version,
+            capture_validation_error=capture_validation_error,
+        )
+
+    def __repr__(self):
+        size = len(self.data)
+        return f"LazyNotebook(nbformat={self.nbformat}, {size=})"
+
+
+def read_notebook_metadata(os_path) -> NotebookNode:
+    """
+    Notebook level metadata without decoding cells or outputs.
+    """
+    return LazyNotebook.from_path(os_path).metadata
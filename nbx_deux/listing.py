@@ -0,0 +1,209 @@
+"""
+Directory listing engine built on `os.scandir`.
+
+`ContentsManager.get` style listings stat every child several times (lstat for
+filtering, stat for the model, access for writable). Here a directory is
+scanned once and the `DirEntry` lstat result travels with each child so models
+can be built without going back to the filesystem.
+
+ListingCache keeps the scanned entries per directory keyed on the directory's
+(dev, inode, mtime). Adding, removing or renaming a child bumps the directory
+mtime, so an unchanged directory costs a single stat to revalidate.
+
+NOTE: Editing a child in place does not touch the parent mtime. Anything that
+writes into a cached directory without replacing files should call
+`ListingCache.invalidate`.
+
+With `watched` set, a watcher (see nbx_deux.watcher) is calling `invalidate`
+for every change, so cached directories are returned without the stat.
+"""
+import dataclasses as dc
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from jupyter_core.paths import is_file_hidden
+
+from nbx_deux.fileio import FCM_HIDE_GLOBS, should_list, stat_has_access
+
+# Directories modified this recently are not cached. Filesystem timestamps are
+# coarser than the writes they track, so a change landing in the same tick as
+# our scan would otherwise go unnoticed. Same idea as git's racy index check.
+RACY_WINDOW_NS = 2 * 10**9
+
+
+@dc.dataclass(frozen=True, slots=True)
+class ListingEntry:
+    name: str
+    os_path: str
+    # lstat result, mirrors what FileContentsManager uses for its models
+    stat: os.stat_result
+    # follows symlinks
+    is_dir: bool
+
+    @property
+    def is_symlink(self):
+        return stat.S_ISLNK(self.stat.st_mode)
+
+
+def scan_dir(os_dir) -> tuple[ListingEntry, ...]:
+    """
+    Scan os_dir and return entries for regular files, directories and symlinks.
+    """
+    entries = []
+    with os.scandir(os_dir) as it:
+        for entry in it:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if (
+                not stat.S_ISLNK(st.st_mode)
+                and not stat.S_ISREG(st.st_mode)
+                and not stat.S_ISDIR(st.st_mode)
+            ):
+                continue
+
+            try:
+                # only costs a syscall for symlinks
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            entries.append(ListingEntry(
+                name=entry.name,
+                os_path=entry.path,
+                stat=st,
+                is_dir=is_dir,
+            ))
+    return tuple(entries)
+
+
+def entry_is_hidden(entry: ListingEntry):
+    """
+    `is_file_hidden` without the syscalls it makes for directories.
+    """
+    if entry.name.startswith('.'):
+        return True
+
+    # symlinks need the target stat. let jupyter_core handle them.
+    if entry.is_symlink:
+        return is_file_hidden(entry.os_path, stat_res=entry.stat)
+
+    st = entry.stat
+    if stat.S_ISDIR(st.st_mode):
+        can_list = stat_has_access(st, os.X_OK | os.R_OK)
+        if can_list is None:
+            return is_file_hidden(entry.os_path, stat_res=st)
+        if not can_list:
+            return True
+
+    if getattr(st, "st_flags", 0) & stat.UF_HIDDEN:
+        return True
+
+    return False
+
+
+def filter_entries(entries, *, allow_hidden=False, hide_globs=FCM_HIDE_GLOBS):
+    for entry in entries:
+        if not should_list(entry.name, hide_globs):
+            continue
+        try:
+            if not allow_hidden and entry_is_hidden(entry):
+                continue
+        except OSError:
+            continue
+        yield entry
+
+
+def is_racy(st):
+    """
+    Whether st was modified too recently for its mtime to be trusted as a key.
+    """
+    return time.time_ns() - st.st_mtime_ns < RACY_WINDOW_NS
+
+
+class ListingCache:
+    """
+    LRU of scanned directory entries keyed on the directory (dev, inode, mtime).
+    """
+    def __init__(self, maxsize=256, watched=False):
+        self.maxsize = maxsize
+        self.watched = watched
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        # bumped by every invalidate so a scan that raced one isn't stored
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def dir_key(st):
+        return (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+    def get_entries(self, os_dir) -> tuple[ListingEntry, ...]:
+        os_dir = str(os_dir)
+        st = None
+        key = None
+        if not self.watched:
+            st = os.stat(os_dir)
+            key = self.dir_key(st)
+
+        with self._lock:
+            cached = self._entries.get(os_dir)
+            if cached is not None and cached[0] == key:
+                self._entries.move_to_end(os_dir)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            generation = self._generation
+
+        entries = scan_dir(os_dir)
+
+        if st is not None and is_racy(st):
+            return entries
+
+        with self._lock:
+            if generation != self._generation:
+                return entries
+            self._entries[os_dir] = (key, entries)
+            self._entries.move_to_end(os_dir)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entries
+
+    def invalidate(self, os_dir=None):
+        """
+        Drop os_dir from the cache. No argument clears everything.
+        """
+        with self._lock:
+            self._generation += 1
+            if os_dir is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(str(os_dir), None)
+
+    def invalidate_tree(self, os_dir):
+        """
+        Drop os_dir and every directory below it.
+        """
+        os_dir = str(os_dir)
+        prefix = os_dir.rstrip(os.sep) + os.sep
+        with self._lock:
+            self._generation += 1
+            for path in [p for p in self._entries if p == os_dir or p.startswith(prefix)]:
+                del self._entries[path]
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,27 +1,112 @@
+import asyncio
 import dataclasses as dc
+import functools
 import os
 from pathlib import Path
 
 
-from traitlets import Dict, Unicode, List
+from traitlets import Dict, Enum, Float, Integer, Unicode, List
 from jupyter_server.services.contents.filemanager import FileContentsManager
 from jupyter_server.services.contents.manager import ContentsManager
 from nbx_deux.bundle_manager.bundle_nbmanager import BundleContentsManager
+from nbx_deux.models import anchored_model_dict
 from nbx_deux.nbx_manager import NBXContentsManager, ApiPath
 from nbx_deux.root_manager import RootContentsManager
+from nbx_deux.watcher import WATCH_BACKENDS
 
 
-@dc.dataclass(kw_only=True)
+@dc.dataclass(kw_only=True, frozen=True, slots=True)
 class ManagerMeta:
     """
+    Where a request path was routed. Frozen so resolutions can be cached and
+    shared between requests.
     """
     # the original request path
     request_path: str
-    # nbm alias
+    # nbm alias. '' routes to the root manager
     nbm_path: str
     path: str
 
 
+class _RouteNode:
+    __slots__ = ('children', 'alias')
+
+    def __init__(self):
+        self.children: dict[str, _RouteNode] = {}
+        self.alias: str | None = None
+
+
+class AliasRouter:
+    """
+    Longest prefix match of API paths against manager aliases.
+
+    Aliases can be nested, e.g. `team` and `team/projects`. The longer alias
+    shadows that part of the shorter one's tree. Paths that are only a prefix
+    of aliases, like `team` when just `team/projects` is configured, route to
+    the root manager as virtual directories.
+    """
+    def __init__(self, aliases):
+        self.root = _RouteNode()
+        for alias in aliases:
+            segments = alias.strip('/').split('/')
+            if not all(segments):
+                raise Exception(f"Invalid manager alias {alias!r}")
+            node = self.root
+            for segment in segments:
+                node = node.children.setdefault(segment, _RouteNode())
+            node.alias = '/'.join(segments)
+
+    def resolve(self, path) -> ManagerMeta:
+        path = path.strip('/')
+        if not path:
+            return ManagerMeta(request_path='', nbm_path='', path='')
+
+        node = self.root
+        alias = None
+        for segment in path.split('/'):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.alias is not None:
+                alias = node.alias
+
+        if alias is not None:
+            return ManagerMeta(
+                request_path=path,
+                nbm_path=alias,
+                path=path[len(alias) + 1:],
+            )
+        if node is not None:
+            return ManagerMeta(request_path=path, nbm_path='', path=path)
+        raise Exception(f"Could not find manager for {path=}")
+
+    def _node(self, path) -> _RouteNode:
+        node = self.root
+        path = path.strip('/')
+        for segment in path.split('/') if path else []:
+            node = node.children[segment]
+        return node
+
+    def children(self, path) -> list[str]:
+        """
+        Names directly under a root or virtual directory path.
+        """
+        return list(self._node(path).children)
+
+    def aliases_under(self, path) -> list[str]:
+        """
+        Every alias at or below path.
+        """
+        aliases = []
+        stack = [self._node(path)]
+        while stack:
+            node = stack.pop()
+            if node.alias is not None:
+                aliases.append(node.alias)
+            stack.extend(node.children.values())
+        return aliases
+
+
 class MetaManager(NBXContentsManager):
     # Used to have file_dirs, but removed since bundle_dirs can handle regular files
     bundle_dirs = Dict(
@@ -29,82 +114,136 @@ class MetaManager(NBXContentsManager):
         help="BundleNBManager. Dict of alias, path"
     )
     trash_dir = Unicode(config=True)
+    bundle_index_dir = Unicode(
+        '',
+        config=True,
+        help="Directory for per alias sqlite metadata indexes. Empty disables indexing.",
+    )
     submanager_post_save_hooks = List(
         config=True,
     )
+    watch_files = Enum(
+        WATCH_BACKENDS,
+        default_value='off',
+        config=True,
+        help="BundleContentsManager.watch_files for every bundle_dirs root.",
+    )
+    watch_poll_interval = Float(
+        1.0,
+        config=True,
+        help="BundleContentsManager.watch_poll_interval for every bundle_dirs root.",
+    )
+    route_cache_size = Integer(
+        4096,
+        config=True,
+        help="Number of request path resolutions to keep.",
+    )
+    root_listing_timeout = Float(
+        2.0,
+        config=True,
+        help="RootContentsManager.listing_timeout",
+    )
+    root_listing_ttl = Float(
+        10.0,
+        config=True,
+        help="RootContentsManager.listing_ttl",
+    )
 
     def __init__(self, *args, managers=None, **kwargs):
         super().__init__(*args, **kwargs)
         if managers is None:
             managers = {}
         self.managers = managers
+        self._loop = None
         self.init_managers()
 
     def init_managers(self):
         for alias, path in self.bundle_dirs.items():
-            fb = BundleContentsManager(root_dir=str(path), trash_dir=self.trash_dir)
-            for hook in self.submanager_post_save_hooks:
-                fb.register_post_save_hook(hook)
-                fb.fm.register_post_save_hook(hook)
-            self.managers[alias] = fb
+            self.managers[alias.strip('/')] = self.new_submanager(alias, path)
 
-        self.root = RootContentsManager(meta_manager=self)
-
-    def get_nbm_from_path(self, path) -> tuple[ContentsManager, ManagerMeta]:
-        path = path.strip('/')
-
-        # we are on root
-        if not path:
-            meta = ManagerMeta(
-                request_path=path,
-                nbm_path='',
-                path='',
-            )
-            return self.root, meta
+        self.init_router()
+        self.root = RootContentsManager(
+            meta_manager=self,
+            listing_timeout=self.root_listing_timeout,
+            listing_ttl=self.root_listing_ttl,
+        )
 
-        bits = path.split(os.sep)
-        nbm_path = bits.pop(0)
-        local_path = os.sep.join(bits)
-        meta = ManagerMeta(
-            request_path=path,
-            nbm_path=nbm_path,
-            path=local_path,
+    def new_submanager(self, alias, path) -> ContentsManager:
+        index_path = ''
+        if self.bundle_index_dir:
+            index_path = os.path.join(self.bundle_index_dir, f"{alias}.sqlite")
+        fb = BundleContentsManager(
+            root_dir=str(path),
+            trash_dir=self.trash_dir,
+            index_path=index_path,
+            watch_files=self.watch_files,
+            watch_poll_interval=self.watch_poll_interval,
         )
+        for hook in self.submanager_post_save_hooks:
+            fb.register_post_save_hook(hook)
+            fb.fm.register_post_save_hook(hook)
+        fb.change_listeners.append(functools.partial(self.submanager_changed, alias))
+        return fb
+
+    def init_router(self):
+        """
+        (Re)build routing from self.managers. Call after changing managers.
+        """
+        self.router = AliasRouter(self.managers)
+        self._route = functools.lru_cache(maxsize=self.route_cache_size)(self.router.resolve)
+
+    def submanager_changed(self, alias, data):
+        """
+        Re-emit an external change seen by a submanager under its alias.
+        """
+        self.root.invalidate_summaries(alias)
+        data = dict(data)
+        data['path'] = os.path.join(alias, data['path'])
+        if 'source_path' in data:
+            data['source_path'] = os.path.join(alias, data['source_path'])
+        self.emit(data=data)
+
+    def bind_loop(self, loop=None):
+        """
+        Hand the running loop to the watching submanagers, see
+        BundleContentsManager.bind_loop. Submanager calls may not run on the
+        loop, so we do it from our own requests.
+        """
+        if loop is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+        if loop is self._loop:
+            return
+        self._loop = loop
+        for nbm in self.managers.values():
+            if bind_loop := getattr(nbm, 'bind_loop', None):
+                bind_loop(loop)
+
+    def stop_watchers(self):
+        for nbm in self.managers.values():
+            if stop_watcher := getattr(nbm, 'stop_watcher', None):
+                stop_watcher()
 
-        nbm = self.managers.get(nbm_path, None)
-        if nbm is None:
-            raise Exception(f"Could not find {nbm_path=} {path=}")
-        return nbm, meta
+    def get_nbm_from_path(self, path) -> tuple[ContentsManager, ManagerMeta]:
+        meta = self._route(path)
+        # root or a virtual directory above nested aliases
+        if not meta.nbm_path:
+            return self.root, meta
+        return self.managers[meta.nbm_path], meta
 
     # ContentManager API
     def get(self, path: ApiPath, content=True, type=None, format=None):
+        self.bind_loop()
         nbm, meta = self.get_nbm_from_path(path)
         model = nbm.get(meta.path, content=content, type=type, format=format)
-
-        # meh. if we're changing back to dict so quickly, maybe just use
-        # TypedDict instead?
-        if hasattr(model, 'asdict'):
-            model = model.asdict()
-
-        self.reanchor_paths_with_nbm_path(model, meta)
-
-        return model
-
-    def reanchor_paths_with_nbm_path(self, model, meta):
-        # while the local manager doesn't know its nbm_path,
-        # we have to add it back in for the metamanager.
-        if model['type'] == 'directory':
-            if not (content := model.get("content", [])):
-                return
-
-            for m in content:
-                m['path'] = os.path.join(meta.nbm_path, m['path'])
-
-        # so the path needs to be the full request path.
-        if model['type'] == 'notebook':
-            model['path'] = os.path.join(meta.nbm_path, model['path'])
+        # while the local manager doesn't know its nbm_path, we have to add it
+        # back in for the metamanager. content is passed through, not copied.
+        return anchored_model_dict(model, meta.nbm_path)
 
     def save(self, model, path: ApiPath):
+        self.bind_loop()
         nbm, meta = self.get_nbm_from_path(path)
         return nbm.save(model, meta.path)
 
@@ -10,9 +10,7 @@ import dataclasses as dc
 from datetime import datetime
 import mimetypes
 from typing import Any, ClassVar, cast
-import stat
 from functools import partial
-from jupyter_core.paths import is_file_hidden
 from jupyter_server.services.contents.filemanager import FileContentsManager
 from jupyter_server.utils import ApiPath, to_os_path
 from nbformat import NotebookNode
@@ -20,55 +18,101 @@ from nbformat import NotebookNode
 from nbx_deux.fileio import (
     FCM_HIDE_GLOBS,
     get_ospath_metadata,
+    get_stat_metadata,
     mark_trusted_cells,
     ospath_is_writable,
+    stat_is_writable,
     _read_file,
-    _read_notebook,
-    should_list,
+    _read_validated_notebook,
     validate_notebook_model,
 )
+from nbx_deux.listing import ListingEntry, filter_entries, scan_dir
 
 RelPath = str
 
 
-def model_to_dict(obj) -> dict:
+# Leaves that can be handed out as is. deepcopy would return the same object
+# for these anyway, but only after a trip through its dispatch.
+IMMUTABLE_TYPES = frozenset({str, bytes, int, float, bool, type(None), datetime})
+
+
+def model_to_dict(obj, share=False) -> dict:
     """
     Modified dc.asdict that allows Models to control how they turn into dicts.
+
+    share=True skips copying notebook content. NotebookNode values are passed
+    through by reference and only model / list / dict containers are rebuilt,
+    so callers can still set top level keys but must not mutate the notebook.
     """
     if not isinstance(obj, BaseModel):
         raise Exception(f"model_to_dict only works on BaseModel {type(obj)}")
-    dct = _model_to_dict(obj)
+    dct = _model_to_dict(obj, share)
     dct = cast(dict, dct)
     return dct
 
 
-def _model_to_dict(obj):
-    if isinstance(obj, BaseModel):
+def _model_to_dict(obj, share=False):
+    if type(obj) in IMMUTABLE_TYPES:
+        return obj
+    elif isinstance(obj, BaseModel):
         results = {}
         for k, v in obj.asdict(shallow=True).items():
-            results[k] = _model_to_dict(v)
+            results[k] = _model_to_dict(v, share)
         return results
     elif dc._is_dataclass_instance(obj):
         result = []
         for f in dc.fields(obj):
-            value = _model_to_dict(getattr(obj, f.name))
+            value = _model_to_dict(getattr(obj, f.name), share)
             result.append((f.name, value))
         return dict(result)
+    elif share and isinstance(obj, NotebookNode):
+        return obj
     elif isinstance(obj, tuple) and hasattr(obj, '_fields'):
-        return type(obj)(*[_model_to_dict(v) for v in obj])
+        return type(obj)(*[_model_to_dict(v, share) for v in obj])
     elif isinstance(obj, (list, tuple)):
         # Assume we can create an object of this type by passing in a
         # generator (which is not true for namedtuples, handled
         # above).
-        return type(obj)(_model_to_dict(v) for v in obj)
+        return type(obj)(_model_to_dict(v, share) for v in obj)
     elif isinstance(obj, dict):
-        return type(obj)((_model_to_dict(k),
-                          _model_to_dict(v))
+        return type(obj)((_model_to_dict(k, share),
+                          _model_to_dict(v, share))
                          for k, v in obj.items())
     else:
         return copy.deepcopy(obj)
 
 
+def _shallow_dict(model) -> dict:
+    if isinstance(model, BaseModel):
+        return model.asdict(shallow=True)
+    return dict(model)
+
+
+def anchored_model_dict(model, prefix: str) -> dict:
+    """
+    Shallow dict of model with prefix in front of its path and, for
+    directories, its children's paths.
+
+    Only the top level dict and the directory content list are new. Notebook
+    content, children's values etc. are the model's own objects, so this is
+    for passing a model on, not for editing it.
+    """
+    dct = _shallow_dict(model)
+    if not prefix:
+        return dct
+
+    path = dct['path']
+    dct['path'] = f"{prefix}/{path}" if path else prefix
+    if dct.get('type') == 'directory' and dct.get('content'):
+        children = []
+        for child in dct['content']:
+            child = _shallow_dict(child)
+            child['path'] = f"{prefix}/{child['path']}"
+            children.append(child)
+        dct['content'] = children
+    return dct
+
+
 def default_model_get(path: ApiPath, content, root_dir):
     """
     Normally for directory type listings the ContentsManager.get is called for each subitem.
@@ -94,6 +138,36 @@ def default_model_get(path: ApiPath, content, root_dir):
     return model
 
 
+def default_entry_model_get(path: ApiPath, entry: ListingEntry, root_dir):
+    """
+    default_model_get for directory listings. Builds the content=False model
+    from the scandir entry instead of going back to the filesystem.
+    """
+    os_path = entry.os_path
+    if entry.is_dir:
+        model = DirectoryModel.from_filepath(
+            os_path,
+            root_dir=root_dir,
+            content=False,
+            stat_res=entry.stat,
+        )
+    elif entry.name.endswith('.ipynb'):
+        model = NotebookModel.from_filepath(
+            os_path,
+            root_dir=root_dir,
+            content=False,
+            stat_res=entry.stat,
+        )
+    else:
+        model = FileModel.from_filepath(
+            os_path,
+            root_dir=root_dir,
+            content=False,
+            stat_res=entry.stat,
+        )
+    return model
+
+
 @dc.dataclass(kw_only=True)
 class BaseModel:
     """
@@ -136,8 +210,17 @@ class BaseModel:
         )
 
     @classmethod
-    def from_filepath_dict(cls, os_path, root_dir=None) -> dict:
-        f_metadata = get_ospath_metadata(os_path)
+    def from_filepath_dict(cls, os_path, root_dir=None, stat_res=None) -> dict:
+        """
+        stat_res: lstat result for os_path. When passed (i.e. from a directory
+        scan) no further syscalls are made.
+        """
+        if stat_res is None:
+            f_metadata = get_ospath_metadata(os_path)
+            writable = ospath_is_writable(os_path)
+        else:
+            f_metadata = get_stat_metadata(stat_res)
+            writable = stat_is_writable(os_path, stat_res)
 
         if root_dir is None:
             # default to root dir being the parent.
@@ -148,7 +231,6 @@ class BaseModel:
                 path = ''
 
         name = os.path.split(path)[1]
-        writable = ospath_is_writable(os_path)
 
         model = dict(
             name=name,
@@ -167,19 +249,20 @@ class BaseModel:
         )
         return cls(**model_dict)
 
-    def asdict(self, shallow=False) -> dict:
+    def asdict(self, shallow=False, share=False) -> dict:
         if shallow is False:
-            return model_to_dict(self)
+            return model_to_dict(self, share=share)
 
-        dct = self._shallow_asdict()
-        if 'message' in dct and dct['message'] is None:
-            dct.pop('message')
-        return dct
+        return self._shallow_asdict()
 
     def _shallow_asdict(self):
         result = {}
         for f in dc.fields(self):
             value = getattr(self, f.name)
+            # skipped rather than popped after, inserting it first would
+            # have grown the dict to the next table size
+            if f.name == 'message' and value is None:
+                continue
             result[f.name] = value
         return result
 
@@ -207,11 +290,18 @@ class FileModel(BaseModel):
     type: str = dc.field(default='file', init=False)
 
     @classmethod
-    def from_filepath_dict(cls, os_path, root_dir=None, content=True, format=None):
-        if not os.path.isfile(os_path):
+    def from_filepath_dict(
+        cls,
+        os_path,
+        root_dir=None,
+        content=True,
+        format=None,
+        stat_res=None,
+    ):
+        if stat_res is None and not os.path.isfile(os_path):
             raise Exception(f"FileModel called on non-file path {os_path=}")
 
-        model = BaseModel.from_filepath_dict(os_path, root_dir=root_dir)
+        model = BaseModel.from_filepath_dict(os_path, root_dir=root_dir, stat_res=stat_res)
         model["mimetype"] = mimetypes.guess_type(os_path)[0]
 
         if content:
@@ -245,13 +335,23 @@ class NotebookModel(BaseModel):
         return cls(content=nb, created=created, last_modified=last_modified, **kwargs)
 
     @classmethod
-    def from_filepath_dict(cls, os_path, root_dir=None, content=True, format=None):
-        model = BaseModel.from_filepath_dict(os_path, root_dir=root_dir)
+    def from_filepath_dict(
+        cls,
+        os_path,
+        root_dir=None,
+        content=True,
+        format=None,
+        stat_res=None,
+        validation_policy='always',
+    ):
+        model = BaseModel.from_filepath_dict(os_path, root_dir=root_dir, stat_res=stat_res)
 
         if content:
-            validation_error: dict = {}
-            nb = _read_notebook(os_path)
-            mark_trusted_cells(nb)
+            nb, digest, validation_error = _read_validated_notebook(
+                os_path,
+                validation_policy=validation_policy,
+            )
+            mark_trusted_cells(nb, digest=digest)
             model["content"] = nb
             validate_notebook_model(model, validation_error)
 
@@ -278,34 +378,31 @@ class DirectoryModel(BaseModel):
         os_dir,
         path,
         *,
-        model_get,
+        model_get=None,
+        entry_model_get=None,
         allow_hidden=False,
-        hide_globs=FCM_HIDE_GLOBS
+        hide_globs=FCM_HIDE_GLOBS,
+        listing_cache=None,
     ):
-        contents = []
-        for name in os.listdir(os_dir):
-            try:
-                os_path = os.path.join(os_dir, name)
-            except UnicodeDecodeError as e:
-                continue
-
-            try:
-                st = os.lstat(os_path)
-            except OSError as e:
-                continue
-
-            if (
-                not stat.S_ISLNK(st.st_mode)
-                and not stat.S_ISREG(st.st_mode)
-                and not stat.S_ISDIR(st.st_mode)
-            ):
-                continue
+        """
+        model_get(path, content) is the ContentsManager.get style callback.
+        entry_model_get(path, entry) receives the ListingEntry from the scan
+        so it can build the child model from the cached stat result.
+        """
+        if listing_cache is not None:
+            entries = listing_cache.get_entries(os_dir)
+        else:
+            entries = scan_dir(os_dir)
 
+        contents = []
+        for entry in filter_entries(entries, allow_hidden=allow_hidden, hide_globs=hide_globs):
+            child_path = f"{path}/{entry.name}"
             try:
-                if should_list(name, hide_globs) and (
-                    allow_hidden or not is_file_hidden(os_path, stat_res=st)
-                ):
-                    contents.append(model_get(path=f"{path}/{name}", content=False))
+                if entry_model_get is not None:
+                    model = entry_model_get(path=child_path, entry=entry)
+                else:
+                    model = model_get(path=child_path, content=False)
+                contents.append(model)
             except OSError as e:
                 # ELOOP: recursive symlink, also don't show failure due to permissions
                 if e.errno not in [errno.ELOOP, errno.EACCES]:
@@ -318,7 +415,10 @@ class DirectoryModel(BaseModel):
         os_path,
         root_dir=None,
         content=True,
-        model_get=None
+        model_get=None,
+        entry_model_get=None,
+        listing_cache=None,
+        stat_res=None,
     ):
 
         # Default Directory root_dir to os_path
@@ -328,6 +428,7 @@ class DirectoryModel(BaseModel):
         model = BaseModel.from_filepath_dict(
             os_path,
             root_dir=root_dir,
+            stat_res=stat_res,
         )
         model["size"] = None
 
@@ -336,12 +437,14 @@ class DirectoryModel(BaseModel):
             # the CM logic without needing a CM. This will be wrong for things
             # like Bundles which *require* the specifc bundle logic to correctly
             # return notebooks/files/dirs.
-            if model_get is None:
-                model_get = partial(default_model_get, root_dir=root_dir)
+            if model_get is None and entry_model_get is None:
+                entry_model_get = partial(default_entry_model_get, root_dir=root_dir)
             content = cls.get_dir_content(
                 os_path,
                 model['path'],
-                model_get=model_get
+                model_get=model_get,
+                entry_model_get=entry_model_get,
+                listing_cache=listing_cache,
             )
             model['content'] = content
             # Copying jupyter idiom of only setting format when content is requested
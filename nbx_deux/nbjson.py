@@ -0,0 +1,287 @@
+"""
+Pluggable json backend for reading and writing notebooks.
+
+nbformat always goes through the stdlib json module on text. This reads bytes
+straight into the backend and writes the whole document with one buffered
+call, while keeping nbformat's on-disk layout (indent=1, sorted keys,
+ensure_ascii=False, split lines) byte for byte so diffs stay stable.
+
+orjson is used when installed, then ujson, then stdlib json. Anything the
+fast encoder would format differently from stdlib json (exponent floats,
+nan/inf, non-str keys, huge ints) falls back to stdlib for that document.
+"""
+import json
+import math
+
+from nbformat import NBFormatError, ValidationError, versions
+from nbformat.notebooknode import NotebookNode
+from nbformat.reader import NotJSONError, get_version
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+TRANSIENT_NB_METADATA = ('orig_nbformat', 'orig_nbformat_minor', 'signature')
+NON_TEXT_SPLIT_MIMES = {'application/javascript', 'image/svg+xml'}
+
+
+def _split_mimebundle(data):
+    """_split_mimebundle from nbformat.v4.rwbase that returns a copy."""
+    out = {}
+    for key, value in data.items():
+        if isinstance(value, str) and (key.startswith('text/') or key in NON_TEXT_SPLIT_MIMES):
+            value = value.splitlines(True)
+        out[key] = value
+    return out
+
+
+def _disk_metadata(metadata, transient):
+    return {k: v for k, v in metadata.items() if k not in transient}
+
+
+def _disk_output(output):
+    output_type = output.get('output_type')
+    if output_type in {'execute_result', 'display_data'} and 'data' in output:
+        output = dict(output)
+        output['data'] = _split_mimebundle(output['data'])
+    elif output_type == 'stream' and isinstance(output.get('text'), str):
+        output = dict(output)
+        output['text'] = output['text'].splitlines(True)
+    return output
+
+
+def _disk_cell(cell):
+    cell = dict(cell)
+    source = cell.get('source')
+    if isinstance(source, str):
+        cell['source'] = source.splitlines(True)
+
+    if 'attachments' in cell:
+        cell['attachments'] = {
+            name: _split_mimebundle(bundle)
+            for name, bundle in cell['attachments'].items()
+        }
+
+    if 'metadata' in cell:
+        cell['metadata'] = _disk_metadata(cell['metadata'], ('trusted',))
+
+    if cell.get('cell_type') == 'code' and 'outputs' in cell:
+        cell['outputs'] = [_disk_output(output) for output in cell['outputs']]
+    return cell
+
+
+def to_disk_notebook(nb) -> dict:
+    """
+    v4 notebook in the form JSONWriter dumps: split_lines + strip_transient.
+
+    JSONWriter deepcopies the whole notebook first so it doesn't modify the
+    in-memory dict. This only shallow copies the containers on the way to
+    something that changes, so output payloads are shared, not copied.
+    """
+    disk = dict(nb)
+    if 'metadata' in disk:
+        disk['metadata'] = _disk_metadata(disk['metadata'], TRANSIENT_NB_METADATA)
+    if 'cells' in disk:
+        disk['cells'] = [_disk_cell(cell) for cell in disk['cells']]
+    return disk
+
+
+def _bytes_default(obj):
+    """nbformat's BytesEncoder.default"""
+    if isinstance(obj, bytes):
+        return obj.decode('ascii')
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class _BytesEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, bytes):
+            return obj.decode('ascii')
+        return super().default(obj)
+
+
+def _float_is_safe(value):
+    # fast encoders agree with repr except for exponent notation and nan/inf
+    return math.isfinite(value) and 'e' not in repr(value)
+
+
+def has_unsafe_values(obj) -> bool:
+    """
+    Does obj contain values that a fast encoder won't format like stdlib json?
+    """
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            for key, value in obj.items():
+                if not isinstance(key, str):
+                    return True
+                if not isinstance(value, str):
+                    stack.append(value)
+        elif isinstance(obj, (list, tuple)):
+            for value in obj:
+                if not isinstance(value, str):
+                    stack.append(value)
+        elif isinstance(obj, float):
+            if not _float_is_safe(obj):
+                return True
+    return False
+
+
+class JSONBackend:
+    """
+    stdlib json. Also the base for the other backends.
+    """
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        s = json.dumps(
+            obj,
+            cls=_BytesEncoder,
+            indent=1,
+            sort_keys=True,
+            separators=(',', ': '),
+            ensure_ascii=False,
+        )
+        return s.encode('utf-8')
+
+    def parse_json(self, data):
+        try:
+            return self.loads(data)
+        except ValueError as e:
+            error = e
+
+        if self.name != JSONBackend.name:
+            # fast parsers are stricter than stdlib json about NaN, huge ints, etc.
+            try:
+                return json.loads(data)
+            except ValueError as e:
+                error = e
+
+        message = f"Notebook does not appear to be JSON: {data!r}"
+        if len(message) > 80:
+            message = message[:77] + "..."
+        raise NotJSONError(message) from error
+
+    def reads_notebook(self, data) -> NotebookNode:
+        """
+        nbformat.reader.reads. No conversion or validation.
+        """
+        nb_dict = self.parse_json(data)
+        major, minor = get_version(nb_dict)
+        if major not in versions:
+            raise NBFormatError(f"Unsupported nbformat version {major}")
+        try:
+            return versions[major].to_notebook_json(nb_dict, minor=minor)
+        except AttributeError as e:
+            msg = f"The notebook is invalid and is missing an expected key: {e}"
+            raise ValidationError(msg) from None
+
+    def writes_notebook(self, nb) -> bytes:
+        """
+        Same bytes as nbformat.write(nb, version=NO_CONVERT) to a utf-8 file.
+        """
+        major, _ = get_version(nb)
+        if major != 4:
+            s = versions[major].writes_json(nb)
+        else:
+            s = self.dumps(to_disk_notebook(nb))
+        if isinstance(s, str):
+            s = s.encode('utf-8')
+        if not s.endswith(b'\n'):
+            s += b'\n'
+        return s
+
+
+class OrjsonBackend(JSONBackend):
+    name = 'orjson'
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        if has_unsafe_values(obj):
+            return super().dumps(obj)
+        try:
+            data = orjson.dumps(
+                obj,
+                default=_bytes_default,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS,
+            )
+        except TypeError:
+            # surrogates, ints over 64 bits, etc.
+            return super().dumps(obj)
+        return reindent(data)
+
+
+class UjsonBackend(JSONBackend):
+    """
+    ujson for reads only. Its encoder doesn't match stdlib indentation or
+    float formatting so writes stay on stdlib json.
+    """
+    name = 'ujson'
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+
+def reindent(data: bytes) -> bytes:
+    """
+    Turn 2 space json indentation into nbformat's 1 space.
+
+    json strings can't contain raw newlines so the leading spaces of every
+    line are indentation. One split and one join was measurably faster than
+    either a regex callback or a bytes.replace per indent level.
+    """
+    lines = data.split(b'\n')
+    return b'\n'.join([line[(len(line) - len(line.lstrip(b' '))) >> 1:] for line in lines])
+
+
+BACKENDS = {
+    'orjson': OrjsonBackend if orjson is not None else None,
+    'ujson': UjsonBackend if ujson is not None else None,
+    'json': JSONBackend,
+}
+
+
+def available_backends() -> list[str]:
+    return [name for name, backend in BACKENDS.items() if backend is not None]
+
+
+def get_backend(name=None) -> JSONBackend:
+    """
+    Backend by name. Defaults to the fastest one installed.
+    """
+    if name is None:
+        name = available_backends()[0]
+    backend = BACKENDS.get(name)
+    if backend is None:
+        raise Exception(f"JSON backend {name!r} is not available")
+    return backend()
+
+
+BACKEND = get_backend()
+
+
+def set_backend(name=None) -> JSONBackend:
+    global BACKEND
+    BACKEND = get_backend(name)
+    return BACKEND
+
+
+def reads_notebook(data) -> NotebookNode:
+    return BACKEND.reads_notebook(data)
+
+
+def writes_notebook(nb) -> bytes:
+    return BACKEND.writes_notebook(nb)
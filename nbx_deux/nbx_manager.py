@@ -1,6 +1,7 @@
 import os
 
 from traitlets import (
+    Enum,
     TraitError,
     Unicode,
     default,
@@ -14,11 +15,22 @@ from jupyter_server.utils import (
 )
 from tornado.web import HTTPError
 
+from nbx_deux.fileio import VALIDATION_POLICIES
 from nbx_deux.models import BaseModel
 
 
 class NBXContentsManager(ContentsManager):
     root_dir = Unicode(config=True)
+    validation_policy = Enum(
+        VALIDATION_POLICIES,
+        default_value='always',
+        config=True,
+        help=(
+            "When to run nbformat schema validation on notebook reads. "
+            "'on-change' caches results per (path, mtime, size, version). "
+            "'on-save-only' relies on the validation done when saving."
+        ),
+    )
 
     # Even though not all CMs will make use of root_dir, feels cleaner to
     # keep it here.
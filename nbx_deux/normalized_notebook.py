@@ -1,5 +1,8 @@
+from collections import OrderedDict
+from collections.abc import Sequence
 from functools import cached_property
-import copy
+import json
+import threading
 
 from nbformat import NotebookNode
 from nbx_deux.nbx_convert import (
@@ -7,12 +10,66 @@ from nbx_deux.nbx_convert import (
     NBXCellScriptCellReader,
     upgrade_nb,
 )
+from nbx_deux.trust_cache import content_digest
+
+
+STRUCTURAL_SKIP = ('source', 'outputs')
+
+
+class PyCellCache:
+    """
+    LRU of rendered percent format cell text.
+
+    A cell's text only depends on its id, type, source and metadata, so
+    re-exporting a notebook after a one cell edit only renders that cell.
+    """
+    def __init__(self, maxsize=8192):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(cell) -> str:
+        data = json.dumps(
+            [cell['id'], cell['cell_type'], cell['source'], cell['metadata']],
+            sort_keys=True,
+        )
+        return content_digest(data.encode('utf-8'))
+
+    def get(self, key):
+        with self._lock:
+            text = self._cache.get(key)
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._cache.move_to_end(key)
+            return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._cache[key] = text
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+
+PYCELL_CACHE = PyCellCache()
 
 
 class NBXNotebookExport:
-    def __init__(self, notebooknode: NotebookNode):
+    def __init__(self, notebooknode: NotebookNode, cache: PyCellCache | None = PYCELL_CACHE):
         self.notebooknode = notebooknode
-        self.cell_map = {cell['id']: cell for cell in notebooknode['cells']}
+        self.cache = cache
 
     def get_pyheader(self, cell):
         bits = []
@@ -30,28 +87,38 @@ class NBXNotebookExport:
 
     @cached_property
     def components(self):
-        # gonna pare down skeleton by removing source / outputs
-        skeleton = copy.deepcopy(self.notebooknode)
+        """
+        Split the notebook into a skeleton without source / outputs, the
+        source cells and the outputs.
+
+        Only the notebook and cell dicts are new. Metadata and outputs are
+        the notebooknode's own objects, so treat them as read only.
+        """
+        nb = self.notebooknode
+        skeleton = NotebookNode({k: v for k, v in nb.items() if k != 'cells'})
+        skeleton['cells'] = []
         source_cells = {}
         all_outputs = {}
 
-        for cell in skeleton['cells']:
+        for cell in nb['cells']:
             id = cell['id']
+            skeleton_cell = NotebookNode({
+                k: v for k, v in cell.items() if k not in STRUCTURAL_SKIP
+            })
+            skeleton['cells'].append(skeleton_cell)
+
             source_cells[id] = NBXCellExport(NotebookNode({
                 'id': id,
                 'cell_type': cell['cell_type'],
-                'source': cell.pop('source'),
+                'source': cell['source'],
                 'metadata': cell['metadata'],
             }), 'python')
 
-            if outputs := cell.pop('outputs', None):
-                sentinel_outputs = []
-                for output in outputs:
-                    sentinel = {
-                        'output_type': output['output_type'],
-                    }
-                    sentinel_outputs.append(sentinel)
-                cell['outputs'] = sentinel_outputs
+            if outputs := cell.get('outputs'):
+                skeleton_cell['outputs'] = [
+                    {'output_type': output['output_type']}
+                    for output in outputs
+                ]
                 all_outputs[id] = outputs
 
         return {
@@ -60,29 +127,144 @@ class NBXNotebookExport:
             'all_outputs': all_outputs
         }
 
+    def render_cell(self, cell) -> str:
+        if self.cache is None:
+            return "\n".join(NBXCellExport(cell, 'python').cell_to_text())
+
+        key = self.cache.key(cell)
+        text = self.cache.get(key)
+        if text is None:
+            text = "\n".join(NBXCellExport(cell, 'python').cell_to_text())
+            self.cache.put(key, text)
+        return text
+
+    def iter_pychunks(self):
+        """
+        The percent format export, a cell or separator at a time.
+        """
+        for i, cell in enumerate(self.notebooknode['cells']):
+            if i:
+                yield "\n\n"
+            yield self.render_cell(cell)
+
+    def write_pyfile(self, f):
+        for chunk in self.iter_pychunks():
+            f.write(chunk)
+
     def to_pyfile(self):
-        outs = []
-        for id, cell in self.components['source_cells'].items():
-            out = cell.cell_to_text()
-            out = "\n".join(out)
-            outs.append(out)
+        return "".join(self.iter_pychunks())
 
-        return "\n\n".join(outs)
 
+class _LineWindow(Sequence):
+    """
+    lines[start:] without the copy.
 
-def nbxpy_to_cells(content):
+    The cell reader is handed "the rest of the file" once per cell and slices
+    it again to look past the cell, so real list slices make parsing
+    quadratic. Open ended slices of a window are windows. Bounded slices are
+    only as long as a cell and are copied as usual.
+    """
+    __slots__ = ('lines', 'start')
+
+    def __init__(self, lines, start=0):
+        self.lines = lines
+        self.start = start
+
+    def __len__(self):
+        return len(self.lines) - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if index.stop is None and step == 1:
+                return _LineWindow(self.lines, self.start + start)
+            return self.lines[self.start + start:self.start + stop:step]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.lines[self.start + index]
+
+    def __iter__(self):
+        lines = self.lines
+        for i in range(self.start, len(lines)):
+            yield lines[i]
+
+
+def nbxpy_cell_chunks(content):
+    """
+    [(cell, text)] where text is the part of content the cell was read from.
+    """
     reader = NBXCellScriptCellReader({})
     lines = content.split('\n')
 
-    cells = []
+    chunks = []
     seen = set()
     offset = 0
     while offset < len(lines):
-        new_cell, pos_next_cell = reader.read(lines[offset:])
+        new_cell, pos_next_cell = reader.read(_LineWindow(lines, offset))
         cell_id = new_cell['id']
         if cell_id in seen:
             raise Exception(f"Got duplicated cell_ids {cell_id=}")
         seen.add(cell_id)
-        cells.append(new_cell)
+        text = "\n".join(lines[offset:offset + pos_next_cell])
+        chunks.append((new_cell, text))
         offset += pos_next_cell
-    return cells
+    return chunks
+
+
+def nbxpy_to_cells(content):
+    return [cell for cell, _ in nbxpy_cell_chunks(content)]
+
+
+def _imported_cell(py_cell):
+    """
+    Notebook cell for a cell that only exists in the nbxpy file.
+    """
+    cell = NotebookNode(py_cell)
+    metadata = NotebookNode(cell['metadata'])
+    # layout hints from the percent format, not cell metadata
+    metadata.pop('lines_to_next_cell', None)
+    if language := metadata.pop('language', None):
+        cell['source'] = f"%%{language}\n{cell['source']}"
+    cell['metadata'] = metadata
+    return cell
+
+
+def merge_nbxpy(nb: NotebookNode, content) -> bool:
+    """
+    Update nb in place from an edited nbxpy export of it, matching cells by id.
+
+    The export drops some detail (cell magics, trailing blank lines) so a cell
+    only takes the nbxpy source if its text differs from what nb exports to.
+    Cells keep their outputs and metadata. Cells that are missing from content
+    are removed, new ones are added, and the order follows content.
+
+    Returns whether nb changed.
+    """
+    old_cells = {cell['id']: cell for cell in nb['cells']}
+    cells = []
+    changed = False
+    for py_cell, text in nbxpy_cell_chunks(content):
+        cell = old_cells.get(py_cell['id'])
+        if cell is None:
+            cells.append(_imported_cell(py_cell))
+            changed = True
+            continue
+
+        exported = "\n".join(NBXCellExport(cell, 'python').cell_to_text())
+        if exported.rstrip('\n') == text.rstrip('\n'):
+            cells.append(cell)
+            continue
+
+        changed = True
+        if cell['cell_type'] != py_cell['cell_type']:
+            cells.append(_imported_cell(py_cell))
+            continue
+        cell['source'] = _imported_cell(py_cell)['source']
+        cells.append(cell)
+
+    if [cell['id'] for cell in cells] != [cell['id'] for cell in nb['cells']]:
+        changed = True
+    nb['cells'] = cells
+    return changed
@@ -1,3 +1,23 @@
+"""
+The root of a MetaManager: a directory per alias.
+
+Each alias entry carries the real metadata of the alias root (mtime, writable,
+...) so clients sorting the home page don't have to `get` every alias. The
+alias roots are fetched concurrently on listing_workers threads and a listing
+waits at most listing_timeout seconds for all of them. Results are kept for
+listing_ttl seconds. An alias that doesn't answer in time is listed with its
+last known model, or a bare one if it never answered. If its fetch had started
+it keeps going in the background to fill the cache for the next listing. One
+still queued behind other aliases is cancelled and asked for again next time.
+"""
+import asyncio
+from concurrent.futures import CancelledError, ThreadPoolExecutor, TimeoutError
+import inspect
+import threading
+import time
+
+from traitlets import Float, Integer
+
 from nbx_deux.models import DirectoryModel
 from nbx_deux.nbx_manager import NBXContentsManager, ApiPath
 
@@ -8,28 +28,164 @@ class RootContentsManager(NBXContentsManager):
 
     Basically creates the psuedo home directory listing
     """
+    listing_timeout = Float(
+        2.0,
+        config=True,
+        help="Seconds a listing waits for the alias roots.",
+    )
+    listing_ttl = Float(
+        10.0,
+        config=True,
+        help="Seconds an alias root model is reused for. 0 always refetches.",
+    )
+    listing_workers = Integer(
+        8,
+        config=True,
+        help="Threads used to fetch alias root models.",
+    )
+
     def __init__(self, *args, meta_manager, **kwargs):
         self.meta_manager = meta_manager
         super().__init__(*args, **kwargs)
+        # alias -> (fetched at, model)
+        self._summaries: dict[str, tuple[float, dict]] = {}
+        # alias -> future of the fetch in progress
+        self._fetching = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        # event loop of each pool thread, for async submanagers
+        self._local = threading.local()
 
     @property
     def managers(self):
         return self.meta_manager.managers
 
-    def _list_nbm_dirs(self):
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.listing_workers,
+                thread_name_prefix='nbx-root',
+            )
+        return self._executor
+
+    def _fetch_summary(self, alias):
+        try:
+            model = self.managers[alias].get('', content=False)
+            if inspect.isawaitable(model):
+                model = self._run_async(model)
+            if hasattr(model, 'asdict'):
+                model = model.asdict()
+            model = dict(model)
+            with self._lock:
+                self._summaries[alias] = (time.monotonic(), model)
+            return model
+        finally:
+            with self._lock:
+                self._fetching.pop(alias, None)
+
+    def _run_async(self, awaitable):
+        """
+        Run an async submanager's call from a pool thread, where no loop is
+        running. Each thread keeps one loop for its lifetime instead of
+        asyncio.run's new loop per call, which would also set up and tear
+        down a default executor for the submanager's stat calls every time.
+        """
+        loop = getattr(self._local, 'loop', None)
+        if loop is None:
+            loop = self._local.loop = asyncio.new_event_loop()
+        return loop.run_until_complete(awaitable)
+
+    def alias_summaries(self, aliases) -> dict[str, dict]:
+        """
+        content=False root models for aliases. Aliases that fail or time out
+        without a previous model are left out.
+        """
+        now = time.monotonic()
+        summaries = {}
+        futures = {}
+        with self._lock:
+            for alias in aliases:
+                fetched_at, model = self._summaries.get(alias, (None, None))
+                if model is not None and now - fetched_at < self.listing_ttl:
+                    summaries[alias] = model
+                    continue
+                # a slow alias only ever has one fetch going
+                if (future := self._fetching.get(alias)) is None:
+                    future = self.executor.submit(self._fetch_summary, alias)
+                    self._fetching[alias] = future
+                futures[alias] = future
+
+        # One deadline for the whole listing. With more aliases than
+        # listing_workers some fetches are still queued when it passes. Those
+        # are cancelled rather than waited on, so the listing stays bounded.
+        deadline = now + self.listing_timeout
+        for alias, future in futures.items():
+            try:
+                summaries[alias] = future.result(timeout=max(deadline - time.monotonic(), 0))
+                continue
+            except TimeoutError:
+                if future.cancel():
+                    # never ran, so _fetch_summary won't clear it
+                    with self._lock:
+                        if self._fetching.get(alias) is future:
+                            del self._fetching[alias]
+                    self.log.warning("Listing alias %s didn't start in time", alias)
+                else:
+                    self.log.warning("Listing alias %s timed out", alias)
+            except CancelledError:
+                # cancelled by a concurrent listing
+                pass
+            except Exception:
+                self.log.exception("Listing alias %s failed", alias)
+            with self._lock:
+                stale = self._summaries.get(alias)
+            if stale is not None:
+                summaries[alias] = stale[1]
+        return summaries
+
+    def invalidate_summaries(self, alias=None):
+        with self._lock:
+            if alias is None:
+                self._summaries.clear()
+            else:
+                self._summaries.pop(alias, None)
+
+    def _list_nbm_dirs(self, path: ApiPath = ''):
+        path = path.strip('/')
+        router = self.meta_manager.router
+        children = {}
+        for name in router.children(path):
+            child_path = f"{path}/{name}".strip('/')
+            is_alias = child_path in self.managers
+            aliases = [child_path] if is_alias else router.aliases_under(child_path)
+            children[name] = (is_alias, aliases)
+        summaries = self.alias_summaries([a for _, aliases in children.values() for a in aliases])
+
         dirs = []
-        for name in self.managers:
-            model = self._get_dir_content_model(name)
+        for name, (is_alias, aliases) in children.items():
+            models = [summaries[alias] for alias in aliases if alias in summaries]
+            model = self._get_dir_content_model(name, path, models, is_alias=is_alias)
             dirs.append(model)
         return dirs
 
     def get(self, path: ApiPath, content=True, type=None, format=None):
         return self.get_dir(path)
 
-    def _get_dir_content_model(self, name):
+    def _get_dir_content_model(self, name, parent='', models=(), is_alias=False):
+        """
+        models: root models of the aliases at or below this entry. A virtual
+        directory gets the newest last_modified of its aliases.
+        """
         model = {}
+        if is_alias and models:
+            model.update(models[0])
+        elif models:
+            model['last_modified'] = max(m['last_modified'] for m in models)
+            model['created'] = min(m['created'] for m in models)
+            model['writable'] = False
         model['name'] = name
-        model['path'] = name
+        model['path'] = f"{parent}/{name}".strip('/')
         model['type'] = 'directory'
         model['format'] = 'json'
         return model
@@ -42,7 +198,7 @@ class RootContentsManager(NBXContentsManager):
 
     def get_dir(self, path: ApiPath, content=True, **kwargs):
         """ retrofit to use old list_dirs. No notebooks """
-        dirs = self._list_nbm_dirs()
+        dirs = self._list_nbm_dirs(path)
         model = DirectoryModel.transient(
             path,
             content=dirs,
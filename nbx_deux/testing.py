@@ -1,6 +1,11 @@
+from datetime import datetime, timezone
+import functools
 from tempfile import TemporaryDirectory
 from pathlib import Path
+import threading
+import time
 
+from github import GithubException, RateLimitExceededException, UnknownObjectException
 from mock import Mock
 import pandas as pd
 
@@ -87,3 +92,197 @@ def makeFakeGist():
     gist.history = history
 
     return gist
+
+
+class FakeGistFile:
+    def __init__(self, filename, content, truncate_at=None):
+        self.filename = filename
+        self.size = len(content.encode('utf-8'))
+        # like the api, large files only come with part of their content
+        self.truncated = truncate_at is not None and len(content) > truncate_at
+        self.content = content[:truncate_at] if self.truncated else content
+        self.raw_url = f"https://gist.example.com/raw/{filename}"
+
+
+class FakeGistServer:
+    """
+    In-memory stand-in for the gist api. FakeGistHubs for different logins
+    share one server so they see the same gists.
+
+    Every call is recorded in `requests` as (login, method, gist_id).
+    `fail_next` makes the next n calls raise like a flaky network would.
+    `set_rate_limit` gives a login a request budget that runs out until its
+    reset time. `latency` holds every call for that long, with the most
+    calls seen at once kept in `max_active`.
+    """
+    def __init__(self, truncate_at=None, latency=0):
+        self.gists = {}
+        self.truncate_at = truncate_at
+        self.latency = latency
+        self.requests = []
+        self.rate_limits = {}
+        self.active = 0
+        self.max_active = 0
+        self._next_id = 1
+        self._failures = []
+        self._lock = threading.Lock()
+
+    def set_rate_limit(self, login, remaining, limit=5000, reset=None):
+        if reset is None:
+            reset = time.time() + 3600
+        self.rate_limits[login] = {'remaining': remaining, 'limit': limit, 'reset': reset}
+
+    def rate_limit(self, login):
+        """(remaining, limit, reset) like the X-RateLimit headers."""
+        with self._lock:
+            rl = self.rate_limits.get(login)
+            if rl is None:
+                return 5000, 5000, time.time() + 3600
+            if time.time() >= rl['reset']:
+                rl['remaining'] = rl['limit']
+                rl['reset'] = time.time() + 3600
+            return rl['remaining'], rl['limit'], rl['reset']
+
+    def _spend(self, login):
+        remaining, _, _ = self.rate_limit(login)
+        with self._lock:
+            if remaining <= 0:
+                raise RateLimitExceededException(403, {'message': 'API rate limit exceeded'}, None)
+            if login in self.rate_limits:
+                self.rate_limits[login]['remaining'] -= 1
+
+    def fail_next(self, n=1, status=502):
+        with self._lock:
+            self._failures.extend([status] * n)
+
+    def record(self, login, method, gist_id=None):
+        with self._lock:
+            self.requests.append((login, method, gist_id))
+        self._spend(login)
+        if self.latency:
+            with self._lock:
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+            time.sleep(self.latency)
+            with self._lock:
+                self.active -= 1
+        with self._lock:
+            if self._failures:
+                status = self._failures.pop(0)
+                raise GithubException(status, {'message': 'fake failure'}, None)
+
+    def count(self, method, gist_id=None):
+        return sum(
+            1 for _, m, g in self.requests
+            if m == method and (gist_id is None or g == gist_id)
+        )
+
+    def create(self, login, public, files, description):
+        self.record(login, 'POST')
+        with self._lock:
+            gist_id = f"fake{self._next_id}"
+            self._next_id += 1
+            self.gists[gist_id] = {
+                'owner': login,
+                'public': public,
+                'description': description,
+                'files': {fn: f._identity['content'] for fn, f in files.items()},
+                'version': 1,
+                'updated_at': datetime.now(timezone.utc),
+            }
+        return FakeGist(self, login, gist_id)
+
+    def remote_edit(self, gist_id, files):
+        """Change a gist behind the clients' backs."""
+        state = self.get_state(gist_id)
+        state['files'].update(files)
+        state['version'] += 1
+        state['updated_at'] = datetime.now(timezone.utc)
+
+    def get_state(self, gist_id):
+        if gist_id not in self.gists:
+            raise UnknownObjectException(404, {'message': 'Not Found'}, None)
+        return self.gists[gist_id]
+
+
+class FakeGist:
+    """
+    Snapshot of a gist like the PyGithub Gist object.
+    """
+    def __init__(self, server, login, gist_id):
+        self.server = server
+        self.login = login
+        self.id = gist_id
+        self._load()
+
+    def _load(self):
+        state = self.server.get_state(self.id)
+        self.owner = Mock()
+        self.owner.login = state['owner']
+        self.public = state['public']
+        self.description = state['description']
+        self.files = {
+            fn: FakeGistFile(fn, content, truncate_at=self.server.truncate_at)
+            for fn, content in state['files'].items()
+        }
+        self.version = state['version']
+        self.updated_at = state['updated_at']
+        self.etag = f'W/"{self.id}-{self.version}"'
+
+    def edit(self, description=None, files=None):
+        self.server.record(self.login, 'PATCH', self.id)
+        state = self.server.get_state(self.id)
+        if state['owner'] != self.login:
+            raise GithubException(404, {'message': 'Not Found'}, None)
+        if description is not None:
+            state['description'] = description
+        for fn, f in (files or {}).items():
+            if f is None:
+                state['files'].pop(fn, None)
+            else:
+                state['files'][fn] = f._identity['content']
+        state['version'] += 1
+        state['updated_at'] = datetime.now(timezone.utc)
+        self._load()
+
+    def update(self):
+        """Conditional GET. Returns whether the gist changed."""
+        state = self.server.get_state(self.id)
+        if state['version'] == self.version:
+            self.server.record(self.login, 'GET 304', self.id)
+            return False
+        self.server.record(self.login, 'GET', self.id)
+        self._load()
+        return True
+
+    def delete(self):
+        self.server.record(self.login, 'DELETE', self.id)
+        self.server.gists.pop(self.id, None)
+
+
+class FakeGistHub:
+    """
+    Enough of github.Github for GistService.
+    """
+    def __init__(self, server, login='nbx'):
+        self.server = server
+        self.login = login
+
+    @property
+    def rate_limiting(self):
+        remaining, limit, _ = self.server.rate_limit(self.login)
+        return remaining, limit
+
+    @property
+    def rate_limiting_resettime(self):
+        return self.server.rate_limit(self.login)[2]
+
+    def get_user(self):
+        user = Mock()
+        user.login = self.login
+        user.create_gist = functools.partial(self.server.create, self.login)
+        return user
+
+    def get_gist(self, gist_id):
+        self.server.record(self.login, 'GET', gist_id)
+        return FakeGist(self.server, self.login, gist_id)
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+from nbformat.v4 import new_code_cell, new_notebook
+
+from nbx_deux.bundle_manager.bundle_nbmanager import BundleContentsManager
+from nbx_deux.bundle_manager.tests.test_bundle_nbmanager import stage_bundle_workspace
+from nbx_deux.models import NotebookModel
+from nbx_deux.testing import TempDir
+from ..async_manager import AsyncBundleContentsManager, AsyncMetaManager
+
+
+def listing_dicts(model):
+    return sorted(
+        (m.asdict() if hasattr(m, 'asdict') else m for m in model['content']),
+        key=lambda m: m['path'],
+    )
+
+
+def test_async_bundle_contents_manager():
+    with TempDir() as td:
+        stage_bundle_workspace(td)
+        for i in range(5):
+            td.joinpath(f'file{i}.txt').write_text(str(i))
+        sync_nbm = BundleContentsManager(root_dir=str(td))
+        nbm = AsyncBundleContentsManager(root_dir=str(td), listing_batch_size=2)
+
+        async def run():
+            # batched listing matches the sync one
+            listing = await nbm.get('')
+            assert listing_dicts(listing) == listing_dicts(sync_nbm.get(''))
+            assert listing['format'] == 'json'
+            assert await nbm.dir_exists('subdir')
+            assert not await nbm.dir_exists('subdir/example.ipynb')
+            assert await nbm.file_exists('subdir/example.ipynb')
+
+            nb = new_notebook(cells=[new_code_cell('1 + 1')])
+            model = NotebookModel.from_nbnode(nb, name='new.ipynb', path='new.ipynb')
+            await nbm.save(model.asdict(), 'new.ipynb')
+            got = await nbm.get('new.ipynb')
+            assert got['content'].cells[0].source == '1 + 1'
+            assert td.joinpath('new.ipynb/new.ipynb').exists()
+
+            checkpoint = await nbm.create_checkpoint('new.ipynb')
+            assert [c['id'] for c in await nbm.list_checkpoints('new.ipynb')] == [checkpoint['id']]
+
+            await nbm.rename('sup.txt', 'renamed.txt')
+            assert await nbm.exists('renamed.txt')
+            await nbm.delete('renamed.txt')
+            assert not await nbm.file_exists('renamed.txt')
+
+        asyncio.run(run())
+
+
+def test_async_meta_manager_mixed():
+    with TempDir() as td:
+        td.joinpath('one').mkdir()
+        td.joinpath('two').mkdir()
+        td.joinpath('two/b.txt').write_text('b')
+        sync_nbm = BundleContentsManager(root_dir=str(td.joinpath('two')))
+        meta = AsyncMetaManager(
+            bundle_dirs={'one': str(td.joinpath('one'))},
+            managers={'two': sync_nbm},
+        )
+        assert isinstance(meta.managers['one'], AsyncBundleContentsManager)
+
+        async def run():
+            root = await meta.get('')
+            assert {m['name'] for m in root['content']} == {'one', 'two'}
+            assert all('last_modified' in m for m in root['content'])
+
+            nb = new_notebook()
+            model = NotebookModel.from_nbnode(nb, name='a.ipynb', path='a.ipynb')
+            await meta.save(model.asdict(), 'one/a.ipynb')
+            assert (await meta.get('one/a.ipynb'))['path'] == 'one/a.ipynb'
+            assert [m['path'] for m in (await meta.get('two'))['content']] == ['two/b.txt']
+            assert await meta.file_exists('two/b.txt')
+
+            model = await meta.update({'path': 'two/c.txt'}, 'two/b.txt')
+            assert model['path'] == 'two/c.txt'
+            assert td.joinpath('two/c.txt').exists()
+
+        asyncio.run(run())
+
+
+def test_async_meta_manager_doesnt_block_loop():
+    with TempDir() as td:
+        td.joinpath('slow').mkdir()
+
+        class SlowManager(BundleContentsManager):
+            def get(self, path, content=True, type=None, format=None):
+                time.sleep(0.3)
+                return super().get(path, content=content, type=type, format=format)
+
+        meta = AsyncMetaManager(managers={'slow': SlowManager(root_dir=str(td.joinpath('slow')))})
+
+        async def run():
+            lags = []
+
+            async def heartbeat():
+                for _ in range(20):
+                    start = time.perf_counter()
+                    await asyncio.sleep(0.01)
+                    lags.append(time.perf_counter() - start - 0.01)
+
+            start = time.perf_counter()
+            await asyncio.gather(heartbeat(), *[meta.get('slow') for _ in range(4)])
+            # the four slow gets ran side by side and the loop kept ticking
+            assert time.perf_counter() - start < 1.0
+            assert max(lags) < 0.1
+
+        asyncio.run(run())
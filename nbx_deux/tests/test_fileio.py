@@ -0,0 +1,66 @@
+from unittest import mock
+
+import nbformat
+from nbformat import v4
+import pytest
+
+from nbx_deux import fileio
+from nbx_deux.testing import TempDir
+from ..fileio import ValidationCache, _read_validated_notebook, _save_notebook
+from ..models import NotebookModel
+
+
+def write_notebook(nb_file, nb):
+    with nb_file.open('w') as f:
+        nbformat.write(nb, f)
+
+
+def test_validation_policy():
+    with TempDir() as td:
+        nb_file = td.joinpath('example.ipynb')
+        write_notebook(nb_file, v4.new_notebook())
+        cache = ValidationCache()
+
+        with mock.patch.object(fileio, 'validate_nb', wraps=fileio.validate_nb) as validate_nb:
+            _read_validated_notebook(nb_file, 'on-change', cache=cache)
+            _read_validated_notebook(nb_file, 'on-change', cache=cache)
+            assert validate_nb.call_count == 1
+            assert cache.stats()['hits'] == 1
+
+            _read_validated_notebook(nb_file, 'on-save-only', cache=cache)
+            assert validate_nb.call_count == 1
+
+        # content change means a new key
+        nb = v4.new_notebook()
+        nb.cells.append(v4.new_code_cell('1 + 1'))
+        write_notebook(nb_file, nb)
+        _read_validated_notebook(nb_file, 'on-change', cache=cache)
+        assert cache.stats()['misses'] == 2
+
+        with pytest.raises(ValueError, match="Unknown validation policy"):
+            _read_validated_notebook(nb_file, 'sometimes', cache=cache)
+
+
+def test_validation_error_message():
+    with TempDir() as td:
+        nb_file = td.joinpath('example.ipynb')
+        nb = v4.new_notebook()
+        nb.cells.append(v4.new_code_cell('1 + 1'))
+        nb.cells[0]['bad_key'] = 'oops'
+        write_notebook(nb_file, nb)
+
+        for policy in ('always', 'on-change', 'on-change'):
+            model = NotebookModel.from_filepath(nb_file, root_dir=td, validation_policy=policy)
+            assert model.message.startswith('Notebook validation failed')
+
+        model = NotebookModel.from_filepath(nb_file, root_dir=td, validation_policy='on-save-only')
+        assert model.message is None
+
+
+def test_save_seeds_validation_cache():
+    with TempDir() as td:
+        nb_file = td.joinpath('example.ipynb')
+        _save_notebook(nb_file, v4.new_notebook())
+        with mock.patch.object(fileio, 'validate_nb') as validate_nb:
+            _read_validated_notebook(nb_file, 'on-change')
+            assert validate_nb.call_count == 0
@@ -1,15 +1,19 @@
 from contextlib import contextmanager
+import threading
+import time
 from tempfile import TemporaryDirectory
+from unittest import mock
 
 from github import Auth, Github
 import pytest
 
 from jupyter_server.services.contents.filemanager import FileContentsManager
+from nbformat.v4 import new_code_cell, new_notebook
 from traitlets.config import functools
 
-from nbx_deux.testing import makeFakeGist
+from nbx_deux.testing import FakeGistHub, FakeGistServer, makeFakeGist
 from nbx_deux.config import GITHUB_TOKEN
-from ..gist import model_to_files, GistService, Gister
+from ..gist import file_hash, model_to_files, GistCache, GistService, Gister
 
 
 def github_hub():
@@ -205,3 +209,255 @@ class TestGister:
         # same as previous file content
         assert not gister._is_dirty(old_desc,
                                     files={'a.ipynb': 'a.ipynb content'})
+
+
+def make_fake_service(server):
+    with mock.patch('builtins.print'):
+        return GistService(hub=FakeGistHub(server))
+
+
+def test_is_dirty_local_hashes():
+    server = FakeGistServer(truncate_at=100)
+    service = make_fake_service(server)
+    gist = service.create_gist(
+        description='desc',
+        files={'small.txt': 'small', 'big.txt': 'x' * 1000},
+    )
+    assert gist.file_hashes['small.txt'] == file_hash('small')
+    # only part of the content came back, so we don't know its hash
+    assert gist.file_hashes['big.txt'] is None
+
+    gets = server.count('GET')
+    assert not gist._is_dirty('desc', {'small.txt': 'small'})
+    assert gist._is_dirty('desc', {'small.txt': 'changed'})
+    assert gist._is_dirty('desc', {'big.txt': 'x' * 1000})
+
+    # pushing records what we sent
+    assert gist.edit('desc', files={'big.txt': 'x' * 1000}, settle=False)
+    assert not gist._is_dirty('desc', {'big.txt': 'x' * 1000})
+    assert not gist.edit('desc', files={'big.txt': 'x' * 1000}, settle=False)
+    assert server.count('GET') == gets
+
+    # deletions drop the record
+    gist.save('desc', files={'small.txt': 'small'}, settle=False)
+    assert set(gist.file_hashes) == {'small.txt'}
+    assert set(server.gists[gist.id]['files']) == {'small.txt'}
+
+
+def test_remote_changes():
+    server = FakeGistServer()
+    service = make_fake_service(server)
+    gist = service.create_gist(files={'a.txt': 'a', 'b.txt': 'b'})
+    assert gist.remote_changes() == []
+    assert server.count('GET 304', gist.id) == 1
+
+    server.remote_edit(gist.id, {'a.txt': 'edited on github'})
+    # local check doesn't notice
+    assert not gist._is_dirty(gist.description, {'a.txt': 'a'})
+    assert gist.remote_changes() == ['a.txt']
+    assert gist.has_conflict({'a.txt': 'mine'})
+    assert not gist.has_conflict({'b.txt': 'mine'})
+
+    gist.pull()
+    assert gist.remote_changes() == []
+    assert gist._is_dirty(gist.description, {'a.txt': 'a'})
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_gist_cache_ttl():
+    server = FakeGistServer()
+    clock = FakeClock()
+    service = make_fake_service(server)
+    gist_id = service.create_gist(files={'a.txt': 'a'}).id
+    service.gist_cache = GistCache(ttl=60, clock=clock)
+    gets = server.count('GET', gist_id)
+
+    gist = service.get_gist(gist_id)
+    assert service.get_gist(gist_id) is gist
+    assert server.count('GET', gist_id) == gets + 1
+
+    # stale entries are revalidated, not refetched
+    clock.now = 61
+    assert service.get_gist(gist_id) is gist
+    assert server.count('GET 304', gist_id) == 1
+    assert server.count('GET', gist_id) == gets + 1
+
+    server.remote_edit(gist_id, {'a.txt': 'edited on github'})
+    clock.now = 122
+    assert service.get_gist(gist_id).files['a.txt'].content == 'edited on github'
+    assert gist.file_hashes['a.txt'] == file_hash('edited on github')
+
+    stats = service.gist_cache.stats()
+    assert stats['revalidations'] == 2
+    assert stats['not_modified'] == 1
+    assert stats['misses'] == 1
+
+    # deleted on github
+    server.gists.pop(gist_id)
+    clock.now = 183
+    assert service.gist_cache.get(gist_id) is None
+    assert gist_id not in service.gist_cache
+
+
+def test_gist_cache_revalidates_outside_lock():
+    server = FakeGistServer()
+    clock = FakeClock()
+    service = make_fake_service(server)
+    slow_id = service.create_gist(files={'a.txt': 'a'}).id
+    fast_id = service.create_gist(files={'b.txt': 'b'}).id
+    cache = GistCache(ttl=60, clock=clock)
+    service.gist_cache = cache
+    slow = service.get_gist(slow_id)
+    clock.now = 61
+    fast = service.get_gist(fast_id)
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_refresh():
+        started.set()
+        release.wait(5)
+        return False
+
+    with mock.patch.object(slow, 'refresh', side_effect=slow_refresh):
+        thread = threading.Thread(target=cache.get, args=(slow_id,))
+        thread.start()
+        assert started.wait(5)
+        # neither another gist nor the one being revalidated waits on it
+        assert cache.get(fast_id) is fast
+        assert cache.get(slow_id) is slow
+        release.set()
+        thread.join(5)
+    assert cache.stats()['revalidations'] == 1
+
+    # a connection error leaves the entry stale for the next get to retry
+    clock.now = 200
+    with mock.patch.object(slow, 'refresh', side_effect=ConnectionError('down')):
+        with pytest.raises(ConnectionError):
+            cache.get(slow_id)
+    assert cache.get(slow_id) is slow
+    assert cache.stats()['revalidations'] == 3
+
+
+def test_gist_cache_bounds():
+    server = FakeGistServer()
+    service = make_fake_service(server)
+    cache = GistCache(max_entries=2, max_bytes=1000)
+    service.gist_cache = cache
+    gists = [service.create_gist(files={'a.txt': 'x' * 300}) for _ in range(3)]
+
+    # max_entries
+    assert len(cache) == 2
+    assert gists[0].id not in cache
+    assert cache.stats()['evictions'] == 1
+
+    # lru order
+    cache.get(gists[1].id)
+    cache.put(gists[0].id, gists[0])
+    assert set(cache._entries) == {gists[1].id, gists[0].id}
+
+    # max_bytes
+    gists[1].edit(files={'a.txt': 'x' * 800}, settle=False)
+    cache.get(gists[1].id)
+    assert set(cache._entries) == {gists[1].id}
+    assert cache.stats()['bytes'] == 800
+
+    # too big to cache at all
+    huge = service.create_gist(files={'a.txt': 'x' * 2000})
+    assert huge.id not in cache
+
+
+def make_model(name, source='1 + 1'):
+    nb = new_notebook()
+    nb.cells.append(new_code_cell(source))
+    return {'name': name, 'content': nb}
+
+
+def test_publish_many():
+    server = FakeGistServer(latency=0.02)
+    service = make_fake_service(server)
+    with mock.patch('builtins.print'):
+        someone_else = GistService(hub=FakeGistHub(server, login='someone'))
+    existing = service.create_gist(description='a.ipynb', files={'a.ipynb': 'old'})
+    other = someone_else.create_gist(files={'x.txt': 'x'})
+
+    items = [
+        (make_model('a.ipynb'), existing.id),
+        (make_model('b.ipynb'), None),
+        (make_model('c.ipynb'), None),
+        (make_model('d.ipynb'), other.id),
+    ]
+    server.max_active = 0
+    results = service.publish_many(items, max_workers=2)
+    assert [r.name for r in results] == ['a.ipynb', 'b.ipynb', 'c.ipynb', 'd.ipynb']
+    assert [r.status for r in results] == ['updated', 'created', 'created', 'skipped']
+    assert server.max_active <= 2
+    assert results[0].gist_id == existing.id
+    created = server.gists[results[1].gist_id]
+    assert created['owner'] == 'nbx'
+    assert set(created['files']) == {'b.ipynb'}
+    assert server.count('PATCH', other.id) == 0
+
+    # nothing changed, nothing sent
+    items[1] = (items[1][0], results[1].gist_id)
+    items[2] = (items[2][0], results[2].gist_id)
+    patches = server.count('PATCH')
+    results = service.publish_many(items[:3], max_workers=3)
+    assert [r.status for r in results] == ['unchanged'] * 3
+    assert server.count('PATCH') == patches
+
+    server.fail_next(1, status=500)
+    results = service.publish_many([(make_model('e.ipynb'), None)])
+    assert results[0].status == 'failed'
+    assert 'fake failure' in results[0].error
+
+
+def test_publish_many_rate_limit():
+    server = FakeGistServer()
+    service = make_fake_service(server)
+    gists = [service.create_gist(files={'empty.txt': 'x'}) for _ in range(3)]
+    items = [(make_model(f'{i}.ipynb'), gist.id) for i, gist in enumerate(gists)]
+
+    # out of requests for the next hour: held back, never sent
+    server.set_rate_limit('nbx', remaining=0)
+    requests = len(server.requests)
+    results = service.publish_many(items, max_wait=5)
+    assert [r.status for r in results] == ['rate_limited'] * 3
+    assert len(server.requests) == requests
+
+    # the reset is close, so wait for it instead of failing
+    server.set_rate_limit('nbx', remaining=1, limit=100, reset=time.time() + 0.2)
+    start = time.monotonic()
+    results = service.publish_many(items, max_wait=5)
+    assert [r.status for r in results] == ['updated'] * 3
+    assert time.monotonic() - start >= 0.15
+    assert server.count('PATCH') == 3
+
+
+def test_publish_many_request_budget():
+    server = FakeGistServer(latency=0.02)
+    service = make_fake_service(server)
+    gist = service.create_gist(files={'empty.txt': 'x'})
+
+    # same gist twice: run in order, never side by side on the shared Gister
+    items = [(make_model('a.ipynb', 'first'), gist.id), (make_model('a.ipynb', 'second'), gist.id)]
+    server.max_active = 0
+    results = service.publish_many(items, max_workers=2)
+    assert [r.status for r in results] == ['updated', 'updated']
+    assert server.max_active == 1
+    assert "second" in server.gists[gist.id]['files']['a.ipynb']
+
+    # a new gist needs more than the one request that's left. don't start it.
+    assert service.publish_requests(None) == 3
+    server.set_rate_limit('nbx', remaining=2)
+    requests = len(server.requests)
+    results = service.publish_many([(make_model('new.ipynb'), None)], max_wait=5)
+    assert results[0].status == 'rate_limited'
+    assert len(server.requests) == requests
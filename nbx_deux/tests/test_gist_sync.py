@@ -0,0 +1,163 @@
+import time
+from unittest import mock
+
+from nbformat.v4 import new_code_cell, new_notebook, writes
+from jupyter_server.services.contents.filemanager import FileContentsManager
+
+from nbx_deux import gist_hooks
+from nbx_deux.testing import FakeGistHub, FakeGistServer, TempDir
+from ..gist import GistService
+from ..gist_sync import GistSyncWorker
+
+
+def make_service(server, login='nbx'):
+    with mock.patch('builtins.print'):
+        return GistService(hub=FakeGistHub(server, login=login))
+
+
+def stage_notebook(td, gist_id, name='example.ipynb'):
+    nb = new_notebook()
+    nb.metadata['gist_id'] = gist_id
+    nb.cells.append(new_code_cell('1 + 1'))
+    nb_file = td.joinpath(name)
+    nb_file.write_text(writes(nb))
+    return nb_file
+
+
+def test_gist_sync_coalesces():
+    server = FakeGistServer()
+    service = make_service(server)
+    gist = service.create_gist(files={'empty.txt': 'empty'})
+
+    with TempDir() as td:
+        nb_file = stage_notebook(td, gist.id)
+        worker = GistSyncWorker(service, debounce=60)
+        for _ in range(5):
+            assert worker.submit(gist.id, nb_file)
+        assert worker.stats()['pending'] == 1
+        assert worker.stats()['coalesced'] == 4
+
+        assert worker.flush(timeout=5)
+        assert server.count('PATCH', gist.id) == 1
+        assert set(server.gists[gist.id]['files']) == {'example.ipynb'}
+        assert server.gists[gist.id]['description'] == 'example.ipynb'
+
+        state = worker.state(gist.id)
+        assert state.status == 'synced'
+        assert state.pushes == 1
+        assert state.submitted == 5
+
+        # same content again doesn't send an edit
+        worker.submit(gist.id, nb_file)
+        assert worker.flush(timeout=5)
+        assert worker.state(gist.id).status == 'unchanged'
+        assert server.count('PATCH', gist.id) == 1
+        worker.shutdown()
+
+
+def test_gist_sync_drains_at_exit():
+    server = FakeGistServer()
+    service = make_service(server)
+    gist = service.create_gist()
+
+    with TempDir() as td, mock.patch('nbx_deux.gist_sync.atexit.register') as register:
+        nb_file = stage_notebook(td, gist.id)
+        worker = GistSyncWorker(service, debounce=60, exit_timeout=5)
+        worker.submit(gist.id, nb_file)
+        register.assert_called_once_with(worker.shutdown, timeout=5)
+
+        # the exit hook pushes the save still waiting out its debounce
+        func, *args = register.call_args.args
+        func(*args, **register.call_args.kwargs)
+        assert server.count('PATCH', gist.id) == 1
+        assert worker.state(gist.id).status == 'synced'
+
+
+def test_gist_sync_debounce():
+    server = FakeGistServer()
+    service = make_service(server)
+    gist = service.create_gist()
+
+    with TempDir() as td:
+        nb_file = stage_notebook(td, gist.id)
+        worker = GistSyncWorker(service, debounce=0.05)
+        worker.submit(gist.id, nb_file)
+        assert worker.state(gist.id).status == 'pending'
+
+        deadline = time.monotonic() + 5
+        while worker.state(gist.id).status != 'synced' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert worker.state(gist.id).status == 'synced'
+        worker.shutdown()
+
+
+def test_gist_sync_retries():
+    server = FakeGistServer()
+    service = make_service(server)
+    gist = service.create_gist()
+
+    with TempDir() as td:
+        nb_file = stage_notebook(td, gist.id)
+        worker = GistSyncWorker(service, debounce=0, backoff=0.01, max_retries=3)
+        server.fail_next(2)
+        worker.submit(gist.id, nb_file)
+        assert worker.flush(timeout=5)
+
+        state = worker.state(gist.id)
+        assert state.status == 'synced'
+        assert state.attempts == 3
+        assert state.last_error is None
+        assert worker.stats()['retries'] == 2
+
+        # give up after max_retries
+        server.fail_next(10)
+        nb_file.write_text(writes(new_notebook()))
+        worker.max_retries = 1
+        worker.submit(gist.id, nb_file)
+        assert worker.flush(timeout=5)
+        state = worker.state(gist.id)
+        assert state.status == 'failed'
+        assert 'fake failure' in state.last_error
+        worker.shutdown()
+
+
+def test_gist_sync_bounded_and_owner():
+    server = FakeGistServer()
+    service = make_service(server)
+    someone_else = make_service(server, login='someone')
+    gist = service.create_gist()
+    other_gist = someone_else.create_gist()
+
+    with TempDir() as td:
+        nb_file = stage_notebook(td, gist.id)
+        worker = GistSyncWorker(service, debounce=60, max_pending=1)
+        assert worker.submit(other_gist.id, nb_file)
+        assert not worker.submit(gist.id, nb_file)
+        assert worker.state(gist.id).status == 'dropped'
+
+        assert worker.flush(timeout=5)
+        # not our gist, nothing pushed
+        assert worker.state(other_gist.id).status == 'skipped'
+        assert server.count('PATCH') == 0
+        worker.shutdown()
+
+
+def test_gist_post_save_hook_queues():
+    server = FakeGistServer()
+    service = make_service(server)
+    gist = service.create_gist()
+
+    with TempDir() as td:
+        nb_file = stage_notebook(td, gist.id)
+        worker = GistSyncWorker(service, debounce=60)
+        fm = FileContentsManager(root_dir=str(td))
+        model = fm.get('example.ipynb', content=False)
+        with mock.patch.object(gist_hooks, 'sync_worker', worker):
+            gist_hooks.gist_post_save_notebook(model, str(nb_file), fm)
+
+        # nothing happened inside the hook
+        assert server.count('PATCH') == 0
+        assert worker.state(gist.id).status == 'pending'
+        assert worker.flush(timeout=5)
+        assert server.count('PATCH', gist.id) == 1
+        worker.shutdown()
@@ -0,0 +1,89 @@
+import base64
+import json
+
+import nbformat
+from nbformat import v3, v4
+import pytest
+
+from nbx_deux.testing import TempDir
+from ..lazy_notebook import LazyNotebook, LazyNotebookError, read_notebook_metadata
+
+
+def make_notebook():
+    nb = v4.new_notebook()
+    nb['metadata']['gist_id'] = 'abc'
+    nb['metadata']['kernelspec'] = {'name': 'python3', 'display_name': 'Python 3'}
+    nb['metadata']['tricky'] = 'brackets ] } [ { and "quotes" \\ here'
+    png = base64.b64encode(b'\x89PNG' * 1000).decode('ascii')
+    nb.cells.append(v4.new_markdown_cell('# title\nsome text ]]'))
+    nb.cells.append(v4.new_code_cell(
+        'x = "{"\nprint(x)',
+        outputs=[
+            v4.new_output('stream', name='stdout', text='{\n[\n'),
+            v4.new_output('display_data', data={'image/png': png, 'text/plain': 'fig'}),
+        ],
+        execution_count=1,
+    ))
+    nb.cells.append(v4.new_raw_cell('unicode ☃ λ'))
+    return nb
+
+
+def test_lazy_notebook():
+    nb = make_notebook()
+    data = nbformat.writes(nb).encode('utf-8')
+    lazy = LazyNotebook(data)
+
+    full = nbformat.reads(data.decode('utf-8'), as_version=4)
+    assert lazy.nbformat == 4
+    assert lazy.nbformat_minor == full.nbformat_minor
+    assert lazy.metadata == full.metadata
+    assert lazy.cell_count == 3
+
+    for i, cell in enumerate(full.cells):
+        lazy_cell = lazy.cell(i)
+        assert lazy_cell.id == cell.id
+        assert lazy_cell.cell_type == cell.cell_type
+        assert lazy_cell.source == cell.source
+        assert lazy_cell.materialize() == cell
+
+    assert lazy.materialize() == full
+
+
+def test_lazy_notebook_skips_outputs():
+    nb = make_notebook()
+    lazy = LazyNotebook(nbformat.writes(nb))
+    cell = lazy.cell(1)
+    assert cell.source == 'x = "{"\nprint(x)'
+    # outputs were only located, never decoded
+    assert 'outputs' in cell
+    assert 'outputs' not in cell._fields
+
+
+def test_lazy_notebook_compact_json():
+    nb = make_notebook()
+    data = json.dumps(nb, separators=(',', ':'))
+    lazy = LazyNotebook(data)
+    assert lazy.metadata == nb.metadata
+    assert [c.id for c in lazy.iter_cells()] == [c.id for c in nb.cells]
+
+
+def test_read_notebook_metadata():
+    with TempDir() as td:
+        nb_file = td.joinpath('example.ipynb')
+        nb = make_notebook()
+        with nb_file.open('w') as f:
+            nbformat.write(nb, f)
+        metadata = read_notebook_metadata(nb_file)
+        assert metadata['gist_id'] == 'abc'
+        assert metadata.kernelspec.name == 'python3'
+
+        # v3 notebooks still expose metadata, but not lazy cells
+        v3_file = td.joinpath('old.ipynb')
+        old_nb = v3.new_notebook(metadata=v3.new_metadata(name='old'))
+        old_nb.metadata['gist_id'] = 'old_gist'
+        with v3_file.open('w') as f:
+            f.write(v3.writes_json(old_nb))
+        lazy = LazyNotebook.from_path(v3_file)
+        assert lazy.metadata['gist_id'] == 'old_gist'
+        with pytest.raises(LazyNotebookError):
+            lazy.cell_count
@@ -0,0 +1,118 @@
+import os
+from unittest import mock
+
+from nbformat import v4
+from jupyter_server.services.contents.filemanager import FileContentsManager
+
+from nbx_deux.testing import TempDir
+from nbx_deux import listing
+from ..listing import ListingCache, filter_entries, scan_dir
+from ..models import DirectoryModel
+
+
+def stage_listing(td):
+    td.joinpath('subdir').mkdir()
+    td.joinpath('.hidden').mkdir()
+    with td.joinpath('sup.txt').open('w') as f:
+        f.write('sups')
+    with td.joinpath('example.ipynb').open('w') as f:
+        f.write(v4.writes(v4.new_notebook()))
+    with td.joinpath('skip.pyc').open('w') as f:
+        f.write('')
+
+
+def test_scan_dir():
+    with TempDir() as td:
+        stage_listing(td)
+        entries = {e.name: e for e in scan_dir(td)}
+        assert set(entries) == {'subdir', '.hidden', 'sup.txt', 'example.ipynb', 'skip.pyc'}
+        assert entries['subdir'].is_dir
+        assert not entries['sup.txt'].is_dir
+        assert entries['sup.txt'].stat.st_size == 4
+
+        visible = {e.name for e in filter_entries(entries.values())}
+        assert visible == {'subdir', 'sup.txt', 'example.ipynb'}
+
+        visible = {e.name for e in filter_entries(entries.values(), allow_hidden=True)}
+        assert visible == {'subdir', '.hidden', 'sup.txt', 'example.ipynb'}
+
+
+def test_listing_cache():
+    with TempDir() as td:
+        stage_listing(td)
+        cache = ListingCache(maxsize=2)
+
+        # racy window makes freshly created dirs uncacheable
+        entries = cache.get_entries(td)
+        assert len(cache) == 0
+
+        with mock.patch.object(listing, 'RACY_WINDOW_NS', 0):
+            entries = cache.get_entries(td)
+            assert len(cache) == 1
+            assert cache.get_entries(td) is entries
+            assert cache.stats()['hits'] == 1
+
+            # new entry bumps dir mtime and forces a rescan
+            with td.joinpath('new.txt').open('w') as f:
+                f.write('new')
+            st = os.stat(td)
+            os.utime(td, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+            new_entries = cache.get_entries(td)
+            assert new_entries is not entries
+            assert 'new.txt' in {e.name for e in new_entries}
+
+            cache.invalidate(td)
+            assert len(cache) == 0
+
+            cache.get_entries(td)
+            cache.get_entries(td.joinpath('subdir'))
+            cache.get_entries(td.joinpath('.hidden'))
+            assert len(cache) == 2
+
+
+def test_watched_listing_cache():
+    with TempDir() as td:
+        stage_listing(td)
+        td.joinpath('subdir/inner').mkdir()
+        cache = ListingCache(watched=True)
+
+        # no stat to revalidate, so racy dirs are cached too
+        entries = cache.get_entries(td)
+        cache.get_entries(td.joinpath('subdir'))
+        cache.get_entries(td.joinpath('subdir/inner'))
+        assert len(cache) == 3
+
+        with mock.patch.object(os, 'stat', side_effect=AssertionError):
+            assert cache.get_entries(td) is entries
+
+        cache.invalidate_tree(td.joinpath('subdir'))
+        assert len(cache) == 1
+
+        # a scan that raced an invalidate isn't kept
+        real_scan = listing.scan_dir
+
+        def scan_and_invalidate(os_dir):
+            result = real_scan(os_dir)
+            cache.invalidate(os_dir)
+            return result
+
+        with mock.patch.object(listing, 'scan_dir', scan_and_invalidate):
+            cache.get_entries(td.joinpath('subdir'))
+        assert len(cache) == 1
+
+
+def test_directory_model_listing_cache():
+    with TempDir() as td:
+        stage_listing(td)
+        fcm = FileContentsManager(root_dir=str(td))
+        fcm_model = fcm.get("")
+        fcm_content = sorted(fcm_model['content'], key=lambda m: m['name'])
+
+        cache = ListingCache()
+        with mock.patch.object(listing, 'RACY_WINDOW_NS', 0):
+            for _ in range(2):
+                model = DirectoryModel.from_filepath(td, root_dir=td, listing_cache=cache)
+                content = model.asdict()['content']
+                content = sorted(content, key=lambda m: m['name'])
+                assert content == fcm_content
+        assert cache.stats()['hits'] == 1
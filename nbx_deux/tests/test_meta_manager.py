@@ -0,0 +1,197 @@
+import dataclasses as dc
+import threading
+import time
+from unittest import mock
+
+import pytest
+from nbformat.v4 import new_notebook
+
+from nbx_deux.models import NotebookModel
+from nbx_deux.testing import TempDir
+from ..meta_manager import AliasRouter, ManagerMeta, MetaManager
+
+
+def test_alias_router():
+    router = AliasRouter(['home', 'team', 'team/projects', 'org/data/raw'])
+
+    def route(path):
+        meta = router.resolve(path)
+        return meta.nbm_path, meta.path
+
+    assert route('') == ('', '')
+    assert route('/home/') == ('home', '')
+    assert route('home/a/b.ipynb') == ('home', 'a/b.ipynb')
+    assert route('team/notes.ipynb') == ('team', 'notes.ipynb')
+    # longest prefix wins
+    assert route('team/projects') == ('team/projects', '')
+    assert route('team/projects/x/y.ipynb') == ('team/projects', 'x/y.ipynb')
+    # prefixes of aliases are virtual dirs on the root manager
+    assert route('org') == ('', 'org')
+    assert route('org/data') == ('', 'org/data')
+    assert route('org/data/raw/z') == ('org/data/raw', 'z')
+    assert router.children('') == ['home', 'team', 'org']
+    assert router.children('org/data') == ['raw']
+
+    for path in ['nope', 'org/other', 'org/data/cooked/z']:
+        with pytest.raises(Exception, match="Could not find"):
+            router.resolve(path)
+
+    meta = router.resolve('home/a')
+    with pytest.raises(dc.FrozenInstanceError):
+        meta.path = 'b'  # type: ignore
+    assert not hasattr(meta, '__dict__')
+    assert meta == ManagerMeta(request_path='home/a', nbm_path='home', path='a')
+
+    with pytest.raises(Exception, match="Invalid manager alias"):
+        AliasRouter(['a//b'])
+
+
+def test_meta_manager_nested_aliases():
+    with TempDir() as td:
+        td.joinpath('home').mkdir()
+        td.joinpath('projects').mkdir()
+        meta = MetaManager(bundle_dirs={
+            'home': str(td.joinpath('home')),
+            'team/projects': str(td.joinpath('projects')),
+        })
+
+        listing = meta.get('')
+        assert [m['path'] for m in listing['content']] == ['home', 'team']
+        listing = meta.get('team')
+        assert [m['path'] for m in listing['content']] == ['team/projects']
+
+        nb = new_notebook()
+        model = NotebookModel.from_nbnode(nb, name='a.ipynb', path='a.ipynb')
+        meta.save(model.asdict(), 'team/projects/a.ipynb')
+        assert td.joinpath('projects/a.ipynb/a.ipynb').exists()
+        assert meta.get('team/projects/a.ipynb')['path'] == 'team/projects/a.ipynb'
+        listing = meta.get('team/projects')
+        assert [m['path'] for m in listing['content']] == ['team/projects/a.ipynb']
+
+        # resolutions are cached and shared
+        nbm, first = meta.get_nbm_from_path('team/projects/a.ipynb')
+        nbm2, second = meta.get_nbm_from_path('team/projects/a.ipynb')
+        assert nbm is nbm2 is meta.managers['team/projects']
+        assert first is second
+
+
+def test_root_listing_metadata():
+    with TempDir() as td:
+        for name in ['home', 'projects', 'slow']:
+            td.joinpath(name).mkdir()
+        meta = MetaManager(
+            bundle_dirs={
+                'home': str(td.joinpath('home')),
+                'team/projects': str(td.joinpath('projects')),
+                'slow': str(td.joinpath('slow')),
+            },
+            root_listing_timeout=0.1,
+            root_listing_ttl=60,
+        )
+        slow = meta.managers['slow']
+        real_get = slow.get
+        release = threading.Event()
+        calls = []
+
+        def slow_get(path, **kwargs):
+            calls.append(path)
+            release.wait(5)
+            return real_get(path, **kwargs)
+
+        with mock.patch.object(slow, 'get', slow_get):
+            start = time.monotonic()
+            content = {m['name']: m for m in meta.get('')['content']}
+            assert time.monotonic() - start < 2
+
+            home = meta.managers['home'].get('', content=False)
+            assert content['home']['last_modified'] == home['last_modified']
+            assert content['home']['writable'] is True
+            # virtual dirs summarize the aliases below them
+            projects = meta.managers['team/projects'].get('', content=False)
+            assert content['team']['last_modified'] == projects['last_modified']
+            assert content['team']['path'] == 'team'
+            # timed out with nothing cached: listed bare
+            assert content['slow'] == {
+                'name': 'slow', 'path': 'slow', 'type': 'directory', 'format': 'json',
+            }
+
+            # still the one fetch going
+            meta.get('')
+            assert calls == ['']
+
+            release.set()
+            if future := meta.root._fetching.get('slow'):
+                future.result(5)
+            content = {m['name']: m for m in meta.get('')['content']}
+            assert 'last_modified' in content['slow']
+            assert calls == ['']
+
+        # cached for listing_ttl
+        with mock.patch.object(meta.managers['home'], 'get', side_effect=AssertionError):
+            meta.get('')
+        # expired models are still better than nothing when the alias fails
+        meta.root.listing_ttl = 0
+        with mock.patch.object(meta.managers['home'], 'get', side_effect=OSError):
+            content = {m['name']: m for m in meta.get('')['content']}
+            assert content['home']['last_modified'] == home['last_modified']
+
+            meta.root.invalidate_summaries('home')
+            content = {m['name']: m for m in meta.get('')['content']}
+            assert 'last_modified' not in content['home']
+
+
+def test_root_listing_queued_fetch_cancelled():
+    with TempDir() as td:
+        for name in ['a_slow', 'b']:
+            td.joinpath(name).mkdir()
+        meta = MetaManager(
+            bundle_dirs={name: str(td.joinpath(name)) for name in ['a_slow', 'b']},
+            root_listing_timeout=0.1,
+        )
+        meta.root.listing_workers = 1
+        slow = meta.managers['a_slow']
+        real_get = slow.get
+        release = threading.Event()
+
+        def slow_get(path, **kwargs):
+            release.wait(5)
+            return real_get(path, **kwargs)
+
+        with mock.patch.object(slow, 'get', slow_get):
+            start = time.monotonic()
+            meta.get('')
+            # the deadline covers the listing, not each alias in turn
+            assert time.monotonic() - start < 1
+            # b was queued behind a_slow on the one worker and dropped
+            assert set(meta.root._fetching) == {'a_slow'}
+
+            future = meta.root._fetching['a_slow']
+            release.set()
+            future.result(5)
+            content = {m['name']: m for m in meta.get('')['content']}
+            assert 'last_modified' in content['a_slow']
+            assert 'last_modified' in content['b']
+
+
+def test_meta_manager_get_anchors_paths():
+    with TempDir() as td:
+        td.joinpath('projects/sub').mkdir(parents=True)
+        td.joinpath('projects/sub/a.txt').write_text('a')
+        meta = MetaManager(bundle_dirs={'team/projects': str(td.joinpath('projects'))})
+        nbm = meta.managers['team/projects']
+
+        nb = new_notebook()
+        model = NotebookModel.from_nbnode(nb, name='a.ipynb', path='sub/a.ipynb')
+        with mock.patch.object(nbm, 'get', return_value=model):
+            got = meta.get('team/projects/sub/a.ipynb')
+        # nothing below the top level is copied
+        assert got['content'] is nb
+        assert got['path'] == 'team/projects/sub/a.ipynb'
+        assert model.path == 'sub/a.ipynb'
+        assert 'message' not in got
+
+        listing = meta.get('team/projects/sub')
+        assert listing['path'] == 'team/projects/sub'
+        assert [m['path'] for m in listing['content']] == ['team/projects/sub/a.txt']
+        assert meta.get('team/projects/sub/a.txt')['path'] == 'team/projects/sub/a.txt'
+        assert meta.get('team/projects')['path'] == 'team/projects'
@@ -12,6 +12,7 @@ from ..models import (
     FileModel,
     NotebookModel,
     DirectoryModel,
+    model_to_dict,
 )
 
 
@@ -115,3 +116,26 @@ def test_notebook_model():
         name='name', path='path', last_modified=datetime.now(), created=datetime.now(), content=1
     )
     assert model.format == 'json'
+
+
+def test_model_to_dict_share():
+    nb = v4.new_notebook()
+    nb.cells.append(v4.new_code_cell('1 + 1'))
+    model = NotebookModel.from_nbnode(nb, name='hi.ipynb', path='hi.ipynb')
+
+    dct = model_to_dict(model)
+    assert dct['content'] == nb
+    assert dct['content'] is not nb
+    assert dct['content']['cells'][0] is not nb['cells'][0]
+
+    shared = model_to_dict(model, share=True)
+    assert shared == dct
+    assert shared['content'] is nb
+    assert model.asdict(share=True)['content'] is nb
+
+    # containers are still fresh so paths can be rewritten
+    directory = DirectoryModel.transient('dir', content=[model])
+    shared = directory.asdict(share=True)
+    shared['content'][0]['path'] = 'dir/hi.ipynb'
+    assert model.path == 'hi.ipynb'
+    assert shared['content'][0]['content'] is nb
@@ -0,0 +1,181 @@
+import base64
+import copy
+import json
+from unittest import mock
+
+import nbformat
+from nbformat import sign, v3, v4
+import pytest
+
+from nbx_deux.testing import TempDir
+from .. import fileio
+from ..trust_cache import TrustCache
+from ..nbjson import (
+    JSONBackend,
+    available_backends,
+    get_backend,
+    reindent,
+    to_disk_notebook,
+)
+
+BACKENDS = available_backends()
+
+
+def make_notebook():
+    nb = v4.new_notebook()
+    nb.metadata['kernelspec'] = {'name': 'python3', 'display_name': 'Python 3'}
+    nb.metadata['orig_nbformat'] = 3
+    nb.metadata['nested'] = {'a': [1, 2.5, {'b': [], 'c': {}}], 'd': None, 'e': True}
+    png = base64.b64encode(b'\x89PNG' * 100).decode('ascii')
+    nb.cells.append(v4.new_markdown_cell(
+        'unicode ☃ λ 😀\ttab "quotes" \\ back\nline\r\nwindows\n',
+        attachments={'a.svg': {'image/svg+xml': '<svg>\n</svg>', 'image/png': png}},
+    ))
+    cell = v4.new_code_cell(
+        'x = 1\nprint(x)',
+        outputs=[
+            v4.new_output('stream', name='stdout', text='1\n2\n'),
+            v4.new_output('display_data', data={
+                'image/png': png,
+                'text/plain': 'fig\nure',
+                'application/json': {'k': [1, 2]},
+                'application/javascript': 'var x;\nx = 1;',
+            }),
+            v4.new_output('execute_result', data={'text/html': '<b>\n</b>'}, execution_count=1),
+            v4.new_output('error', ename='E', evalue='v', traceback=['a', 'b']),
+        ],
+        execution_count=1,
+    )
+    cell.metadata['trusted'] = True
+    nb.cells.append(cell)
+    nb.cells.append(v4.new_raw_cell(''))
+    return nb
+
+
+def expected_bytes(nb):
+    s = nbformat.writes(nb, version=nbformat.NO_CONVERT)
+    if not s.endswith('\n'):
+        s += '\n'
+    return s.encode('utf-8')
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_writes_matches_nbformat(name):
+    backend = get_backend(name)
+    nb = make_notebook()
+    before = copy.deepcopy(nb)
+    assert backend.writes_notebook(nb) == expected_bytes(nb)
+    # in-memory notebook is left alone
+    assert nb == before
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+@pytest.mark.parametrize('value', [
+    1e-7,
+    1e16,
+    float('nan'),
+    float('inf'),
+    2 ** 70,
+    '\ud800',
+    b'bytes',
+])
+def test_writes_fallback_values(name, value):
+    backend = get_backend(name)
+    nb = make_notebook()
+    nb.metadata['odd'] = value
+    try:
+        expected = expected_bytes(nb)
+    except UnicodeEncodeError:
+        with pytest.raises(UnicodeEncodeError):
+            backend.writes_notebook(nb)
+        return
+    assert backend.writes_notebook(nb) == expected
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_writes_non_str_keys(name):
+    nb = make_notebook()
+    nb.metadata['odd'] = {1: 'one'}
+    assert get_backend(name).writes_notebook(nb) == expected_bytes(nb)
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_writes_v3(name):
+    nb = v3.new_notebook(metadata=v3.new_metadata(name='old'))
+    assert get_backend(name).writes_notebook(nb) == expected_bytes(nb)
+
+
+@pytest.mark.parametrize('name', BACKENDS)
+def test_reads_matches_nbformat(name):
+    backend = get_backend(name)
+    data = expected_bytes(make_notebook())
+    expected = nbformat.reads(data.decode('utf-8'), as_version=nbformat.NO_CONVERT)
+    nb = backend.reads_notebook(data)
+    assert nb == expected
+    assert isinstance(nb.cells[1].outputs[0], nbformat.NotebookNode)
+
+    # round trip
+    assert backend.writes_notebook(nb) == data
+
+    # NaN is accepted by stdlib json
+    nan_data = data.replace(b'"e": true', b'"e": NaN')
+    assert backend.reads_notebook(nan_data).metadata.nested.e != 0
+
+    with pytest.raises(nbformat.reader.NotJSONError):
+        backend.reads_notebook(b'{not json')
+
+
+def test_to_disk_notebook():
+    nb = make_notebook()
+    disk = to_disk_notebook(nb)
+    assert 'orig_nbformat' not in disk['metadata']
+    assert 'trusted' not in disk['cells'][1]['metadata']
+    assert disk['cells'][0]['source'] == nb.cells[0].source.splitlines(True)
+    # large payloads are shared, not copied
+    png = nb.cells[1].outputs[1].data['image/png']
+    assert disk['cells'][1]['outputs'][1]['data']['image/png'] is png
+
+
+def test_reindent():
+    obj = {'a': [1, {'b': [[{}], []]}], 'c': {'d': 'x\n  y'}}
+    two = json.dumps(obj, indent=2).encode()
+    one = json.dumps(obj, indent=1).encode()
+    assert reindent(two) == one
+
+
+def test_save_notebook_matches_nbformat():
+    with TempDir() as td:
+        nb_file = td.joinpath('example.ipynb')
+        nb = make_notebook()
+        digest = fileio._save_notebook(nb_file, nb)
+        data = nb_file.read_bytes()
+        assert data == expected_bytes(nb)
+        assert digest == fileio.content_digest(data)
+
+        read_nb, read_digest = fileio._read_notebook(nb_file, with_digest=True)
+        assert read_digest == digest
+        assert read_nb == nbformat.read(nb_file, as_version=4)
+
+
+def test_save_notebook_seeds_trust():
+    # keep signatures out of the real notary db
+    notary = sign.NotebookNotary(db_file=':memory:', secret=b'nbx secret')
+    trust_cache = TrustCache(notary)
+    patch_notary = mock.patch.object(fileio, 'CM_NOTARY', notary)
+    patch_cache = mock.patch.object(fileio, 'TRUST_CACHE', trust_cache)
+    with TempDir() as td, patch_notary, patch_cache:
+        nb_file = td.joinpath('example.ipynb')
+        nb = make_notebook()
+        notary.mark_cells(nb, True)
+        signature = fileio.check_and_sign(nb)
+        assert signature is not None
+        digest = fileio._save_notebook(nb_file, nb, signature=signature)
+        hits = trust_cache.hits
+        assert trust_cache.check_signature(nb, digest=digest) is True
+        assert trust_cache.hits == hits + 1
+
+
+def test_stdlib_backend():
+    assert isinstance(get_backend('json'), JSONBackend)
+    with pytest.raises(Exception, match='not available'):
+        get_backend('simdjson')
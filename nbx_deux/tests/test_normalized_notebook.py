@@ -1,7 +1,10 @@
-from nbx_deux.nbx_convert import NBXCellExport
+from nbx_deux.nbx_convert import NBXCellExport, NBXCellScriptCellReader
 
-from nbx_deux.normalized_notebook import NBXNotebookExport, nbxpy_to_cells
+from nbx_deux.normalized_notebook import NBXNotebookExport, PyCellCache, merge_nbxpy, nbxpy_to_cells
+from nbx_deux.trust_cache import chunks_digest, content_digest
 from textwrap import dedent
+import copy
+import io
 from nbformat import v4 as current
 
 cython_source = dedent("""
@@ -56,5 +59,137 @@ def test_nbxpy_to_cell():
     assert new_nnpy.to_pyfile() == export_text
 
 
+def test_merge_nbxpy():
+    cells = [
+        current.new_code_cell(id='a', source='x = 1', outputs=[
+            current.new_output('stream', name='stdout', text='1'),
+        ]),
+        current.new_markdown_cell(id='b', source='# Title'),
+        current.new_code_cell(id='c', source=cython_source),
+        current.new_code_cell(id='d', source='def f():\n    return 1\n\n'),
+    ]
+    nb = current.new_notebook(cells=cells)
+    export_text = NBXNotebookExport(nb).to_pyfile()
+
+    # lossy bits of the export don't count as edits
+    assert not merge_nbxpy(nb, export_text)
+    assert nb.cells == cells
+
+    edited = export_text.replace('x = 1', 'x = 2')
+    assert merge_nbxpy(nb, edited)
+    assert nb.cells[0].source == 'x = 2'
+    # outputs are kept
+    assert nb.cells[0].outputs[0].text == '1'
+    assert nb.cells[2].source == cython_source
+
+    # drop b, add e at the front, edit the cython cell
+    chunks = edited.split('\n\n# %% ')
+    chunks = [chunks[0]] + ['# %% ' + chunk for chunk in chunks[1:]]
+    new_cell = '# %% id="e"\ny = 3'
+    cython_chunk = chunks[2].replace('self.age = age', 'self.age = age + 1')
+    text = '\n\n'.join([new_cell, chunks[0], cython_chunk, chunks[3]])
+    assert merge_nbxpy(nb, text)
+    assert [cell.id for cell in nb.cells] == ['e', 'a', 'c', 'd']
+    assert nb.cells[0].source == 'y = 3'
+    assert nb.cells[0].outputs == []
+    assert nb.cells[2].source.startswith('%%cython\n')
+    assert nb.cells[2].source.endswith('self.age = age + 1')
+
+
+def test_nbxpy_to_cells_matches_sliced_reader():
+    sources = [
+        ('markdown', '# Title\n\n```mermaid\n%% not a cell\n```'),
+        ('code', 'import os'),
+        ('markdown', 'just notes'),
+        ('markdown', 'more notes'),
+        ('code', 'def f():\n    return 1'),
+        ('code', 'class A:\n    pass\n\n\n'),
+        ('code', 's = """\n# %% inside a string\n"""'),
+        ('raw', 'raw'),
+        ('code', ''),
+        ('code', '%%time\nx = 1'),
+    ]
+    new_cell = {
+        'code': current.new_code_cell,
+        'markdown': current.new_markdown_cell,
+        'raw': current.new_raw_cell,
+    }
+    cells = [new_cell[t](source, id=f'cell{i}') for i, (t, source) in enumerate(sources)]
+    export_text = NBXNotebookExport(current.new_notebook(cells=cells)).to_pyfile()
+
+    # what nbxpy_to_cells did before windows: hand the reader a copy of the rest
+    reader = NBXCellScriptCellReader({})
+    lines = export_text.split('\n')
+    expected = []
+    offset = 0
+    while offset < len(lines):
+        cell, pos_next_cell = reader.read(lines[offset:])
+        expected.append(cell)
+        offset += pos_next_cell
+
+    assert nbxpy_to_cells(export_text) == expected
+    assert [cell.id for cell in expected] == [cell.id for cell in cells]
+
+
+def test_components_share_outputs():
+    output = current.new_output('display_data', data={'image/png': 'abc' * 1000})
+    cell = current.new_code_cell(id='plot', source='plot()', outputs=[output])
+    cell.metadata['tags'] = ['figure']
+    md_cell = current.new_markdown_cell(id='notes', source='# Notes')
+    nb = current.new_notebook(cells=[cell, md_cell])
+    before = copy.deepcopy(nb)
+
+    export = NBXNotebookExport(nb)
+    components = export.components
+    skeleton = components['skeleton']
+    assert skeleton['cells'][0] == {
+        'id': 'plot',
+        'cell_type': 'code',
+        'execution_count': None,
+        'metadata': {'tags': ['figure']},
+        'outputs': [{'output_type': 'display_data'}],
+    }
+    assert 'source' not in skeleton['cells'][1]
+    assert 'outputs' not in skeleton['cells'][1]
+    assert skeleton['metadata'] is nb['metadata']
+    assert components['all_outputs']['plot'] is cell['outputs']
+    assert list(components['source_cells']) == ['plot', 'notes']
+
+    export.to_pyfile()
+    assert nb == before
+
+
+def test_pyfile_cell_cache():
+    cells = [current.new_code_cell(id=f'c{i}', source=f'x = {i}') for i in range(5)]
+    cells.append(current.new_code_cell(id='cython_cell', source=cython_source))
+    nb = current.new_notebook(cells=cells)
+    expected = NBXNotebookExport(nb, cache=None).to_pyfile()
+
+    cache = PyCellCache()
+    assert NBXNotebookExport(nb, cache=cache).to_pyfile() == expected
+    assert cache.stats() == {'hits': 0, 'misses': 6, 'size': 6}
+    assert NBXNotebookExport(nb, cache=cache).to_pyfile() == expected
+    assert cache.hits == 6
+
+    # only the edited cell is rendered again
+    nb.cells[2].source = 'x = 20'
+    nb.cells[3].metadata['tags'] = ['slow']
+    text = NBXNotebookExport(nb, cache=cache).to_pyfile()
+    assert text == NBXNotebookExport(nb, cache=None).to_pyfile()
+    assert 'x = 20' in text
+    assert cache.stats() == {'hits': 10, 'misses': 8, 'size': 8}
+
+    f = io.StringIO()
+    NBXNotebookExport(nb, cache=cache).write_pyfile(f)
+    assert f.getvalue() == text
+
+    chunks = [chunk.encode('utf-8') for chunk in NBXNotebookExport(nb, cache=cache).iter_pychunks()]
+    assert chunks_digest(chunks) == content_digest(text.encode('utf-8'))
+
+    cache = PyCellCache(maxsize=2)
+    NBXNotebookExport(nb, cache=cache).to_pyfile()
+    assert cache.stats()['size'] == 2
+
+
 if __name__ == '__main__':
     ...
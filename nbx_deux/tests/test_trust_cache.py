@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import nbformat
+from nbformat import sign, v4
+
+from nbx_deux.testing import TempDir
+from ..models import NotebookModel
+from ..trust_cache import SharedSignatureStore, TrustCache, content_digest, share_notary_store
+
+
+def make_notary():
+    return sign.NotebookNotary(db_file=':memory:', secret=b'nbx secret')
+
+
+def make_notebook():
+    nb = v4.new_notebook()
+    cell = v4.new_code_cell('1 + 1', outputs=[
+        v4.new_output('display_data', data={'text/html': '<b>hi</b>'}),
+    ])
+    nb.cells.append(cell)
+    return nb
+
+
+def test_trust_cache():
+    notary = make_notary()
+    cache = TrustCache(notary)
+    nb = make_notebook()
+    digest = content_digest(nbformat.writes(nb).encode('utf-8'))
+
+    assert cache.check_signature(nb) is False
+    assert cache.stats()['db_checks'] == 1
+
+    # html output in an untrusted cell means no signing
+    assert cache.check_and_sign(nb) is None
+
+    notary.mark_cells(nb, True)
+    signature = cache.check_and_sign(nb)
+    assert signature == notary.compute_signature(nb)
+    assert notary.check_signature(nb)
+
+    # autosave of unchanged content doesn't touch the db again.
+    # check_cells pops the trusted flags, so mark again like a client would.
+    notary.mark_cells(nb, True)
+    with mock.patch.object(notary.store, 'store_signature') as store_signature:
+        assert cache.check_and_sign(nb) == signature
+        assert store_signature.call_count == 0
+
+    with mock.patch.object(notary.store, 'check_signature') as check_signature:
+        assert cache.check_signature(nb, digest=digest) is True
+        assert check_signature.call_count == 0
+
+    # digest hit skips the hmac entirely
+    with mock.patch.object(notary, 'compute_signature') as compute_signature:
+        assert cache.check_signature(nb, digest=digest) is True
+        assert compute_signature.call_count == 0
+
+    stats = cache.stats()
+    assert stats['db_stores'] == 1
+    assert stats['hits'] == 3
+    assert 0 < cache.hit_rate < 1
+
+
+def test_trust_cache_lru():
+    notary = make_notary()
+    cache = TrustCache(notary, maxsize=2)
+    for i in range(3):
+        nb = make_notebook()
+        nb.metadata['i'] = i
+        notary.sign(nb)
+        cache.check_signature(nb, digest=str(i))
+    # each check stores a digest and a signature key
+    assert cache.stats()['size'] == 2
+
+
+def test_trust_cache_untrusted_not_kept():
+    notary = make_notary()
+    cache = TrustCache(notary)
+    nb = make_notebook()
+    assert cache.check_signature(nb, digest='abc') is False
+    assert cache.stats()['size'] == 0
+
+    # trusted elsewhere, e.g. ContentsManager.trust_notebook with its own notary
+    other = sign.NotebookNotary(db_file=':memory:', secret=b'nbx secret')
+    other.store = notary.store
+    other.sign(nb)
+    assert cache.check_signature(nb, digest='abc') is True
+    assert cache.digest_trusted('abc')
+
+
+def test_trust_cache_ttl():
+    notary = make_notary()
+    now = [0.0]
+    cache = TrustCache(notary, ttl=60, clock=lambda: now[0])
+    nb = make_notebook()
+    notary.sign(nb)
+    signature = notary.compute_signature(nb)
+    assert cache.check_signature(nb, digest='abc') is True
+
+    with mock.patch.object(notary.store, 'check_signature') as check_signature:
+        now[0] = 59
+        assert cache.check_signature(nb, digest='abc') is True
+        assert check_signature.call_count == 0
+
+    # revoked. still trusted from cache until the entries expire
+    notary.store.remove_signature(signature, notary.algorithm)
+    assert cache.check_signature(nb, digest='abc') is True
+    now[0] = 61
+    assert cache.check_signature(nb, digest='abc') is False
+    assert not cache.digest_trusted('abc')
+
+    # expired entries go back to the db, which keeps last_seen current
+    notary.sign(nb)
+    now[0] = 200
+    with mock.patch.object(notary.store, 'check_signature') as check_signature:
+        check_signature.return_value = True
+        assert cache.check_signature(nb, digest='abc') is True
+        now[0] = 300
+        assert cache.check_signature(nb, digest='abc') is True
+        assert check_signature.call_count == 2
+
+
+def test_notebook_model_trust():
+    with TempDir() as td:
+        nb_file = td.joinpath('example.ipynb')
+        nb = make_notebook()
+        with nb_file.open('w') as f:
+            nbformat.write(nb, f)
+
+        model = NotebookModel.from_filepath(nb_file, root_dir=td)
+        assert model.content.cells[0].metadata.trusted is False
+
+
+def test_shared_signature_store_threads():
+    notary = share_notary_store(make_notary())
+    assert isinstance(notary.store, SharedSignatureStore)
+    cache = TrustCache(notary)
+    nb = make_notebook()
+    notary.mark_cells(nb, True)
+
+    def sign_and_check(i):
+        # distinct notebooks so every call hits the db
+        nb_i = make_notebook()
+        nb_i.cells[0].source = f'{i} + 1'
+        notary.mark_cells(nb_i, True)
+        cache.check_and_sign(nb_i)
+        return notary.store.check_signature(notary.compute_signature(nb_i), notary.algorithm)
+
+    # the store was opened on this thread
+    cache.check_and_sign(nb)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert all(executor.map(sign_and_check, range(20)))
+    assert cache.stats()['db_stores'] == 21
+
+    with TempDir() as td:
+        notary = share_notary_store(sign.NotebookNotary(
+            db_file=str(td.joinpath('nbsignatures.db')),
+            secret=b'nbx secret',
+        ))
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(notary.store.store_signature, 'abc', 'sha256').result()
+        assert notary.store.check_signature('abc', 'sha256')
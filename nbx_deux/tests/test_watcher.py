@@ -0,0 +1,132 @@
+import errno
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from nbx_deux.testing import TempDir
+from ..watcher import (
+    CREATED,
+    DELETED,
+    MODIFIED,
+    MOVED,
+    UNWATCHED,
+    InotifyWatcher,
+    PollingWatcher,
+    inotify_available,
+)
+
+
+def stage_tree(td):
+    td.joinpath('subdir/deeper').mkdir(parents=True)
+    td.joinpath('subdir/deeper/a.txt').write_text('a')
+    td.joinpath('b.txt').write_text('b')
+
+
+def change_tree(td):
+    td.joinpath('b.txt').write_text('bb')
+    td.joinpath('c.txt').write_text('c')
+    os.rename(td.joinpath('subdir'), td.joinpath('moved'))
+    td.joinpath('moved/deeper/a.txt').unlink()
+
+
+def summarize(events, td):
+    return {
+        (e.kind, os.path.relpath(e.path, td), e.src_path and os.path.relpath(e.src_path, td))
+        for e in events
+    }
+
+
+def test_polling_watcher():
+    with TempDir() as td:
+        stage_tree(td)
+        batches = []
+        watcher = PollingWatcher(td, batches.append, interval=3600)
+        watcher.start()
+        try:
+            assert watcher.poll() == []
+            change_tree(td)
+            events = watcher.poll()
+        finally:
+            watcher.stop()
+
+        # children of the moved dir aren't reported on their own. a.txt was
+        # never seen under its new path.
+        assert summarize(events, td) == {
+            (MODIFIED, 'b.txt', None),
+            (CREATED, 'c.txt', None),
+            (MOVED, 'moved', 'subdir'),
+            (DELETED, 'subdir/deeper/a.txt', None),
+        }
+        assert batches == [events]
+        assert not watcher.running
+
+
+@pytest.mark.skipif(not inotify_available(), reason="needs inotify")
+def test_inotify_watcher():
+    with TempDir() as td:
+        stage_tree(td)
+        events = []
+        cond = threading.Condition()
+
+        def callback(batch):
+            with cond:
+                events.extend(batch)
+                cond.notify_all()
+
+        def wait_for(kind, name):
+            with cond:
+                return cond.wait_for(
+                    lambda: any(e.kind == kind and e.path.endswith(name) for e in events),
+                    timeout=5,
+                )
+
+        watcher = InotifyWatcher(td, callback)
+        watcher.start()
+        try:
+            change_tree(td)
+            # new directories are watched as they show up
+            td.joinpath('new/inner').mkdir(parents=True)
+            assert wait_for(CREATED, 'inner')
+            td.joinpath('new/inner/d.txt').write_text('d')
+            td.joinpath('new/inner/d.txt').unlink()
+            assert wait_for(DELETED, 'd.txt')
+        finally:
+            watcher.stop(timeout=5)
+
+        seen = summarize(events, td)
+        assert (MODIFIED, 'b.txt', None) in seen
+        assert (CREATED, 'c.txt', None) in seen
+        assert (MOVED, 'moved', 'subdir') in seen
+        # the moved watch follows the directory
+        assert (DELETED, 'moved/deeper/a.txt', None) in seen
+        assert (DELETED, 'new/inner/d.txt', None) in seen
+        assert not watcher.running
+
+
+@pytest.mark.skipif(not inotify_available(), reason="needs inotify")
+def test_inotify_watcher_out_of_watches():
+    with TempDir() as td:
+        events = []
+        cond = threading.Condition()
+
+        def callback(batch):
+            with cond:
+                events.extend(batch)
+                cond.notify_all()
+
+        watcher = InotifyWatcher(td, callback)
+        watcher.start()
+        try:
+            assert watcher.complete
+            out_of_watches = OSError(errno.ENOSPC, "No space left on device")
+            with mock.patch.object(watcher, '_add_watch', side_effect=out_of_watches):
+                td.joinpath('new').mkdir()
+                with cond:
+                    assert cond.wait_for(lambda: any(e.kind == UNWATCHED for e in events), 5)
+        finally:
+            watcher.stop(timeout=5)
+
+        assert (UNWATCHED, 'new', None) in summarize(events, td)
+        assert not watcher.complete
@@ -0,0 +1,208 @@
+"""
+In-process cache in front of the NotebookNotary.
+
+Every notebook read checks the signature db and every save signs. For a large
+notebook that is reopened and autosaved over and over, that means repeatedly
+HMACing the whole document and hitting sqlite for an answer we already have.
+
+Results are cached under two kinds of keys:
+    ('digest', <hash of the file bytes>): skips both the HMAC and the db
+    ('signature', <notary hmac>): skips the db
+
+Only trusted results are kept. A notebook can become trusted behind our back,
+e.g. `jupyter trust` or ContentsManager.trust_notebook signing into the same db
+through another notary, and a cached False would hide that until restart.
+
+Entries expire after ttl seconds and the next check goes back to the db. The db
+check is what bumps a signature's last_seen, so without this the notebooks we
+answer from cache the most would look unused and be the first that cull_db
+evicts. It also bounds how long a revoked signature (remove_signature, or a
+`jupyter trust` change from another process) is still reported as trusted here:
+up to ttl seconds after the revocation.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from nbformat import sign
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def chunks_digest(chunks) -> str:
+    """content_digest(b''.join(chunks)) without the join."""
+    h = hashlib.blake2b(digest_size=20)
+    for chunk in chunks:
+        h.update(chunk)
+    return h.hexdigest()
+
+
+class SharedSignatureStore(sign.SQLiteSignatureStore):
+    """
+    SQLiteSignatureStore that can be used from worker threads. sqlite3 ties a
+    connection to the thread that opened it unless told otherwise, so the
+    connection is reopened with check_same_thread=False and calls are
+    serialized.
+    """
+    def __init__(self, db_file, **kwargs):
+        self._db_lock = threading.RLock()
+        super().__init__(db_file, **kwargs)
+
+    def _connect_db(self, db_file):
+        # nbformat deals with a corrupt / unwritable db. reopen what it settled on.
+        db = super()._connect_db(db_file)
+        db.close()
+        db = sqlite3.connect(
+            self.db_file,
+            detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
+            check_same_thread=False,
+        )
+        self.init_db(db)
+        return db
+
+    def store_signature(self, digest, algorithm):
+        with self._db_lock:
+            return super().store_signature(digest, algorithm)
+
+    def check_signature(self, digest, algorithm):
+        with self._db_lock:
+            return super().check_signature(digest, algorithm)
+
+    def remove_signature(self, digest, algorithm):
+        with self._db_lock:
+            return super().remove_signature(digest, algorithm)
+
+    def cull_db(self):
+        with self._db_lock:
+            return super().cull_db()
+
+    def close(self):
+        with self._db_lock:
+            return super().close()
+
+
+def share_notary_store(notary: sign.NotebookNotary):
+    """Swap the notary's sqlite store for a SharedSignatureStore."""
+    store = notary.store
+    if type(store) is sign.SQLiteSignatureStore:
+        store.close()
+        notary.store = SharedSignatureStore(store.db_file)
+    return notary
+
+
+class TrustCache:
+    def __init__(self, notary: sign.NotebookNotary, maxsize=1024, ttl=300, clock=time.monotonic):
+        self.notary = notary
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.db_checks = 0
+        self.db_stores = 0
+        # key -> (trusted, cached at)
+        self._cache: OrderedDict[tuple[str, str], tuple[bool, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            trusted, cached_at = entry
+            if self.clock() - cached_at > self.ttl:
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return trusted
+
+    def _put(self, key, trusted):
+        with self._lock:
+            self._cache[key] = (trusted, self.clock())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def check_signature(self, nb, digest=None) -> bool:
+        """
+        NotebookNotary.check_signature with caching.
+
+        digest: content_digest of the bytes nb was read from.
+        """
+        if digest is not None:
+            trusted = self._get(('digest', digest))
+            if trusted is not None:
+                self.hits += 1
+                return trusted
+
+        if nb.nbformat < 3:
+            return False
+
+        signature = self.notary.compute_signature(nb)
+        trusted = self._get(('signature', signature))
+        if trusted is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.db_checks += 1
+            trusted = self.notary.store.check_signature(signature, self.notary.algorithm)
+            if trusted:
+                self._put(('signature', signature), trusted)
+
+        if trusted and digest is not None:
+            self._put(('digest', digest), trusted)
+        return trusted
+
+    def check_and_sign(self, nb):
+        """
+        Sign nb if all its cells are trusted. Returns the signature or None.
+
+        The signature is computed once and only written to the db if we don't
+        already know it is stored.
+        """
+        if not self.notary.check_cells(nb):
+            return None
+
+        signature = self.notary.compute_signature(nb)
+        key = ('signature', signature)
+        if self._get(key) is True:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.db_stores += 1
+            self.notary.store.store_signature(signature, self.notary.algorithm)
+            self._put(key, True)
+        return signature
+
+    def digest_trusted(self, digest) -> bool:
+        return self._get(('digest', digest)) is True
+
+    def seed(self, digest, trusted):
+        """Record the trust of bytes we wrote ourselves."""
+        if trusted:
+            self._put(('digest', digest), trusted)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return self.hits / total
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'db_checks': self.db_checks,
+            'db_stores': self.db_stores,
+            'size': len(self._cache),
+        }
@@ -0,0 +1,458 @@
+"""
+Change feeds for a directory tree.
+
+ListingCache and BundleIndex revalidate against the filesystem with a stat per
+request, and nothing notices a notebook edited in place by another process.
+A watcher tells them when something under a root changes instead.
+
+InotifyWatcher talks to inotify through ctypes so no extra dependency is
+needed. Every directory in the tree gets a watch and new directories are
+picked up as they appear. Where inotify isn't available (not linux, out of
+watches) PollingWatcher rescans the tree on an interval and diffs the stats.
+
+Either way the callback is called on the watcher thread with a list of
+ChangeEvents. Delivery is asynchronous: a change is reported a few ms after it
+happens with inotify, up to one interval later when polling.
+"""
+import ctypes
+import ctypes.util
+import dataclasses as dc
+import errno
+import logging
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+from functools import lru_cache
+
+WATCH_BACKENDS = ('off', 'auto', 'inotify', 'poll')
+
+CREATED = 'created'
+MODIFIED = 'modified'
+DELETED = 'deleted'
+MOVED = 'moved'
+# the kernel dropped events. anything under the root may have changed.
+OVERFLOW = 'overflow'
+# a new directory couldn't be watched (out of watches, EACCES). changes under
+# it won't be reported from now on.
+UNWATCHED = 'unwatched'
+
+
+@dc.dataclass(frozen=True, slots=True)
+class ChangeEvent:
+    kind: str
+    path: str
+    is_dir: bool = False
+    # where a MOVED path came from
+    src_path: str | None = None
+
+
+class Watcher:
+    backend = ''
+
+    def __init__(self, root, callback, log=None):
+        self.root = os.path.abspath(str(root))
+        self.callback = callback
+        self.log = log or logging.getLogger(__name__)
+        self.batches = 0
+        self.events = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._setup()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f'nbx-watch-{self.backend}',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._teardown()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _dispatch(self, events):
+        if not events:
+            return
+        self.batches += 1
+        self.events += len(events)
+        try:
+            self.callback(events)
+        except Exception:
+            self.log.exception("Watch callback failed for %s", self.root)
+
+    def _setup(self):
+        pass
+
+    def _teardown(self):
+        pass
+
+    def _wakeup(self):
+        pass
+
+    def _run(self):
+        raise NotImplementedError()
+
+
+# inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# IN_CLOSE_WRITE instead of IN_MODIFY so a large write is one event, not one
+# per write() call.
+WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+    | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+
+# struct inotify_event {int wd; uint32_t mask, cookie, len; char name[];}
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+@lru_cache(maxsize=1)
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def inotify_available():
+    return _load_libc() is not None
+
+
+def _errno_error(path=None):
+    err = ctypes.get_errno()
+    return OSError(err, os.strerror(err), path)
+
+
+class InotifyWatcher(Watcher):
+    backend = 'inotify'
+
+    def __init__(self, root, callback, log=None, latency=0.02):
+        super().__init__(root, callback, log=log)
+        # how long to let a burst of events pile up before dispatching
+        self.latency = latency
+        self._libc = None
+        self._fd = None
+        self._pipe = None
+        self._wds: dict[int, str] = {}
+        # False once some directory in the tree went unwatched
+        self.complete = True
+
+    def _setup(self):
+        libc = _load_libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if fd < 0:
+            raise _errno_error()
+        self._libc = libc
+        self._fd = fd
+        self._pipe = os.pipe()
+        try:
+            self._watch_tree(self.root)
+        except OSError:
+            self._teardown()
+            raise
+
+    def _teardown(self):
+        fds = [self._fd] + list(self._pipe or [])
+        self._fd = None
+        self._pipe = None
+        for fd in fds:
+            if fd is not None:
+                os.close(fd)
+
+    def _wakeup(self):
+        if self._pipe is not None:
+            os.write(self._pipe[1], b'x')
+
+    @property
+    def watch_count(self):
+        return len(self._wds)
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # gone, or replaced by a file, before we got to it
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise _errno_error(path)
+        self._wds[wd] = path
+
+    def _watch_tree(self, top, events=None):
+        """
+        Watch top and every directory below it. events collects CREATED for
+        whatever is already inside, which happened before we were watching.
+        """
+        self._add_watch(top)
+        for dirpath, dirnames, filenames in os.walk(top):
+            for name in dirnames:
+                path = os.path.join(dirpath, name)
+                self._add_watch(path)
+                if events is not None:
+                    events.append(ChangeEvent(CREATED, path, is_dir=True))
+            if events is not None:
+                events.extend(
+                    ChangeEvent(CREATED, os.path.join(dirpath, name)) for name in filenames
+                )
+
+    def _watch_new_dir(self, top):
+        events = []
+        try:
+            self._watch_tree(top, events)
+        except OSError:
+            self.log.warning("Unable to watch %s", top, exc_info=True)
+            self.complete = False
+            events.append(ChangeEvent(UNWATCHED, top, is_dir=True))
+        return events
+
+    def _rename_watches(self, src, dest):
+        prefix = src + os.sep
+        for wd, path in self._wds.items():
+            if path == src or path.startswith(prefix):
+                self._wds[wd] = dest + path[len(src):]
+
+    def _drop_watches(self, top):
+        prefix = top + os.sep
+        for wd, path in list(self._wds.items()):
+            if path == top or path.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                self._wds.pop(wd, None)
+
+    def _read(self):
+        chunks = []
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            chunks.append(data)
+        return b''.join(chunks)
+
+    def _run(self):
+        stop_fd = self._pipe[0]
+        while not self._stop.is_set():
+            try:
+                ready, _, _ = select.select([self._fd, stop_fd], [], [])
+            except (OSError, ValueError):
+                return
+            if stop_fd in ready or self._stop.wait(self.latency):
+                return
+            try:
+                data = self._read()
+            except OSError:
+                self.log.exception("Reading inotify events for %s failed", self.root)
+                return
+            self._dispatch(self.parse(data))
+
+    def parse(self, data: bytes) -> list[ChangeEvent]:
+        events = []
+        # cookie -> index of the IN_MOVED_FROM half in events
+        moves = {}
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                events.append(ChangeEvent(OVERFLOW, self.root, is_dir=True))
+                continue
+            if mask & IN_IGNORED:
+                self._wds.pop(wd, None)
+                continue
+            parent = self._wds.get(wd)
+            if parent is None:
+                continue
+
+            path = os.path.join(parent, name) if name else parent
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & IN_MOVED_FROM:
+                moves[cookie] = len(events)
+                events.append(ChangeEvent(DELETED, path, is_dir))
+            elif mask & IN_MOVED_TO:
+                index = moves.pop(cookie, None)
+                if index is not None:
+                    src = events[index].path
+                    events[index] = ChangeEvent(MOVED, path, is_dir, src_path=src)
+                    if is_dir:
+                        self._rename_watches(src, path)
+                else:
+                    events.append(ChangeEvent(CREATED, path, is_dir))
+                    if is_dir:
+                        events.extend(self._watch_new_dir(path))
+            elif mask & IN_CREATE:
+                events.append(ChangeEvent(CREATED, path, is_dir))
+                if is_dir:
+                    events.extend(self._watch_new_dir(path))
+            elif mask & IN_DELETE:
+                events.append(ChangeEvent(DELETED, path, is_dir))
+            elif mask & (IN_CLOSE_WRITE | IN_ATTRIB):
+                events.append(ChangeEvent(MODIFIED, path, is_dir))
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # subdirectories are reported by their parent's watch
+                if path == self.root:
+                    events.append(ChangeEvent(DELETED, path, is_dir=True))
+
+        # directories moved out of the tree keep reporting under the old path
+        for index in moves.values():
+            if events[index].is_dir:
+                self._drop_watches(events[index].path)
+        return events
+
+
+def snapshot_tree(root) -> dict[str, tuple]:
+    """
+    {path: (inode, mtime_ns, ctime_ns, size, is_dir)} for everything under root.
+    Symlinks are recorded, not followed.
+    """
+    snapshot = {}
+    stack = [str(root)]
+    while stack:
+        top = stack.pop()
+        try:
+            it = os.scandir(top)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                is_dir = stat.S_ISDIR(st.st_mode)
+                snapshot[entry.path] = (
+                    st.st_ino, st.st_mtime_ns, st.st_ctime_ns, st.st_size, is_dir,
+                )
+                if is_dir:
+                    stack.append(entry.path)
+    return snapshot
+
+
+def _under(path, top):
+    return path.startswith(top + os.sep)
+
+
+def diff_snapshots(old, new) -> list[ChangeEvent]:
+    """
+    Events that turn old into new. A path that vanished while another with the
+    same inode appeared is reported as a move. The children of a moved
+    directory are not reported on their own.
+    """
+    deleted = old.keys() - new.keys()
+    by_inode = {(old[path][0], old[path][4]): path for path in deleted}
+
+    events = []
+    moved_dirs = []
+    # sorted so a directory comes before its children
+    for path in sorted(new.keys() - old.keys()):
+        ino, _, _, _, is_dir = new[path]
+        src = by_inode.pop((ino, is_dir), None)
+        if src is None:
+            events.append(ChangeEvent(CREATED, path, is_dir))
+            continue
+        deleted.discard(src)
+        if any(_under(path, dest) and _under(src, moved) for moved, dest in moved_dirs):
+            continue
+        events.append(ChangeEvent(MOVED, path, is_dir, src_path=src))
+        if is_dir:
+            moved_dirs.append((src, path))
+
+    for path in sorted(deleted):
+        events.append(ChangeEvent(DELETED, path, old[path][4]))
+
+    for path in sorted(old.keys() & new.keys()):
+        before, after = old[path], new[path]
+        # directory mtimes only move when children come and go, which is
+        # already reported
+        if before != after and not (before[4] and after[4] and before[0] == after[0]):
+            events.append(ChangeEvent(MODIFIED, path, after[4]))
+    return events
+
+
+class PollingWatcher(Watcher):
+    backend = 'poll'
+
+    def __init__(self, root, callback, log=None, interval=1.0):
+        super().__init__(root, callback, log=log)
+        self.interval = interval
+        self._snapshot = {}
+        self._lock = threading.Lock()
+
+    def _setup(self):
+        self._snapshot = snapshot_tree(self.root)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def poll(self) -> list[ChangeEvent]:
+        """
+        Rescan now and dispatch whatever changed.
+        """
+        with self._lock:
+            snapshot = snapshot_tree(self.root)
+            events = diff_snapshots(self._snapshot, snapshot)
+            self._snapshot = snapshot
+        self._dispatch(events)
+        return events
+
+
+def make_watcher(root, callback, backend='auto', interval=1.0, log=None) -> Watcher:
+    """
+    Start a watcher on root. 'auto' uses inotify when it can and polls every
+    interval seconds when it can't.
+    """
+    if backend not in WATCH_BACKENDS or backend == 'off':
+        raise Exception(f"Unknown watch backend {backend!r}")
+
+    log = log or logging.getLogger(__name__)
+    if backend in ('auto', 'inotify'):
+        watcher = InotifyWatcher(root, callback, log=log)
+        try:
+            watcher.start()
+            return watcher
+        except OSError:
+            if backend == 'inotify':
+                raise
+            log.warning(
+                "inotify unavailable for %s, polling every %ss", root, interval, exc_info=True,
+            )
+
+    watcher = PollingWatcher(root, callback, log=log, interval=interval)
+    watcher.start()
+    return watcher